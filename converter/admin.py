@@ -1,5 +1,21 @@
+from celery import current_app
 from django.contrib import admin
-from .models import FileFormat, FormatConversion, ConverterMap
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import (
+    FileFormat,
+    FormatConversion,
+    EncodingProfile,
+    ConverterMap,
+    ProfilingRule,
+    ConversionProfile,
+    ConversionJob,
+    ConversionRollup,
+    WebhookFailure,
+)
+from .utils.webhooks import DELIVER_TASK
 
 
 @admin.register(FileFormat)
@@ -9,6 +25,11 @@ class FileFormatAdmin(admin.ModelAdmin):
     search_fields = ("name",)
 
 
+class EncodingProfileInline(admin.TabularInline):
+    model = EncodingProfile
+    extra = 0
+
+
 @admin.register(FormatConversion)
 class FormatConversionAdmin(admin.ModelAdmin):
     list_display = (
@@ -18,8 +39,9 @@ class FormatConversionAdmin(admin.ModelAdmin):
         "video_codec",
         "audio_video_codec",
         "audio_codec",
+        "inline",
     )
-    list_filter = ("engine", "input_format__file_type")
+    list_filter = ("engine", "inline", "input_format__file_type")
     search_fields = (
         "input_format__name",
         "output_format__name",
@@ -28,6 +50,7 @@ class FormatConversionAdmin(admin.ModelAdmin):
         "engine",
     )
     autocomplete_fields = ("input_format", "output_format")
+    inlines = (EncodingProfileInline,)
 
 
 @admin.register(ConverterMap)
@@ -35,3 +58,162 @@ class ConverterMapAdmin(admin.ModelAdmin):
     list_display = ("format_type", "class_path")
     list_filter = ("format_type",)
     search_fields = ("class_path",)
+
+
+@admin.register(ProfilingRule)
+class ProfilingRuleAdmin(admin.ModelAdmin):
+    list_display = (
+        "__str__",
+        "input_format",
+        "output_format",
+        "sample_rate",
+        "mode",
+        "enabled",
+    )
+    list_filter = ("enabled", "mode")
+    list_editable = ("sample_rate", "mode", "enabled")
+    autocomplete_fields = ("input_format", "output_format")
+
+
+@admin.register(ConversionProfile)
+class ConversionProfileAdmin(admin.ModelAdmin):
+    list_display = (
+        "token",
+        "input_format",
+        "output_format",
+        "engine",
+        "mode",
+        "duration",
+        "succeeded",
+        "created_at",
+        "download_link",
+    )
+    list_filter = ("mode", "succeeded", "engine", "input_format", "output_format")
+    search_fields = ("token", "task_id")
+    exclude = ("data",)
+    readonly_fields = (
+        "token",
+        "task_id",
+        "input_format",
+        "output_format",
+        "engine",
+        "mode",
+        "duration",
+        "succeeded",
+        "created_at",
+        "download_link",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path(
+                "<int:pk>/download/",
+                self.admin_site.admin_view(self.download_view),
+                name="converter_conversionprofile_download",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    @admin.display(description="Profile")
+    def download_link(self, obj):
+        url = reverse("admin:converter_conversionprofile_download", args=[obj.pk])
+        return format_html('<a href="{}">{}</a>', url, obj.filename)
+
+    def download_view(self, request, pk):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(ConversionProfile, pk=pk)
+        response = HttpResponse(
+            bytes(profile.data), content_type="application/octet-stream"
+        )
+        response["Content-Disposition"] = f'attachment; filename="{profile.filename}"'
+        return response
+
+
+@admin.register(ConversionJob)
+class ConversionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "finished_at",
+        "input_format",
+        "output_format",
+        "engine",
+        "outcome",
+        "input_size",
+        "output_size",
+        "queue_wait",
+        "service_time",
+        "user",
+        "api_key",
+    )
+    list_filter = ("outcome", "format_type", "engine", "input_format", "output_format")
+    search_fields = ("token", "task_id", "user__username")
+    date_hierarchy = "finished_at"
+    ordering = ("-finished_at",)
+    list_select_related = ("user", "api_key")
+    readonly_fields = [field.name for field in ConversionJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ConversionRollup)
+class ConversionRollupAdmin(admin.ModelAdmin):
+    list_display = (
+        "day",
+        "input_format",
+        "output_format",
+        "engine",
+        "jobs",
+        "failures",
+        "busy_time",
+        "service_p50",
+        "service_p95",
+        "service_p99",
+        "service_max",
+        "queue_wait_p50",
+        "queue_wait_p95",
+    )
+    list_filter = ("format_type", "engine", "input_format", "output_format")
+    date_hierarchy = "day"
+    ordering = ("-day", "-busy_time")
+    readonly_fields = [field.name for field in ConversionRollup._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(WebhookFailure)
+class WebhookFailureAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "url", "token", "api_key", "attempts", "last_error")
+    search_fields = ("token", "url")
+    date_hierarchy = "created_at"
+    ordering = ("-created_at",)
+    list_select_related = ("api_key",)
+    readonly_fields = [field.name for field in WebhookFailure._meta.fields]
+    actions = ("redeliver",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description="Redeliver selected callbacks")
+    def redeliver(self, request, queryset):
+        # fresh attempts, a failure that persists is dead-lettered again
+        failures = list(queryset)
+        for failure in failures:
+            current_app.send_task(
+                DELIVER_TASK, (failure.token, failure.hook, failure.result)
+            )
+        queryset.filter(pk__in=[failure.pk for failure in failures]).delete()
+        self.message_user(request, f"{len(failures)} callback(s) queued")
@@ -1,5 +1,10 @@
 from django.urls import path
-from .views import AsyncConvertView, ResultsConvertView
+from .views import (
+    AsyncConvertView,
+    CancelConvertView,
+    PreviewView,
+    ResultsConvertView,
+)
 
 
 app_name = "converter_api"
@@ -7,4 +12,6 @@ app_name = "converter_api"
 urlpatterns = [
     path("convert/", AsyncConvertView.as_view(), name="convert"),
     path("result/<str:token>/", ResultsConvertView.as_view(), name="result"),
+    path("cancel/<str:token>/", CancelConvertView.as_view(), name="cancel"),
+    path("preview/", PreviewView.as_view(), name="preview"),
 ]
@@ -1,13 +1,29 @@
 import os
-from django.http import FileResponse
-from rest_framework.views import APIView
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.utils.cache import patch_vary_headers
+from adrf.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
-from ..tasks import convert_task
-import secrets
+from asgiref.sync import sync_to_async
 from rest_framework.response import Response
-from django.conf import settings
 import mimetypes
-from ..utils.redis_ext_client import redis_client
+from ..utils.redis_ext_client import get_async_redis
+from ..utils.async_files import read_uploaded_file
+from ..utils.submission import convert_inline, submit_conversions, Rejected
+from ..utils.previews import get_preview, preview_size
+from ..utils.errors import ConversionError, EngineUnavailable, PreviewUnavailable
+from ..utils.compression import split_encoding, accepts, decompress_file
+from ..utils.storage import get_result_storage
+from ..utils.followers import async_result_token
+from ..utils.formats import normalize_format
+from ..utils.cancellation import cancel, was_cancelled, FINISHED
+from ..utils.webhooks import callback, validate_callback_url
+from django.core.exceptions import ValidationError
+from django.utils.http import content_disposition_header
 from rest_framework.permissions import IsAuthenticated
 
 
@@ -15,41 +31,170 @@ class AsyncConvertView(APIView):
     parser_classes = [MultiPartParser, FormParser]
     permission_classes = [IsAuthenticated]
 
-    def post(self, request):
-        file = request.FILES.get("file")
-        output_format = request.data.get("output_format")
+    async def post(self, request):
+        # multipart parsing may spool large uploads to disk
+        data, files = await sync_to_async(
+            lambda: (request.data, request.FILES), thread_sensitive=False
+        )()
+        file = files.get("file")
+        # repeated or comma separated, several targets share one decode
+        output_formats = [
+            output_format
+            for value in data.getlist("output_format")
+            for output_format in value.split(",")
+            if output_format
+        ]
 
         if not file:
             return Response({"error": "No uploaded file found"}, status=400)
+        if not output_formats:
+            return Response({"error": "No output format given"}, status=400)
+
+        callback_url = data.get("callback_url")
+        hook = None
+        if callback_url:
+            # the API key signs the callback, a session has nothing to sign with
+            if request.auth is None:
+                return Response(
+                    {"error": "Callbacks need API key authentication"}, status=400
+                )
+            try:
+                validate_callback_url(callback_url)
+            except ValidationError:
+                return Response({"error": "Invalid callback URL"}, status=400)
+            hook = callback(
+                callback_url, request.auth.pk, request.build_absolute_uri("/")
+            )
+
+        file_bin = await read_uploaded_file(file)
+        # detected from the content when the name has no extension
+        input_format = file.name.rsplit(".", 1)[-1].lower() if "." in file.name else ""
+        trim = {name: data.get(name) for name in ("start", "end", "max_duration")}
+        # opt in, the result comes back in the response instead of a token
+        sync = str(data.get("sync", "")).lower() in ("1", "true")
+        try:
+            if (
+                sync
+                and len(output_formats) == 1
+                and not hook
+                and not any(trim.values())
+            ):
+                result = await convert_inline(
+                    file_bin,
+                    input_format,
+                    output_formats[0],
+                    data.get("profile"),
+                    user_id=request.user.pk,
+                    api_key_id=getattr(request.auth, "pk", None),
+                )
+                if result is not None:
+                    return self._file_response(result, file.name, output_formats[0])
+            tokens = await submit_conversions(
+                file_bin,
+                input_format,
+                output_formats,
+                user_id=request.user.pk,
+                api_key_id=getattr(request.auth, "pk", None),
+                callback=hook,
+                profile=data.get("profile"),
+                **trim,
+            )
+        except Rejected as e:
+            return Response({"error": str(e)}, status=e.status)
+
+        if len(tokens) == 1:
+            return Response({"result token": next(iter(tokens.values()))}, status=202)
+        return Response({"result tokens": tokens}, status=202)
+
+    def _file_response(self, result, name, output_format):
+        extension = normalize_format(output_format.lower())
+        filename = f"{os.path.splitext(name)[0]}.{extension}"
+        mime_type, _ = mimetypes.guess_type(filename)
+        response = HttpResponse(
+            result, content_type=mime_type or "application/octet-stream"
+        )
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+        return response
 
-        file_bin = file.read()
-        input_format = file.name.rsplit(".", 1)[-1].lower()
-        token = secrets.token_urlsafe(16)
 
-        convert_task.delay(file_bin, input_format, output_format, token)
-        redis_client.setex(f"conv:{token}", settings.FILE_TTL, token)
+class PreviewView(APIView):
+    parser_classes = [MultiPartParser, FormParser]
+    permission_classes = [IsAuthenticated]
+
+    async def post(self, request):
+        data, files = await sync_to_async(
+            lambda: (request.data, request.FILES), thread_sensitive=False
+        )()
+        file = files.get("file")
+        if not file:
+            return Response({"error": "No uploaded file found"}, status=400)
 
-        return Response({"result token": token}, status=202)
+        file_bin = await read_uploaded_file(file)
+        input_format = file.name.rsplit(".", 1)[-1].lower()
+        size = preview_size(data.get("size"))
+        try:
+            preview = await get_preview(file_bin, input_format, size)
+        except PreviewUnavailable as e:
+            return Response({"error": str(e)}, status=400)
+        except EngineUnavailable as e:
+            return Response({"error": str(e)}, status=503)
+        except ConversionError as e:
+            return Response({"error": str(e)}, status=422)
+        return HttpResponse(preview, content_type="image/jpeg")
 
 
 class ResultsConvertView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def get(self, request, token):
+    async def get(self, request, token):
         try:
-            for file in os.listdir(settings.TEMP_DIR):
-                if file.startswith(token):
-                    path = os.path.join(settings.TEMP_DIR, file)
-                    if os.path.isfile(path):
-                        mime_type, _ = mimetypes.guess_type(file)
-                        return FileResponse(
-                            open(path, "rb"),
-                            as_attachment=True,
-                            filename=file,
-                            content_type=mime_type or "application/octet-stream",
-                        )
-
-            task_id = redis_client.get(f"conv:{token}")
+            name = await get_async_redis().get(
+                f"path:{await async_result_token(token)}"
+            )
+            stat = None
+            if name:
+                # older entries hold a full local path
+                name = os.path.basename(name.decode())
+                storage = get_result_storage()
+                stat = await sync_to_async(storage.stat, thread_sensitive=False)(name)
+            if stat:
+                file, encoding = split_encoding(name)
+                decode = encoding and not accepts(
+                    request.headers.get("Accept-Encoding", ""), encoding
+                )
+                if not decode:
+                    url = await sync_to_async(storage.url, thread_sensitive=False)(
+                        name, file
+                    )
+                    if url:
+                        return HttpResponseRedirect(url)
+
+                # sync iterators like the download view, the project is served
+                # over wsgi, which would buffer an async one whole
+                f = await sync_to_async(storage.open, thread_sensitive=False)(name)
+                if decode:
+                    # the client can't decode it, inflate while sending
+                    mime_type, _ = mimetypes.guess_type(file)
+                    response = StreamingHttpResponse(
+                        decompress_file(f, encoding),
+                        content_type=mime_type or "application/octet-stream",
+                    )
+                    response["Content-Disposition"] = content_disposition_header(
+                        True, file
+                    )
+                else:
+                    response = FileResponse(f, as_attachment=True, filename=file)
+                    # object store bodies are not seekable
+                    response.setdefault("Content-Length", stat[0])
+                    if encoding:
+                        response["Content-Encoding"] = encoding
+                if encoding:
+                    patch_vary_headers(response, ("Accept-Encoding",))
+                return response
+
+            task_id = await get_async_redis().get(f"conv:{token}")
+            if task_id and await was_cancelled(task_id.decode()):
+                return Response({"result": "Conversion cancelled"}, status=410)
             if task_id:
                 return Response({"result": "Result file not found"}, status=404)
 
@@ -57,3 +202,19 @@ class ResultsConvertView(APIView):
 
         except Exception as e:
             return Response({"result": f"Unexpected error: {str(e)}"}, status=500)
+
+
+class CancelConvertView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    async def post(self, request, token):
+        try:
+            outcome = await cancel(token)
+        except Exception as e:
+            return Response({"result": f"Unexpected error: {str(e)}"}, status=500)
+
+        if outcome is None:
+            return Response({"result": "Invalid token or no task found"}, status=404)
+        if outcome == FINISHED:
+            return Response({"result": "Conversion already finished"}, status=409)
+        return Response({"result": outcome}, status=202)
@@ -1,6 +1,14 @@
+import atexit
 from django.apps import AppConfig
 
 
 class ConverterConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
-    name = 'converter'
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "converter"
+
+    def ready(self):
+        # web and worker processes alike start here
+        from .utils.metrics import mark_current_process_dead, prune_dead_processes
+
+        prune_dead_processes()
+        atexit.register(mark_current_process_dead)
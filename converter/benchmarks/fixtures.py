@@ -0,0 +1,209 @@
+import io
+import os
+import numpy as np
+from PIL import Image
+from moviepy import AudioArrayClip, VideoClip
+from converter.models import FileFormat, FormatConversion, FormatType
+from converter.utils.converters import DocConverter, ConversionError
+
+
+IMAGE_SIZES = (256, 1024, 2048)
+AUDIO_SECONDS = (5, 30)
+VIDEO_SPECS = ((320, 240, 2), (1280, 720, 2))  # width, height, seconds
+DOC_PARAGRAPHS = (10, 200)
+
+AUDIO_FPS = 44100
+VIDEO_FPS = 24
+
+# pillow save names for formats that differ from the catalog name
+PIL_FORMATS = {"jpeg": "JPEG", "tga": "TGA", "ico": "ICO", "ppm": "PPM"}
+
+
+class Fixture:
+    def __init__(self, input_format, label, data):
+        self.input_format = input_format
+        self.label = label
+        self.data = data
+
+    @property
+    def key(self):
+        return f"{self.input_format}@{self.label}"
+
+
+def _rng():
+    # fixed seed, fixtures must be identical between runs to compare them
+    return np.random.default_rng(1234)
+
+
+def _image_pixels(size):
+    y, x = np.mgrid[0:size, 0:size]
+    noise = _rng().integers(0, 32, (size, size), dtype=np.uint8)
+    r = (x * 255 // max(size - 1, 1)).astype(np.uint8)
+    g = (y * 255 // max(size - 1, 1)).astype(np.uint8)
+    b = ((x + y) % 256).astype(np.uint8) ^ noise
+    return np.dstack([r, g, b])
+
+
+def _tone(seconds):
+    t = np.linspace(0, seconds, int(AUDIO_FPS * seconds), endpoint=False)
+    left = 0.4 * np.sin(2 * np.pi * 440 * t)
+    right = 0.4 * np.sin(2 * np.pi * 660 * t)
+    return np.column_stack([left, right])
+
+
+def _codecs_for(output_format):
+    # reuse the codecs the catalog uses to produce this container
+    conversion = (
+        FormatConversion.objects.filter(output_format__name=output_format)
+        .order_by("id")
+        .first()
+    )
+    if not conversion:
+        return None, None, None
+    return (
+        conversion.video_codec,
+        conversion.audio_video_codec,
+        conversion.audio_codec,
+    )
+
+
+def _read_and_remove(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+
+def image_fixtures(formats, sizes=IMAGE_SIZES):
+    for size in sizes:
+        img = Image.fromarray(_image_pixels(size), "RGB")
+        for fmt in formats:
+            buffer = io.BytesIO()
+            img.save(buffer, format=PIL_FORMATS.get(fmt, fmt.upper()))
+            yield Fixture(fmt, f"{size}px", buffer.getvalue())
+
+
+def audio_fixtures(formats, work_dir, seconds=AUDIO_SECONDS):
+    for duration in seconds:
+        clip = AudioArrayClip(_tone(duration), fps=AUDIO_FPS)
+        for fmt in formats:
+            _, _, codec = _codecs_for(fmt)
+            path = os.path.join(work_dir, f"fixture.{fmt}")
+            clip.write_audiofile(path, codec=codec, logger=None)
+            yield Fixture(fmt, f"{duration}s", _read_and_remove(path))
+
+
+def video_fixtures(formats, work_dir, specs=VIDEO_SPECS):
+    for width, height, duration in specs:
+
+        def frame_function(t, width=width, height=height):
+            y, x = np.mgrid[0:height, 0:width]
+            shift = int(t * VIDEO_FPS * 4)
+            frame = np.dstack([(x + shift) % 256, (y + shift) % 256, (x ^ y) % 256])
+            return frame.astype(np.uint8)
+
+        audio = AudioArrayClip(_tone(duration), fps=AUDIO_FPS)
+        clip = VideoClip(frame_function, duration=duration).with_audio(audio)
+        for fmt in formats:
+            codec, audio_codec, _ = _codecs_for(fmt)
+            path = os.path.join(work_dir, f"fixture.{fmt}")
+            clip.write_videofile(
+                path,
+                fps=VIDEO_FPS,
+                codec=codec,
+                audio_codec=audio_codec,
+                temp_audiofile_path=work_dir,
+                logger=None,
+            )
+            yield Fixture(fmt, f"{width}x{height}", _read_and_remove(path))
+
+
+def _markdown(paragraphs):
+    sections = []
+    for i in range(paragraphs):
+        if i % 10 == 0:
+            sections.append(f"## Section {i // 10 + 1}")
+        sections.append(
+            f"Paragraph {i} with *emphasis*, **strong text** and `inline code`. "
+            + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4
+        )
+        if i % 5 == 0:
+            sections.append("- first item\n- second item\n- third item")
+    return "# Benchmark document\n\n" + "\n\n".join(sections) + "\n"
+
+
+def _html(paragraphs):
+    body = []
+    for i in range(paragraphs):
+        if i % 10 == 0:
+            body.append(f"<h2>Section {i // 10 + 1}</h2>")
+        body.append(
+            f"<p>Paragraph {i} with <em>emphasis</em> and <strong>strong text</strong>. "
+            + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4
+            + "</p>"
+        )
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        "<title>Benchmark document</title></head><body>"
+        "<h1>Benchmark document</h1>" + "".join(body) + "</body></html>"
+    )
+
+
+def _latex(paragraphs):
+    body = []
+    for i in range(paragraphs):
+        if i % 10 == 0:
+            body.append(f"\\section{{Section {i // 10 + 1}}}")
+        body.append(
+            f"Paragraph {i} with \\emph{{emphasis}} and \\textbf{{strong text}}. "
+            + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4
+        )
+    return (
+        "\\documentclass{article}\n\\begin{document}\n"
+        + "\n\n".join(body)
+        + "\n\\end{document}\n"
+    )
+
+
+TEXT_DOCUMENTS = {"markdown": _markdown, "html": _html, "latex": _latex}
+
+
+def document_fixtures(formats, paragraphs=DOC_PARAGRAPHS):
+    for count in paragraphs:
+        source = _markdown(count).encode()
+        for fmt in formats:
+            if fmt in TEXT_DOCUMENTS:
+                yield Fixture(fmt, f"{count}p", TEXT_DOCUMENTS[fmt](count).encode())
+                continue
+            # binary documents are produced from markdown with our own engines
+            try:
+                data = DocConverter().convert(source, "markdown", fmt).read()
+            except (ConversionError, FormatConversion.DoesNotExist):
+                continue
+            yield Fixture(fmt, f"{count}p", data)
+
+
+def build_fixtures(format_type, formats, work_dir, quick=False, sizes=None):
+    def pick(values):
+        if sizes:
+            return sizes
+        return values[:1] if quick else values
+
+    formats = sorted(set(formats))
+    if format_type == FormatType.IMAGE:
+        return image_fixtures(formats, pick(IMAGE_SIZES))
+    if format_type == FormatType.AUDIO:
+        return audio_fixtures(formats, work_dir, pick(AUDIO_SECONDS))
+    if format_type == FormatType.VIDEO:
+        return video_fixtures(formats, work_dir, pick(VIDEO_SPECS))
+    if format_type == FormatType.DOCUMENT:
+        return document_fixtures(formats, pick(DOC_PARAGRAPHS))
+    return iter(())
+
+
+def input_formats(format_type):
+    return list(
+        FileFormat.objects.filter(file_type=format_type, conversions_from__isnull=False)
+        .distinct()
+        .values_list("name", flat=True)
+    )
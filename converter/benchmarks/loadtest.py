@@ -0,0 +1,282 @@
+import asyncio
+import math
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from unittest import mock
+import fakeredis
+import redis
+from fakeredis import aioredis as fake_aioredis
+from celery import current_app
+from celery.contrib.testing.worker import start_worker
+from celery.signals import after_task_publish, task_prerun, task_postrun
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from django.urls import reverse
+from converter.models import FileFormat, FormatType
+from converter.utils.redis_ext_client import (
+    ASYNC_POOL_OPTIONS,
+    redis_client,
+    get_async_redis,
+)
+from .fixtures import VIDEO_SPECS, build_fixtures
+
+
+DEFAULT_MIX = ("png->jpeg:1024:3", "jpeg->webp:1024:2", "png->webp:2048:1")
+PERCENTILES = (50, 95, 99)
+
+
+class JobSpec:
+    def __init__(self, input_format, output_format, size, weight):
+        self.input_format = input_format
+        self.output_format = output_format
+        self.size = size
+        self.weight = weight
+        self.data = None
+
+    @property
+    def pair(self):
+        return f"{self.input_format}->{self.output_format}"
+
+    @classmethod
+    def parse(cls, value):
+        # "png->jpeg:1024:3" is pair, fixture size and relative weight
+        pair, _, rest = value.partition(":")
+        size, _, weight = rest.partition(":")
+        input_format, _, output_format = pair.partition("->")
+        if not input_format or not output_format or not size:
+            raise ValueError(
+                f"Invalid job spec '{value}', expected in->out:size:weight"
+            )
+        return cls(input_format, output_format, size, int(weight or 1))
+
+
+def _fixture_size(format_type, size):
+    if format_type == FormatType.VIDEO:
+        width, height = (int(v) for v in size.split("x"))
+        return width, height, VIDEO_SPECS[0][2]
+    return int(size)
+
+
+def prepare_fixtures(specs, work_dir):
+    for spec in specs:
+        format_type = FileFormat.objects.get(name=spec.input_format).file_type
+        sizes = [_fixture_size(format_type, spec.size)]
+        fixture = next(
+            iter(
+                build_fixtures(format_type, [spec.input_format], work_dir, sizes=sizes)
+            ),
+            None,
+        )
+        if fixture is None:
+            raise ValueError(f"Can't generate a {spec.input_format} fixture")
+        spec.data = fixture.data
+
+
+@contextmanager
+def fake_redis():
+    # point both redis clients at one in-process server, keeping their identity
+    server = fakeredis.FakeServer()
+    sync_pool = redis_client.connection_pool
+    redis_client.connection_pool = redis.ConnectionPool(
+        connection_class=fakeredis.FakeConnection, server=server, db=1
+    )
+    # async clients are created per event loop from these
+    async_pool = mock.patch.dict(
+        ASYNC_POOL_OPTIONS,
+        {"connection_class": fake_aioredis.FakeConnection, "server": server, "db": 1},
+        clear=True,
+    )
+    try:
+        with async_pool:
+            yield server
+    finally:
+        redis_client.connection_pool = sync_pool
+
+
+@contextmanager
+def local_stand_ins(work_dir, workers):
+
+    app = current_app._get_current_object()
+    # celery checks these before its own config, backend is created lazily
+    celery_env = mock.patch.dict(
+        os.environ,
+        {"CELERY_BROKER_URL": "memory://", "CELERY_RESULT_BACKEND": "cache+memory://"},
+    )
+    # the in-memory transport polls, default 1s interval would dominate queue wait
+    transport_options = app.conf.broker_transport_options
+    app.conf.broker_transport_options = {"polling_interval": 0.01}
+    segment_dir = os.path.join(work_dir, "segments")
+    batch_dir = os.path.join(work_dir, "batches")
+    os.makedirs(segment_dir, exist_ok=True)
+    os.makedirs(batch_dir, exist_ok=True)
+    settings = override_settings(
+        ALLOWED_HOSTS=["testserver"],
+        TEMP_DIR=work_dir,
+        SEGMENT_DIR=segment_dir,
+        BATCH_DIR=batch_dir,
+        # worker threads share one process, a per-task address space cap can't apply
+        CONVERSION_RLIMIT_SELF=False,
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    try:
+        with fake_redis(), celery_env, settings, start_worker(
+            app, concurrency=workers, pool="threads", perform_ping_check=False
+        ):
+            yield
+    finally:
+        app.conf.broker_transport_options = transport_options
+
+
+class TaskClock:
+    def __init__(self):
+        self.published = {}
+        self.started = {}
+        self.finished = {}
+
+    def on_publish(self, headers=None, **kwargs):
+        self.published[headers["id"]] = time.perf_counter()
+
+    def on_prerun(self, task_id=None, **kwargs):
+        self.started[task_id] = time.perf_counter()
+
+    def on_postrun(self, task_id=None, **kwargs):
+        self.finished[task_id] = time.perf_counter()
+
+    def __enter__(self):
+        after_task_publish.connect(self.on_publish, weak=False)
+        task_prerun.connect(self.on_prerun, weak=False)
+        task_postrun.connect(self.on_postrun, weak=False)
+        return self
+
+    def __exit__(self, *exc):
+        after_task_publish.disconnect(self.on_publish)
+        task_prerun.disconnect(self.on_prerun)
+        task_postrun.disconnect(self.on_postrun)
+
+
+async def run_job(client, spec, poll_interval, timeout):
+    start = time.perf_counter()
+    url = reverse(
+        "converter:convert",
+        kwargs={"input_format": spec.input_format, "output_format": spec.output_format},
+    )
+    upload = SimpleUploadedFile(f"input.{spec.input_format}", spec.data)
+    response = await client.post(url, {"file": upload})
+    if response.status_code != 200:
+        return {"pair": spec.pair, "ok": False, "error": response.content.decode()}
+    if response.has_header("Content-Disposition"):
+        # converted in the request, nothing was queued
+        return {
+            "pair": spec.pair,
+            "ok": len(response.content) > 0,
+            "inline": True,
+            "end_to_end_s": time.perf_counter() - start,
+            "output_bytes": len(response.content),
+        }
+
+    token = response.json()["token"]
+    task_id = (await get_async_redis().get(f"conv:{token}")).decode()
+    progress_url = reverse("converter:convert_progress", args=[token])
+
+    while True:
+        progress = (await client.get(progress_url)).json()
+        if progress.get("complete"):
+            break
+        if time.perf_counter() - start > timeout:
+            return {"pair": spec.pair, "ok": False, "error": "timed out"}
+        await asyncio.sleep(poll_interval)
+
+    download = await client.get(reverse("converter:download_file", args=[token]))
+    size = sum(len(chunk) for chunk in getattr(download, "streaming_content", []))
+    ok = bool(progress.get("success")) and download.status_code == 200 and size > 0
+    return {
+        "pair": spec.pair,
+        "ok": ok,
+        "token": token,
+        "task_id": task_id,
+        "end_to_end_s": time.perf_counter() - start,
+        "output_bytes": size,
+    }
+
+
+async def replay(specs, total, concurrency, poll_interval, timeout, seed):
+    rng = random.Random(seed)
+    jobs = rng.choices(specs, weights=[s.weight for s in specs], k=total)
+    semaphore = asyncio.Semaphore(concurrency)
+    client = AsyncClient()
+
+    async def limited(spec):
+        async with semaphore:
+            return await run_job(client, spec, poll_interval, timeout)
+
+    return await asyncio.gather(*(limited(spec) for spec in jobs))
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(values):
+    summary = {f"p{pct}": percentile(values, pct) for pct in PERCENTILES}
+    summary["mean"] = sum(values) / len(values) if values else None
+    return summary
+
+
+def build_report(results, clock, wall):
+    for result in results:
+        task_id = result.get("task_id")
+        if task_id in clock.started and task_id in clock.published:
+            result["queue_wait_s"] = clock.started[task_id] - clock.published[task_id]
+        if task_id in clock.finished and task_id in clock.started:
+            result["service_s"] = clock.finished[task_id] - clock.started[task_id]
+
+    def section(rows):
+        done = [r for r in rows if r["ok"]]
+        queued = [r for r in done if not r.get("inline")]
+        return {
+            "jobs": len(rows),
+            "failed": len(rows) - len(done),
+            "inline": len(done) - len(queued),
+            # identical submissions attached to an in-flight job
+            "coalesced": len(queued) - len({r["task_id"] for r in queued}),
+            "queue_wait_s": summarize(
+                [r["queue_wait_s"] for r in done if "queue_wait_s" in r]
+            ),
+            "service_s": summarize([r["service_s"] for r in done if "service_s" in r]),
+            "end_to_end_s": summarize([r["end_to_end_s"] for r in done]),
+        }
+
+    report = section(results)
+    report["wall_s"] = wall
+    report["throughput_jobs_s"] = (
+        report["jobs"] and (report["jobs"] - report["failed"]) / wall
+    )
+    report["pairs"] = {
+        pair: section([r for r in results if r["pair"] == pair])
+        for pair in sorted({r["pair"] for r in results})
+    }
+    return report
+
+
+def run_load(
+    specs, total, concurrency, workers, poll_interval=0.05, timeout=300, seed=0
+):
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_fixtures(specs, work_dir)
+        with local_stand_ins(work_dir, workers), TaskClock() as clock:
+            start = time.perf_counter()
+            results = asyncio.run(
+                replay(specs, total, concurrency, poll_interval, timeout, seed)
+            )
+            wall = time.perf_counter() - start
+    return build_report(results, clock, wall)
@@ -0,0 +1,185 @@
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import tempfile
+import time
+from importlib import metadata
+from queue import Empty
+from django.db import connections
+from converter.models import ConverterMap, FormatConversion, FormatType
+from converter.utils.cache_func import get_converter_class
+from .fixtures import build_fixtures, input_formats
+
+
+COMPARED_METRICS = ("wall_s", "cpu_s", "peak_rss_kb", "output_bytes")
+# timings below this delta are noise, even if the ratio looks bad
+MIN_TIME_DELTA = 0.005
+TRACKED_PACKAGES = ("pillow", "moviepy", "numpy", "pypandoc", "imageio-ffmpeg")
+
+
+def _cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def _measure(class_path, data, input_format, output_format, queue):
+    # runs in a forked child so ru_maxrss belongs to this conversion only
+    try:
+        converter = get_converter_class(class_path)()
+        self_before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+
+        out_file = converter.convert(data, input_format, output_format)
+        output_bytes = len(out_file.getvalue())
+
+        wall = time.perf_counter() - start
+        self_after = resource.getrusage(resource.RUSAGE_SELF)
+        children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        queue.put(
+            {
+                "status": "ok",
+                "wall_s": wall,
+                "cpu_s": _cpu_seconds(self_after)
+                - _cpu_seconds(self_before)
+                + _cpu_seconds(children_after)
+                - _cpu_seconds(children_before),
+                "peak_rss_kb": max(self_after.ru_maxrss, children_after.ru_maxrss),
+                "output_bytes": output_bytes,
+            }
+        )
+    except Exception as e:
+        queue.put({"status": "error", "error": str(e)})
+
+
+def run_isolated(class_path, data, input_format, output_format, timeout):
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    # sqlite/postgres connections must not be shared with the child
+    connections.close_all()
+    process = ctx.Process(
+        target=_measure,
+        args=(class_path, data, input_format, output_format, queue),
+    )
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.kill()
+        process.join()
+        return {"status": "error", "error": f"timed out after {timeout}s"}
+    try:
+        return queue.get(timeout=5)
+    except Empty:
+        return {"status": "error", "error": f"exit code {process.exitcode}"}
+
+
+def _aggregate(samples):
+    ok = [s for s in samples if s["status"] == "ok"]
+    if not ok:
+        return samples[-1]
+    result = {"status": "ok", "runs": len(ok)}
+    for metric in COMPARED_METRICS:
+        result[metric] = statistics.median(s[metric] for s in ok)
+    return result
+
+
+def iter_cases(categories=None, pairs=None, quick=False):
+    conversions = FormatConversion.objects.select_related(
+        "input_format", "output_format"
+    ).order_by("input_format__name", "output_format__name")
+    by_input = {}
+    for conv in conversions:
+        pair = f"{conv.input_format.name}->{conv.output_format.name}"
+        if pairs and pair not in pairs:
+            continue
+        by_input.setdefault(conv.input_format.name, []).append(conv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for format_type in FormatType.values:
+            if categories and format_type not in categories:
+                continue
+            try:
+                class_path = ConverterMap.objects.get(
+                    format_type=format_type
+                ).class_path
+            except ConverterMap.DoesNotExist:
+                continue
+            formats = [f for f in input_formats(format_type) if f in by_input]
+            for fixture in build_fixtures(format_type, formats, work_dir, quick):
+                for conv in by_input[fixture.input_format]:
+                    yield format_type, class_path, fixture, conv
+
+
+def run_benchmarks(categories=None, pairs=None, repeat=1, quick=False, timeout=600):
+    for format_type, class_path, fixture, conv in iter_cases(categories, pairs, quick):
+        output_format = conv.output_format.name
+        samples = [
+            run_isolated(
+                class_path, fixture.data, fixture.input_format, output_format, timeout
+            )
+            for _ in range(repeat)
+        ]
+        result = _aggregate(samples)
+        result.update(
+            {
+                "key": f"{fixture.key}->{output_format}",
+                "category": format_type,
+                "pair": f"{fixture.input_format}->{output_format}",
+                "fixture": fixture.label,
+                "engine": conv.engine or class_path.rsplit(".", 1)[-1],
+                "input_bytes": len(fixture.data),
+            }
+        )
+        yield result
+
+
+def environment():
+    versions = {}
+    for package in TRACKED_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "packages": versions,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def save_report(path, results):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold):
+    previous = {r["key"]: r for r in baseline["results"] if r["status"] == "ok"}
+    regressions = []
+    for result in results:
+        old = previous.get(result["key"])
+        if not old or result["status"] != "ok":
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = old[metric], result[metric]
+            if before <= 0 or after <= before * (1 + threshold):
+                continue
+            if metric.endswith("_s") and after - before < MIN_TIME_DELTA:
+                continue
+            regressions.append(
+                {
+                    "key": result["key"],
+                    "metric": metric,
+                    "baseline": before,
+                    "current": after,
+                    "change": after / before - 1,
+                }
+            )
+    return regressions
@@ -1,6 +1,7 @@
 from django import forms
 from django.core.exceptions import ValidationError
 from django.conf import settings
+from .models import EncodingProfileName
 
 
 class ConvertForm(forms.Form):
@@ -10,6 +11,15 @@ class ConvertForm(forms.Form):
 
 class FileForm(forms.Form):
     file = forms.FileField()
+    profile = forms.ChoiceField(
+        choices=EncodingProfileName.choices,
+        initial=settings.WEB_ENCODING_PROFILE,
+        label="Encoding",
+        required=False,
+    )
+    # seconds or [hh:]mm:ss, audio and video only
+    start = forms.CharField(required=False, max_length=16)
+    end = forms.CharField(required=False, max_length=16)
 
     def clean_file(self):
         file = self.cleaned_data.get("file")
@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand, CommandError
+from converter.models import FormatType
+from converter.benchmarks.runner import (
+    compare,
+    load_report,
+    run_benchmarks,
+    save_report,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every conversion pair in the catalog on generated fixtures "
+        "and optionally compare the results with a saved baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output", default="converter_benchmark.json", help="JSON report path"
+        )
+        parser.add_argument("--baseline", help="previous JSON report to compare with")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.15,
+            help="allowed relative slowdown before a metric is a regression",
+        )
+        parser.add_argument(
+            "--category",
+            action="append",
+            choices=FormatType.values,
+            help="limit to a format type, may be repeated",
+        )
+        parser.add_argument(
+            "--pair",
+            action="append",
+            help="limit to a pair like png->jpeg, may be repeated",
+        )
+        parser.add_argument("--repeat", type=int, default=1)
+        parser.add_argument(
+            "--quick", action="store_true", help="only the smallest fixture size"
+        )
+        parser.add_argument(
+            "--timeout", type=int, default=600, help="per conversion, in sec"
+        )
+
+    def handle(self, *args, **options):
+        baseline = load_report(options["baseline"]) if options["baseline"] else None
+
+        results = []
+        for result in run_benchmarks(
+            categories=options["category"],
+            pairs=options["pair"],
+            repeat=options["repeat"],
+            quick=options["quick"],
+            timeout=options["timeout"],
+        ):
+            results.append(result)
+            if result["status"] == "ok":
+                self.stdout.write(
+                    f"{result['key']:<32} wall {result['wall_s']:8.3f}s  "
+                    f"cpu {result['cpu_s']:8.3f}s  "
+                    f"rss {result['peak_rss_kb'] / 1024:8.1f}MB  "
+                    f"out {result['output_bytes']:>10}B"
+                )
+            else:
+                self.stdout.write(
+                    self.style.WARNING(f"{result['key']:<32} {result['error']}")
+                )
+
+        save_report(options["output"], results)
+        self.stdout.write(f"Saved {len(results)} results to {options['output']}")
+
+        if not baseline:
+            return
+
+        regressions = compare(results, baseline, options["threshold"])
+        for reg in regressions:
+            self.stdout.write(
+                self.style.ERROR(
+                    f"{reg['key']} {reg['metric']}: {reg['baseline']:.4g} -> "
+                    f"{reg['current']:.4g} (+{reg['change']:.0%})"
+                )
+            )
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} regressions above {options['threshold']:.0%}"
+            )
+        self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from converter.utils.storage import get_result_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Install the lifecycle rule that expires conversion results "
+        "in the configured object store"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.RESULT_STORAGE_EXPIRE_DAYS,
+            help="age in days after which results are deleted",
+        )
+
+    def handle(self, *args, **options):
+        storage = get_result_storage()
+        if not hasattr(storage, "configure_lifecycle"):
+            raise CommandError(
+                f"{type(storage).__name__} has no lifecycle rules, "
+                "its results are removed by the cleanup task"
+            )
+        if options["days"] < 1:
+            raise CommandError("--days must be at least 1")
+        storage.configure_lifecycle(options["days"])
+        self.stdout.write(
+            f"results under {storage.prefix!r} in {storage.bucket!r} "
+            f"expire after {options['days']} day(s)"
+        )
@@ -0,0 +1,67 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from converter.benchmarks.loadtest import DEFAULT_MIX, JobSpec, run_load
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a job mix through the conversion views and an embedded worker "
+        "with an in-memory broker, result backend and redis"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--job",
+            action="append",
+            help="job spec in->out:size:weight, e.g. png->jpeg:1024:3 or "
+            "mp4->webm:320x240:1, may be repeated",
+        )
+        parser.add_argument("--jobs", type=int, default=100, help="total submissions")
+        parser.add_argument(
+            "--concurrency", type=int, default=10, help="simultaneous clients"
+        )
+        parser.add_argument("--workers", type=int, default=4, help="worker threads")
+        parser.add_argument("--poll-interval", type=float, default=0.05)
+        parser.add_argument("--timeout", type=int, default=300, help="per job, in sec")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="JSON report path")
+
+    def handle(self, *args, **options):
+        try:
+            specs = [JobSpec.parse(value) for value in options["job"] or DEFAULT_MIX]
+        except ValueError as e:
+            raise CommandError(e)
+
+        report = run_load(
+            specs,
+            total=options["jobs"],
+            concurrency=options["concurrency"],
+            workers=options["workers"],
+            poll_interval=options["poll_interval"],
+            timeout=options["timeout"],
+            seed=options["seed"],
+        )
+
+        self.stdout.write(
+            f"{report['jobs']} jobs, {report['failed']} failed, "
+            f"{report['inline']} inline, {report['coalesced']} coalesced in "
+            f"{report['wall_s']:.2f}s ({report['throughput_jobs_s']:.2f} jobs/s)"
+        )
+        self._write_section("all", report)
+        for pair, section in report["pairs"].items():
+            self._write_section(pair, section)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Saved report to {options['output']}")
+
+    def _write_section(self, name, section):
+        for metric in ("queue_wait_s", "service_s", "end_to_end_s"):
+            values = section[metric]
+            if values["p50"] is None:
+                continue
+            self.stdout.write(
+                f"{name:<16} {metric:<13} p50 {values['p50']:.3f}s  "
+                f"p95 {values['p95']:.3f}s  p99 {values['p99']:.3f}s"
+            )
@@ -0,0 +1,94 @@
+# Generated by Django 4.2 on 2026-10-19 12:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversionProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token", models.CharField(db_index=True, max_length=32)),
+                ("task_id", models.CharField(blank=True, max_length=255)),
+                ("input_format", models.CharField(max_length=10)),
+                ("output_format", models.CharField(max_length=10)),
+                ("engine", models.CharField(blank=True, max_length=50)),
+                (
+                    "mode",
+                    models.CharField(
+                        choices=[
+                            ("sampling", "Sampling (collapsed stacks)"),
+                            ("cprofile", "cProfile (pstats)"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("duration", models.FloatField()),
+                ("succeeded", models.BooleanField(default=False)),
+                ("data", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ProfilingRule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sample_rate", models.FloatField(default=1.0)),
+                (
+                    "mode",
+                    models.CharField(
+                        choices=[
+                            ("sampling", "Sampling (collapsed stacks)"),
+                            ("cprofile", "cProfile (pstats)"),
+                        ],
+                        default="sampling",
+                        max_length=10,
+                    ),
+                ),
+                ("enabled", models.BooleanField(default=True)),
+                (
+                    "input_format",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="profiling_rules_from",
+                        to="converter.fileformat",
+                    ),
+                ),
+                (
+                    "output_format",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="profiling_rules_to",
+                        to="converter.fileformat",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,138 @@
+# Generated by Django 4.2 on 2026-10-19 13:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("users", "0001_initial"),
+        ("converter", "0002_profiling"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversionJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token", models.CharField(max_length=32)),
+                ("task_id", models.CharField(blank=True, max_length=255)),
+                (
+                    "format_type",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("image", "Image"),
+                            ("document", "Document"),
+                            ("audio", "Audio"),
+                            ("video", "Video"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("input_format", models.CharField(max_length=10)),
+                ("output_format", models.CharField(max_length=10)),
+                ("engine", models.CharField(blank=True, max_length=50)),
+                ("input_size", models.BigIntegerField(null=True)),
+                ("output_size", models.BigIntegerField(null=True)),
+                ("queue_wait", models.FloatField(null=True)),
+                ("service_time", models.FloatField(null=True)),
+                (
+                    "outcome",
+                    models.CharField(
+                        choices=[
+                            ("succeeded", "Succeeded"),
+                            ("invalid_input", "Invalid input"),
+                            ("budget_exceeded", "Budget exceeded"),
+                            ("unsupported", "Unsupported"),
+                            ("failed", "Failed"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("finished_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ConversionRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                (
+                    "format_type",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("image", "Image"),
+                            ("document", "Document"),
+                            ("audio", "Audio"),
+                            ("video", "Video"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("input_format", models.CharField(max_length=10)),
+                ("output_format", models.CharField(max_length=10)),
+                ("engine", models.CharField(blank=True, max_length=50)),
+                ("jobs", models.PositiveIntegerField(default=0)),
+                ("failures", models.PositiveIntegerField(default=0)),
+                ("input_bytes", models.BigIntegerField(default=0)),
+                ("output_bytes", models.BigIntegerField(default=0)),
+                ("busy_time", models.FloatField(default=0)),
+                ("service_p50", models.FloatField(null=True)),
+                ("service_p95", models.FloatField(null=True)),
+                ("service_p99", models.FloatField(null=True)),
+                ("service_max", models.FloatField(null=True)),
+                ("queue_wait_p50", models.FloatField(null=True)),
+                ("queue_wait_p95", models.FloatField(null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="conversionrollup",
+            constraint=models.UniqueConstraint(
+                fields=("day", "input_format", "output_format", "engine"),
+                name="unique_rollup_per_day_and_pair",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversionjob",
+            name="api_key",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="users.userapikey",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversionjob",
+            name="user",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
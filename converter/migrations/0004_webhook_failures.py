@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-19 13:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+        ("converter", "0003_conversion_history"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookFailure",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token", models.CharField(max_length=32)),
+                ("url", models.URLField(max_length=2048)),
+                ("hook", models.JSONField()),
+                ("result", models.JSONField()),
+                ("attempts", models.PositiveIntegerField()),
+                ("last_error", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "api_key",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="users.userapikey",
+                    ),
+                ),
+            ],
+        ),
+    ]
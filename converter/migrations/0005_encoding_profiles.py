@@ -0,0 +1,187 @@
+# Generated by Django 4.2 on 2026-10-19 13:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# fast, balanced and small options per encoder, pairs without one keep the
+# engine defaults
+X264 = (
+    {"preset": "veryfast", "crf": 23},
+    {"preset": "medium", "crf": 23},
+    {"preset": "slow", "crf": 28},
+)
+VPX = (
+    {
+        "crf": 10,
+        "video_bitrate": "2M",
+        "ffmpeg_params": ["-deadline", "realtime", "-cpu-used", "8"],
+    },
+    {
+        "crf": 10,
+        "video_bitrate": "2M",
+        "ffmpeg_params": ["-deadline", "good", "-cpu-used", "2"],
+    },
+    {
+        "crf": 20,
+        "video_bitrate": "1M",
+        "ffmpeg_params": ["-deadline", "good", "-cpu-used", "1"],
+    },
+)
+QSCALE = (
+    {"ffmpeg_params": ["-q:v", "4"]},
+    {"ffmpeg_params": ["-q:v", "4"]},
+    {"ffmpeg_params": ["-q:v", "8"]},
+)
+# theora's scale runs the other way, 10 is best
+THEORA = (
+    {"ffmpeg_params": ["-q:v", "7"]},
+    {"ffmpeg_params": ["-q:v", "7"]},
+    {"ffmpeg_params": ["-q:v", "5"]},
+)
+VIDEO_CODECS = {
+    "libx264": X264,
+    "libvpx": VPX,
+    "mpeg4": QSCALE,
+    "flv": QSCALE,
+    "wmv2": QSCALE,
+    "mpeg2video": QSCALE,
+    "libtheora": THEORA,
+}
+VIDEO_AUDIO = ({"audio_bitrate": "128k"},) * 2 + ({"audio_bitrate": "96k"},)
+
+AUDIO_CODECS = {
+    "libmp3lame": (
+        {"audio_bitrate": "192k", "ffmpeg_params": ["-compression_level", "9"]},
+        {"audio_bitrate": "192k"},
+        {"audio_bitrate": "128k", "ffmpeg_params": ["-compression_level", "0"]},
+    ),
+    "aac": (
+        {"audio_bitrate": "192k"},
+        {"audio_bitrate": "192k"},
+        {"audio_bitrate": "128k"},
+    ),
+    "libvorbis": (
+        {"ffmpeg_params": ["-q:a", "5"]},
+        {"ffmpeg_params": ["-q:a", "5"]},
+        {"ffmpeg_params": ["-q:a", "3"]},
+    ),
+    "libopus": (
+        {"audio_bitrate": "128k", "ffmpeg_params": ["-compression_level", "0"]},
+        {"audio_bitrate": "128k"},
+        {"audio_bitrate": "96k", "ffmpeg_params": ["-compression_level", "10"]},
+    ),
+    "flac": (
+        {"ffmpeg_params": ["-compression_level", "0"]},
+        {"ffmpeg_params": ["-compression_level", "5"]},
+        {"ffmpeg_params": ["-compression_level", "12"]},
+    ),
+    "wmav2": (
+        {"audio_bitrate": "192k"},
+        {"audio_bitrate": "192k"},
+        {"audio_bitrate": "128k"},
+    ),
+}
+
+# pillow save options per output format
+IMAGE_FORMATS = {
+    "jpeg": (
+        {"quality": 85},
+        {"quality": 85, "optimize": True},
+        {"quality": 75, "optimize": True, "progressive": True},
+    ),
+    "png": (
+        {"compress_level": 1},
+        {"compress_level": 6},
+        {"compress_level": 9, "optimize": True},
+    ),
+    "webp": (
+        {"quality": 80, "method": 0},
+        {"quality": 80, "method": 4},
+        {"quality": 75, "method": 6},
+    ),
+    "gif": ({}, {}, {"optimize": True}),
+    "tiff": ({}, {"compression": "tiff_lzw"}, {"compression": "tiff_adobe_deflate"}),
+}
+
+NAMES = ("fast", "balanced", "small")
+
+
+def _profiles(conversion):
+    if conversion.video_codec in VIDEO_CODECS:
+        audio = VIDEO_AUDIO if conversion.audio_video_codec else ({},) * 3
+        return [
+            {**video, **track}
+            for video, track in zip(VIDEO_CODECS[conversion.video_codec], audio)
+        ]
+    if conversion.audio_codec in AUDIO_CODECS:
+        return AUDIO_CODECS[conversion.audio_codec]
+    if conversion.input_format.file_type == "image":
+        return IMAGE_FORMATS.get(conversion.output_format.name)
+    return None
+
+
+def seed_profiles(apps, schema_editor):
+    FormatConversion = apps.get_model("converter", "FormatConversion")
+    EncodingProfile = apps.get_model("converter", "EncodingProfile")
+    profiles = []
+    conversions = FormatConversion.objects.select_related(
+        "input_format", "output_format"
+    )
+    for conversion in conversions:
+        for name, options in zip(NAMES, _profiles(conversion) or ()):
+            profiles.append(
+                EncodingProfile(conversion=conversion, name=name, options=options)
+            )
+    EncodingProfile.objects.bulk_create(profiles)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0004_webhook_failures"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EncodingProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        choices=[
+                            ("fast", "Fast"),
+                            ("balanced", "Balanced"),
+                            ("small", "Small"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("options", models.JSONField(blank=True, default=dict)),
+                (
+                    "conversion",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="profiles",
+                        to="converter.formatconversion",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="encodingprofile",
+            constraint=models.UniqueConstraint(
+                fields=("conversion", "name"), name="unique_profile_per_pair"
+            ),
+        ),
+        migrations.RunPython(seed_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+# pandoc starts in milliseconds on these, office formats go through the queue
+TEXT_INPUTS = ("markdown", "html", "latex")
+
+
+def mark_inline(apps, schema_editor):
+    FormatConversion = apps.get_model("converter", "FormatConversion")
+    # pillow converts in process
+    FormatConversion.objects.filter(input_format__file_type="image").update(inline=True)
+    FormatConversion.objects.filter(
+        input_format__name__in=TEXT_INPUTS, engine="pandoc"
+    ).update(inline=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0005_encoding_profiles"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="formatconversion",
+            name="inline",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_inline, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-19 13:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0006_inline_conversions"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="conversionjob",
+            name="outcome",
+            field=models.CharField(
+                choices=[
+                    ("succeeded", "Succeeded"),
+                    ("invalid_input", "Invalid input"),
+                    ("budget_exceeded", "Budget exceeded"),
+                    ("unsupported", "Unsupported"),
+                    ("cancelled", "Cancelled"),
+                    ("failed", "Failed"),
+                ],
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-19 14:40
+
+from django.db import migrations
+
+
+# the mpeg family picks macroblock modes by rate distortion at the same
+# quantizer, slower but smaller, the fast profile keeps the quick decision
+QSCALE_CODECS = ("mpeg4", "flv", "wmv2", "mpeg2video")
+QSCALE = {
+    "fast": ["-q:v", "4"],
+    "balanced": ["-q:v", "4", "-mbd", "rd"],
+    "small": ["-q:v", "8", "-mbd", "rd"],
+}
+
+
+def separate_profiles(apps, schema_editor):
+    EncodingProfile = apps.get_model("converter", "EncodingProfile")
+    profiles = EncodingProfile.objects.filter(
+        conversion__video_codec__in=QSCALE_CODECS, name__in=QSCALE
+    )
+    for profile in profiles:
+        profile.options = {**profile.options, "ffmpeg_params": QSCALE[profile.name]}
+        profile.save(update_fields=["options"])
+
+    # theora, vorbis, aac, wma and gif have no speed setting, a fast profile
+    # there only repeated balanced, the pair now encodes balanced for it
+    balanced = dict(
+        EncodingProfile.objects.filter(name="balanced").values_list(
+            "conversion_id", "options"
+        )
+    )
+    EncodingProfile.objects.filter(
+        pk__in=[
+            profile.pk
+            for profile in EncodingProfile.objects.filter(name="fast")
+            if balanced.get(profile.conversion_id) == profile.options
+        ]
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("converter", "0007_cancelled_outcome"),
+    ]
+
+    operations = [
+        migrations.RunPython(separate_profiles, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 
@@ -27,11 +28,40 @@ class FormatConversion(models.Model):
     audio_video_codec = models.CharField(max_length=50, blank=True, null=True)
     audio_codec = models.CharField(max_length=50, blank=True, null=True)
     engine = models.CharField(max_length=50, blank=True, null=True)
+    # cheap enough to convert small inputs in the request, see submission
+    inline = models.BooleanField(default=False)
 
     def __str__(self):
         return f"{self.input_format.name} → {self.output_format.name}"
 
 
+class EncodingProfileName(models.TextChoices):
+    FAST = "fast", "Fast"
+    BALANCED = "balanced", "Balanced"
+    SMALL = "small", "Small"
+
+
+class EncodingProfile(models.Model):
+    # engine parameters of a pair, video reads preset, crf, video_bitrate,
+    # audio_bitrate and ffmpeg_params, audio the last two, images pass
+    # everything to pillow's save
+    conversion = models.ForeignKey(
+        FormatConversion, related_name="profiles", on_delete=models.CASCADE
+    )
+    name = models.CharField(max_length=10, choices=EncodingProfileName.choices)
+    options = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["conversion", "name"], name="unique_profile_per_pair"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.conversion} ({self.name})"
+
+
 class ConverterMap(models.Model):
     format_type = models.CharField(
         max_length=10, choices=FormatType.choices, unique=True
@@ -40,3 +70,162 @@ class ConverterMap(models.Model):
 
     def __str__(self):
         return f"{self.format_type}: {self.class_path}"
+
+
+class ProfilerMode(models.TextChoices):
+    SAMPLING = "sampling", "Sampling (collapsed stacks)"
+    CPROFILE = "cprofile", "cProfile (pstats)"
+
+
+class ProfilingRule(models.Model):
+    # empty format matches any format
+    input_format = models.ForeignKey(
+        FileFormat,
+        related_name="profiling_rules_from",
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+    )
+    output_format = models.ForeignKey(
+        FileFormat,
+        related_name="profiling_rules_to",
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+    )
+    sample_rate = models.FloatField(default=1.0)
+    mode = models.CharField(
+        max_length=10, choices=ProfilerMode.choices, default=ProfilerMode.SAMPLING
+    )
+    enabled = models.BooleanField(default=True)
+
+    def matches(self, input_format, output_format):
+        return (
+            self.input_format is None or self.input_format.name == input_format
+        ) and (self.output_format is None or self.output_format.name == output_format)
+
+    def __str__(self):
+        source = self.input_format.name if self.input_format else "*"
+        target = self.output_format.name if self.output_format else "*"
+        return f"{source} → {target} ({self.sample_rate:.0%}, {self.mode})"
+
+
+class ConversionProfile(models.Model):
+    token = models.CharField(max_length=32, db_index=True)
+    task_id = models.CharField(max_length=255, blank=True)
+    input_format = models.CharField(max_length=10)
+    output_format = models.CharField(max_length=10)
+    engine = models.CharField(max_length=50, blank=True)
+    mode = models.CharField(max_length=10, choices=ProfilerMode.choices)
+    duration = models.FloatField()
+    succeeded = models.BooleanField(default=False)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def filename(self):
+        ext = "pstats" if self.mode == ProfilerMode.CPROFILE else "collapsed.txt"
+        return f"{self.token}-{self.input_format}-{self.output_format}.{ext}"
+
+    def __str__(self):
+        return f"{self.input_format} → {self.output_format} ({self.token})"
+
+
+class JobOutcome(models.TextChoices):
+    SUCCEEDED = "succeeded", "Succeeded"
+    INVALID_INPUT = "invalid_input", "Invalid input"
+    BUDGET_EXCEEDED = "budget_exceeded", "Budget exceeded"
+    UNSUPPORTED = "unsupported", "Unsupported"
+    CANCELLED = "cancelled", "Cancelled"
+    FAILED = "failed", "Failed"
+
+
+class ConversionJob(models.Model):
+    # one finished conversion, written in bulk by flush_job_history
+    token = models.CharField(max_length=32)
+    task_id = models.CharField(max_length=255, blank=True)
+    format_type = models.CharField(
+        max_length=10, choices=FormatType.choices, blank=True
+    )
+    input_format = models.CharField(max_length=10)
+    output_format = models.CharField(max_length=10)
+    engine = models.CharField(max_length=50, blank=True)
+    input_size = models.BigIntegerField(null=True)
+    output_size = models.BigIntegerField(null=True)
+    # value in sec, submission to first start and first start to finish
+    queue_wait = models.FloatField(null=True)
+    service_time = models.FloatField(null=True)
+    outcome = models.CharField(max_length=20, choices=JobOutcome.choices)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="+",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    api_key = models.ForeignKey(
+        "users.UserAPIKey",
+        related_name="+",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    finished_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.input_format} → {self.output_format} ({self.token})"
+
+
+class ConversionRollup(models.Model):
+    # per day and pair, kept long after the jobs themselves are deleted
+    day = models.DateField()
+    format_type = models.CharField(
+        max_length=10, choices=FormatType.choices, blank=True
+    )
+    input_format = models.CharField(max_length=10)
+    output_format = models.CharField(max_length=10)
+    engine = models.CharField(max_length=50, blank=True)
+    jobs = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    input_bytes = models.BigIntegerField(default=0)
+    output_bytes = models.BigIntegerField(default=0)
+    # values in sec, busy time is what the pair cost the worker pool
+    busy_time = models.FloatField(default=0)
+    service_p50 = models.FloatField(null=True)
+    service_p95 = models.FloatField(null=True)
+    service_p99 = models.FloatField(null=True)
+    service_max = models.FloatField(null=True)
+    queue_wait_p50 = models.FloatField(null=True)
+    queue_wait_p95 = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "input_format", "output_format", "engine"],
+                name="unique_rollup_per_day_and_pair",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.input_format} → {self.output_format}"
+
+
+class WebhookFailure(models.Model):
+    # a completion callback that could not be delivered, redelivered from the admin
+    token = models.CharField(max_length=32)
+    url = models.URLField(max_length=2048)
+    api_key = models.ForeignKey(
+        "users.UserAPIKey",
+        related_name="+",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    hook = models.JSONField()
+    result = models.JSONField()
+    attempts = models.PositiveIntegerField()
+    last_error = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.url} ({self.token})"
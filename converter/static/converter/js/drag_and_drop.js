@@ -106,6 +106,19 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     });
 
+    function saveFile(blob, disposition) {
+        // non-ascii names are sent percent-encoded in filename*
+        const encoded = /filename\*=utf-8''([^;]+)/i.exec(disposition);
+        const plain = /filename="([^"]+)"/.exec(disposition);
+        const link = document.createElement('a');
+        link.href = URL.createObjectURL(blob);
+        link.download = encoded ? decodeURIComponent(encoded[1]) : plain ? plain[1] : 'converted';
+        document.body.appendChild(link);
+        link.click();
+        link.remove();
+        setTimeout(() => URL.revokeObjectURL(link.href), 1000);
+    }
+
     if (form) {
         form.addEventListener('submit', function(e) {
             e.preventDefault();
@@ -121,7 +134,19 @@ document.addEventListener('DOMContentLoaded', function () {
                         'X-CSRFToken': '{{ csrf_token }}'
                     }
                 })
-                .then(response => response.json())
+                .then(response => {
+                    const disposition = response.headers.get('Content-Disposition');
+                    if (response.ok && disposition) {
+                        // small files come back converted, no progress page
+                        return response.blob().then(blob => {
+                            saveFile(blob, disposition);
+                            form.reset();
+                            checkmark.style.display = 'none';
+                            return {};
+                        });
+                    }
+                    return response.json();
+                })
                 .then(data => {
                     if (data.redirect_url) {
                         form.reset();
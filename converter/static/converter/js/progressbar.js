@@ -1,10 +1,12 @@
 document.addEventListener("DOMContentLoaded", function () {
     const downloadBtn = document.getElementById('download-btn');
     const homeBtn = document.getElementById('home-btn');
+    const cancelBtn = document.getElementById('cancel-btn');
     const successHome = document.getElementById('home-text-link');
     const checkmark = document.querySelector('.progress-checkmark');
     const errormark = document.querySelector('.progress-error');
     const heading = document.querySelector('.convert-heading');
+    let cancelled = false;
 
     if (downloadBtn && downloadUrl) {
         downloadBtn.addEventListener('click', function () {
@@ -18,24 +20,53 @@ document.addEventListener("DOMContentLoaded", function () {
         });
     }
 
+    function showFailure(message) {
+        errormark.style.display = 'inline';
+        checkmark.style.display = 'none';
+        downloadBtn.style.display = 'none';
+        cancelBtn.style.display = 'none';
+        homeBtn.style.display = 'inline-block';
+
+        if (heading) {
+            heading.textContent = message;
+        }
+    }
+
+    if (cancelBtn && cancelUrl) {
+        cancelBtn.addEventListener('click', function () {
+            cancelBtn.disabled = true;
+            fetch(cancelUrl, {
+                method: 'POST',
+                headers: {'X-CSRFToken': csrfToken}
+            }).then(function (response) {
+                if (response.status === 202) {
+                    // other submissions of the same file may keep the job running
+                    cancelled = true;
+                    showFailure('Conversion cancelled');
+                } else {
+                    // already finished, the next poll shows the result
+                    cancelBtn.disabled = false;
+                }
+            }).catch(function () {
+                cancelBtn.disabled = false;
+            });
+        });
+    }
+
     function customResult(resultElement, result) {
         const content = document.getElementById('progress-bar-message').innerText.trim();
 
-        if (content === 'Success!') {
+        if (cancelled || result === 'Conversion cancelled') {
+            showFailure('Conversion cancelled');
+        } else if (content === 'Success!') {
             checkmark.style.display = 'inline';
             errormark.style.display = 'none';
             downloadBtn.style.display = 'inline-block';
             homeBtn.style.display = 'none';
             successHome.style.display = 'inline-block';
+            cancelBtn.style.display = 'none';
         } else {
-            errormark.style.display = 'inline';
-            checkmark.style.display = 'none';
-            downloadBtn.style.display = 'none';
-            homeBtn.style.display = 'inline-block';
-
-            if (heading) {
-                heading.textContent = 'Conversion failed';
-            }
+            showFailure('Conversion failed');
         }
     }
 
@@ -1,81 +1,1016 @@
+import io
 import os
+import shutil
 import uuid
-from celery import shared_task
-from .models import FormatConversion
+import logging
+from celery import shared_task, chord, group
+from celery.exceptions import Ignore
+from .models import FormatConversion, FormatType, JobOutcome
 from .utils.cache_func import get_converter_map, get_converter_class
-from .utils.converters import get_conversion
+from .utils.converters import (
+    get_conversion,
+    normalize_format,
+    BudgetExceeded,
+    InvalidInput,
+)
+from .utils.errors import Cancelled, ConversionError, EngineUnavailable
 from celery_progress.backend import ProgressRecorder
+from celery.states import READY_STATES
+from celery.signals import worker_init, worker_process_init
 import time
+from datetime import datetime, timedelta, timezone
 from django.conf import settings
 from .utils.redis_ext_client import redis_client
+from .utils.metrics import (
+    StageTimer,
+    FAILURES,
+    RETRIES,
+    UNKNOWN,
+    MULTI_TARGET,
+    queue_wait,
+)
+from .utils.previews import store_preview
+from .utils.profiling import start_profiling
+from .utils.limits import get_conversion_limits, memory_budget, task_time_limits
+from .utils.failures import input_digest, remember_failure
+from .utils.inflight import release_inflight
+from .utils.batching import (
+    stage_input,
+    add_job,
+    claim_batch,
+    gather_batch,
+    take_batch,
+    is_expired,
+    stranded_batches,
+)
+from .utils.compression import SUFFIXES, result_encoding, compress
+from .utils.storage import get_result_storage, work_dirs_shared
+from .utils.warmup import warm_up
+from .utils.cancellation import (
+    add_pieces,
+    claim_cancelled,
+    install_cancel_handler,
+    is_cancelled,
+    job_pieces,
+    uncancellable,
+)
+from .utils.history import (
+    job_started,
+    job_output,
+    job_output_size,
+    job_finished,
+    outcome_of,
+    flush_history,
+    rollup_day,
+    prune_history,
+)
+from .utils.webhooks import (
+    WebhookError,
+    WebhookRejected,
+    completion,
+    take_callbacks,
+    acquire_slot,
+    release_slot,
+    send_webhook,
+    dead_letter,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+@worker_init.connect
+def warm_up_worker(**kwargs):
+    # runs in the main process, prefork children inherit what it loaded
+    if settings.WORKER_WARMUP:
+        warm_up()
+
+
+@worker_process_init.connect
+def handle_cancel_signal(**kwargs):
+    # pool children only, the signal is sent to the one running the job
+    install_cancel_handler()
+
+
+def _store_result(token, output_format, out_file):
+    filename = f"{token}{uuid.uuid4().hex[:8]}.{output_format}"
+    data = out_file.read()
+    job_output(token, len(data))
+    # text results are stored compressed once, the suffix names the encoding
+    encoding = result_encoding(output_format)
+    if encoding:
+        data = compress(data, encoding)
+        filename += SUFFIXES[encoding]
+    get_result_storage().save(filename, io.BytesIO(data))
+
+    redis_client.setex(f"path:{token}", settings.FILE_TTL, filename)
+    return filename
+
+
+def _job_done(token, task_id, labels, outcome):
+    outcome = outcome or JobOutcome.FAILED
+    # read before the history entry is queued, flushing it drops the details
+    result = completion(outcome, job_output_size(token))
+    job_finished(token, task_id, labels, outcome)
+    for hook in take_callbacks(token, result):
+        deliver_webhook.delay(token, hook, result)
+
+
+def _finish_cancelled(
+    task,
+    job_id,
+    input_format,
+    targets,
+    input_hash=None,
+    profile=None,
+    clip=None,
+    engine=UNKNOWN,
+    work_dir=None,
+):
+    # once per job, the segments of one are stopped on several workers
+    if not claim_cancelled(job_id):
+        return
+    logger.info("conversion cancelled", extra={"tokens": targets, "task_id": job_id})
+    # the signal may still be on its way
+    with uncancellable():
+        task.backend.mark_as_revoked(job_id, "cancelled")
+        for output_format, token in targets.items():
+            labels = {
+                "input_format": normalize_format(input_format),
+                "output_format": normalize_format(output_format),
+                "engine": engine,
+            }
+            _job_done(token, job_id, labels, JobOutcome.CANCELLED)
+            redis_client.delete(f"segments:{token}")
+            if input_hash:
+                release_inflight(
+                    input_hash, input_format, output_format, token, profile, clip
+                )
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
 
 
 @shared_task(bind=True)
-def convert_task(self, file, input_format, output_format, token):
+def convert_task(
+    self,
+    file,
+    input_format,
+    output_format,
+    token,
+    input_hash=None,
+    profile=None,
+    clip=None,
+):
     progress_recorder = ProgressRecorder(self)
+    timer = StageTimer()
+    labels = {"input_format": UNKNOWN, "output_format": UNKNOWN, "engine": UNKNOWN}
+
+    wait = queue_wait(self.request)
+    if wait is not None:
+        timer.add("queue_wait", wait)
+
+    job_started(token)
+    profiling = start_profiling(
+        normalize_format(input_format), normalize_format(output_format)
+    )
+    succeeded = False
+    outcome = None
+    # a retried attempt keeps its identical submissions attached
+    final = True
 
     try:
-        conversion, output_format = get_conversion(input_format, output_format)
+        # cancelled while waiting, the revoke may not have reached this worker
+        if is_cancelled(self.request.id):
+            raise Cancelled()
+        with timer.stage("catalog_lookup"):
+            conversion, output_format = get_conversion(input_format, output_format)
         progress_recorder.set_progress(25, 100)
 
-        format_type = conversion.input_format.file_type
-        converter_map = get_converter_map(format_type)
-        converter_class = get_converter_class(converter_map.class_path)
+        with timer.stage("catalog_lookup"):
+            format_type = conversion.input_format.file_type
+            converter_map = get_converter_map(format_type)
+            converter_class = get_converter_class(converter_map.class_path)
+
+        labels = {
+            "input_format": conversion.input_format.name,
+            "output_format": output_format,
+            "engine": conversion.engine or converter_class.engine or UNKNOWN,
+        }
+        converter = converter_class()
+        if (
+            settings.DOC_BATCH_WINDOW
+            and converter.batchable(conversion)
+            and work_dirs_shared()
+        ):
+            # before the job is visible, its result may be stored right after
+            progress_recorder.set_progress(50, 100)
+            add_job(
+                output_format,
+                {
+                    "task_id": self.request.id,
+                    "token": token,
+                    "class_path": converter_map.class_path,
+                    "input_path": stage_input(
+                        token, conversion.input_format.name, file
+                    ),
+                    "input_format": conversion.input_format.name,
+                    "output_format": output_format,
+                    "input_hash": input_hash,
+                    "profile": profile,
+                },
+            )
+            # whoever converts the batch stores this task's result and claim
+            final = False
+            if claim_batch(output_format):
+                # the batch holds other submissions' jobs, it can't stop for one
+                with uncancellable():
+                    _lead_batch(self, output_format)
+            raise Ignore()
+
+        split = None
+        # a clip is read from its start on, segments would cover the whole file
+        if converter.segmentable and not clip and work_dirs_shared():
+            with timer.stage("segment_split"):
+                split = converter.split(file, input_format)
+        if split:
+            work_dir, segments = split
+            progress_recorder.set_progress(SEGMENTS_START, 100)
+            # the join inherits this task's id, so does the progress polling
+            final = False
+            raise self.replace(
+                _segment_workflow(
+                    converter_map.class_path,
+                    converter.format_type,
+                    work_dir,
+                    segments,
+                    conversion.input_format.name,
+                    output_format,
+                    token,
+                    input_hash,
+                    self.request.id,
+                    profile,
+                )
+            )
 
         progress_recorder.set_progress(50, 100)
-        out_file = converter_class().convert(file, input_format, output_format)
+        with timer.stage("convert"), memory_budget(converter.limits["memory"]):
+            out_file = converter.convert(
+                file, input_format, output_format, profile, clip
+            )
+        # pools that can't signal their workers stop here instead
+        if is_cancelled(self.request.id):
+            raise Cancelled()
 
         progress_recorder.set_progress(75, 100)
-        filename = f"{token}{uuid.uuid4().hex[:8]}.{output_format}"
-        temp_path = os.path.join(settings.TEMP_DIR, filename)
+        with timer.stage("result_write"):
+            result_name = _store_result(token, output_format, out_file)
+        progress_recorder.set_progress(100, 100)
+        succeeded = True
+        outcome = outcome_of(None)
 
-        with open(temp_path, "wb") as f:
-            f.write(out_file.read())
+        logger.info(
+            "conversion finished",
+            extra={"token": token, **labels, "stages": timer.durations},
+        )
+        return result_name
 
-        redis_client.setex(f"path:{token}", settings.FILE_TTL, temp_path)
-        progress_recorder.set_progress(100, 100)
+    except Ignore:
+        raise
 
-        return temp_path
+    except Cancelled:
+        # the engine was stopped and its scratch files removed on the way here
+        final = False
+        _finish_cancelled(
+            self,
+            self.request.id,
+            input_format,
+            {output_format: token},
+            input_hash,
+            profile,
+            clip,
+            labels["engine"],
+        )
+        raise Ignore()
 
     except FormatConversion.DoesNotExist:
-        print(f"[convert_task] Unsupported format: {input_format} -> {output_format}")
+        FAILURES.labels(**labels, error="unsupported").inc()
+        outcome = JobOutcome.UNSUPPORTED
+        logger.warning(
+            "unsupported conversion",
+            extra={
+                "token": token,
+                "requested_input": input_format,
+                "requested_output": output_format,
+            },
+        )
+
+    except InvalidInput as e:
+        FAILURES.labels(**labels, error=type(e).__name__).inc()
+        outcome = outcome_of(e)
+        logger.warning(
+            "invalid input", extra={"token": token, **labels, "reason": str(e)}
+        )
+        # resubmissions of the same file are rejected at ingest, a failing
+        # range says nothing about the rest of the file
+        if not clip:
+            remember_failure(
+                input_hash or input_digest(file), input_format, output_format, str(e)
+            )
+        progress_recorder.set_progress(100, 100)
+        raise
+
+    except BudgetExceeded as e:
+        FAILURES.labels(**labels, error=type(e).__name__).inc()
+        outcome = outcome_of(e)
+        logger.error(
+            "conversion budget exceeded",
+            extra={"token": token, **labels, "reason": str(e)},
+        )
+        progress_recorder.set_progress(100, 100)
+        raise
 
     except Exception as e:
-        print(f"[convert_task] - error to convert file: {e}")
+        FAILURES.labels(**labels, error=type(e).__name__).inc()
+        logger.exception(
+            "conversion failed",
+            extra={"token": token, **labels, "retries": self.request.retries},
+        )
         progress_recorder.set_progress(100, 100)
-        raise self.retry(exc=e, countdown=10, max_retries=3)
+        retries = self.request.retries
+        final = retries >= settings.CONVERSION_MAX_RETRIES
+        outcome = outcome_of(e)
+        if not final:
+            RETRIES.labels(**labels).inc()
+        raise self.retry(
+            exc=e,
+            countdown=settings.CONVERSION_RETRY_BACKOFF * 2**retries,
+            max_retries=settings.CONVERSION_MAX_RETRIES,
+        )
+
+    finally:
+        timer.observe(**labels)
+        if profiling:
+            profiling.finish(token, self.request.id, labels, succeeded)
+        if final:
+            _job_done(token, self.request.id, labels, outcome)
+            if input_hash:
+                release_inflight(
+                    input_hash, input_format, output_format, token, profile, clip
+                )
 
 
 @shared_task(bind=True)
-def cleanup_temp_folder(self):
-    now = time.time()
-    max_age = settings.FILE_TTL
+def convert_many_task(
+    self, file, input_format, targets, input_hash=None, profile=None, clip=None
+):
+    # targets maps each output format to the token its result is stored under
+    progress_recorder = ProgressRecorder(self)
+    timer = StageTimer()
+    labels = {
+        "input_format": UNKNOWN,
+        "output_format": MULTI_TARGET,
+        "engine": UNKNOWN,
+    }
+
+    wait = queue_wait(self.request)
+    if wait is not None:
+        timer.add("queue_wait", wait)
+
+    job_started(*targets.values())
+    outcome = None
+    unsupported = set()
+    final = True
 
     try:
-        with os.scandir(settings.TEMP_DIR) as entries:
-            for entry in entries:
-                if not entry.is_file():
-                    continue
-                stat = entry.stat()
-                age = now - stat.st_mtime
-                if age <= max_age:
-                    continue
+        if is_cancelled(self.request.id):
+            raise Cancelled()
+        tokens = {}
+        with timer.stage("catalog_lookup"):
+            for requested, token in targets.items():
                 try:
-                    # in future all prints = logs
-                    os.remove(entry.path)
-                    print(f"[cleanup_temp_folder] - removed file: {entry.path}")
-                except PermissionError:
-                    print(
-                        f"[cleanup_temp_folder] - permission denied: {entry.path}, skipping"
+                    conversion, output_format = get_conversion(input_format, requested)
+                except FormatConversion.DoesNotExist:
+                    logger.warning(
+                        "unsupported conversion",
+                        extra={
+                            "token": token,
+                            "requested_input": input_format,
+                            "requested_output": requested,
+                        },
                     )
-                except FileNotFoundError:
-                    pass
-                except Exception as e:
-                    print(
-                        f"[cleanup_temp_folder] - error to delete file {entry.path}: {e}"
+                    unsupported.add(token)
+                    continue
+                tokens[output_format] = token
+            if not tokens:
+                return {}
+            format_type = conversion.input_format.file_type
+            converter_map = get_converter_map(format_type)
+            converter_class = get_converter_class(converter_map.class_path)
+        progress_recorder.set_progress(25, 100)
+
+        labels["input_format"] = conversion.input_format.name
+        labels["engine"] = converter_class.engine or UNKNOWN
+        converter = converter_class()
+        with timer.stage("convert"), memory_budget(converter.limits["memory"]):
+            out_files = converter.convert_many(
+                file, input_format, list(tokens), profile, clip
+            )
+        if is_cancelled(self.request.id):
+            raise Cancelled()
+
+        progress_recorder.set_progress(75, 100)
+        with timer.stage("result_write"):
+            paths = {
+                output_format: _store_result(tokens[output_format], output_format, f)
+                for output_format, f in out_files.items()
+            }
+        progress_recorder.set_progress(100, 100)
+        outcome = outcome_of(None)
+
+        logger.info(
+            "conversion finished",
+            extra={"tokens": tokens, **labels, "stages": timer.durations},
+        )
+        return paths
+
+    except Cancelled:
+        final = False
+        _finish_cancelled(
+            self,
+            self.request.id,
+            input_format,
+            targets,
+            input_hash,
+            profile,
+            clip,
+            labels["engine"],
+        )
+        raise Ignore()
+
+    except InvalidInput as e:
+        FAILURES.labels(**labels, error=type(e).__name__).inc()
+        outcome = outcome_of(e)
+        logger.warning(
+            "invalid input", extra={"tokens": targets, **labels, "reason": str(e)}
+        )
+        # the shared decode failed, that holds for every target
+        digest = input_hash or input_digest(file)
+        if not clip:
+            for output_format in targets:
+                remember_failure(digest, input_format, output_format, str(e))
+        progress_recorder.set_progress(100, 100)
+        raise
+
+    except BudgetExceeded as e:
+        FAILURES.labels(**labels, error=type(e).__name__).inc()
+        outcome = outcome_of(e)
+        logger.error(
+            "conversion budget exceeded",
+            extra={"tokens": targets, **labels, "reason": str(e)},
+        )
+        progress_recorder.set_progress(100, 100)
+        raise
+
+    except Exception as e:
+        FAILURES.labels(**labels, error=type(e).__name__).inc()
+        logger.exception(
+            "conversion failed",
+            extra={"tokens": targets, **labels, "retries": self.request.retries},
+        )
+        progress_recorder.set_progress(100, 100)
+        retries = self.request.retries
+        final = retries >= settings.CONVERSION_MAX_RETRIES
+        outcome = outcome_of(e)
+        if not final:
+            RETRIES.labels(**labels).inc()
+        raise self.retry(
+            exc=e,
+            countdown=settings.CONVERSION_RETRY_BACKOFF * 2**retries,
+            max_retries=settings.CONVERSION_MAX_RETRIES,
+        )
+
+    finally:
+        timer.observe(**labels)
+        if final:
+            for output_format, token in targets.items():
+                _job_done(
+                    token,
+                    self.request.id,
+                    {**labels, "output_format": normalize_format(output_format)},
+                    JobOutcome.UNSUPPORTED if token in unsupported else outcome,
+                )
+                if input_hash:
+                    release_inflight(
+                        input_hash, input_format, output_format, token, profile, clip
                     )
+
+
+def _lead_batch(task, output_format):
+    gather_batch(output_format)
+    jobs, waiting = take_batch(output_format)
+    if waiting:
+        # leftovers go to another worker instead of queueing behind this batch
+        doc_batch_task.apply_async(
+            (output_format,), **task_time_limits(FormatType.DOCUMENT)
+        )
+    for job in jobs:
+        if is_expired(job):
+            # stranded until nobody waits on it anymore
+            _settle_batch_job(
+                task, job, ConversionError("Сonversion failed: batch expired")
+            )
+    jobs = [job for job in jobs if not is_expired(job)]
+    if not jobs:
+        return
+
+    # the batch runs in the leader's time limit, the documents it has no
+    # verdict for by then are converted one by one in tasks of their own
+    limits = get_conversion_limits(FormatType.DOCUMENT)
+    timeout = max(
+        limits["soft_time_limit"]
+        - settings.DOC_BATCH_WINDOW
+        - settings.DOC_BATCH_FINISH_TIME,
+        1,
+    )
+    _convert_staged(task, jobs, output_format, timeout)
+
+
+def _convert_staged(task, jobs, output_format, timeout=None):
+    converter = get_converter_class(jobs[0]["class_path"])()
+    input_paths = [job["input_path"] for job in jobs]
+    start = time.perf_counter()
+    try:
+        with memory_budget(converter.limits["memory"]):
+            results = converter.convert_batch(input_paths, output_format, timeout)
+    except Exception as e:
+        error = converter._conversion_error(e)
+        results = {path: error for path in input_paths}
+    logger.info(
+        "batch converted",
+        extra={
+            "output_format": output_format,
+            "jobs": len(jobs),
+            "converted": len(results),
+            "seconds": time.perf_counter() - start,
+        },
+    )
+
+    for job in jobs:
+        _settle_batch_job(task, job, results.get(job["input_path"]))
+
+
+def _settle_batch_job(task, job, outcome):
+    # one job failing to finish leaves the others in the batch to theirs,
+    # without an outcome the job gets a run of its own
+    try:
+        if outcome is None:
+            doc_job_task.apply_async((job,), **task_time_limits(FormatType.DOCUMENT))
+        else:
+            _finish_batch_job(task, job, outcome)
+    except Exception:
+        logger.exception("batched job not finished", extra={"token": job["token"]})
+
+
+def _retry_batch_job(job, outcome, labels):
+    # like a single conversion, an engine that died or a failed write gets
+    # another attempt, a verdict on the input or the budget doesn't
+    retries = job.get("retries", 0)
+    if isinstance(outcome, ConversionError) and not isinstance(
+        outcome, EngineUnavailable
+    ):
+        return False
+    if retries >= settings.CONVERSION_MAX_RETRIES:
+        return False
+    RETRIES.labels(**labels).inc()
+    doc_job_task.apply_async(
+        ({**job, "retries": retries + 1},),
+        countdown=settings.CONVERSION_RETRY_BACKOFF * 2**retries,
+        **task_time_limits(FormatType.DOCUMENT),
+    )
+    return True
+
+
+def _finish_batch_job(task, job, outcome):
+    token = job["token"]
+    labels = {
+        "input_format": job["input_format"],
+        "output_format": job["output_format"],
+        "engine": "libreoffice",
+    }
+    # the staged input and the claim stay with a retried job
+    retried = False
+    try:
+        if is_cancelled(job["task_id"]):
+            # converted along with the batch, nobody wants the result
+            _finish_cancelled(
+                task,
+                job["task_id"],
+                job["input_format"],
+                {job["output_format"]: token},
+                engine=labels["engine"],
+            )
+            return
+        if not isinstance(outcome, Exception):
+            try:
+                result_name = _store_result(token, job["output_format"], outcome)
+            except Exception as e:
+                logger.exception("batched result not stored", extra={"token": token})
+                outcome = e
+            else:
+                task.backend.mark_as_done(job["task_id"], result_name)
+                _job_done(token, job["task_id"], labels, outcome_of(None))
+                return
+
+        FAILURES.labels(**labels, error=type(outcome).__name__).inc()
+        logger.warning(
+            "batched conversion failed",
+            extra={"token": token, **labels, "reason": str(outcome)},
+        )
+        retried = _retry_batch_job(job, outcome, labels)
+        if retried:
+            return
+        if isinstance(outcome, InvalidInput) and job["input_hash"]:
+            remember_failure(
+                job["input_hash"],
+                job["input_format"],
+                job["output_format"],
+                str(outcome),
+            )
+        task.backend.mark_as_failure(job["task_id"], outcome)
+        _job_done(token, job["task_id"], labels, outcome_of(outcome))
+    finally:
+        if not retried:
+            _release_batch_job(job)
+
+
+def _release_batch_job(job):
+    try:
+        os.remove(job["input_path"])
+    except FileNotFoundError:
+        pass
+    if job["input_hash"]:
+        release_inflight(
+            job["input_hash"],
+            job["input_format"],
+            job["output_format"],
+            job["token"],
+            job.get("profile"),
+        )
+
+
+@shared_task(bind=True)
+def doc_batch_task(self, output_format):
+    if claim_batch(output_format):
+        with uncancellable():
+            _lead_batch(self, output_format)
+
+
+@shared_task(bind=True)
+def doc_job_task(self, job):
+    # a document its batch had no verdict for, with a time limit of its own
+    with uncancellable():
+        _convert_staged(self, [job], job["output_format"])
+
+
+@shared_task
+def reclaim_doc_batches():
+    for output_format in stranded_batches():
+        logger.warning(
+            "stranded document batch reclaimed", extra={"output_format": output_format}
+        )
+        doc_batch_task.apply_async(
+            (output_format,), **task_time_limits(FormatType.DOCUMENT)
+        )
+
+
+SEGMENTS_START = 40
+SEGMENTS_END = 90
+
+
+class _ProgressOf:
+    # lets a ProgressRecorder report on the task id the client polls
+    def __init__(self, task, task_id):
+        self.task = task
+        self.task_id = task_id
+
+    def update_state(self, state, meta):
+        self.task.update_state(task_id=self.task_id, state=state, meta=meta)
+
+
+def _segment_workflow(
+    class_path,
+    format_type,
+    work_dir,
+    segments,
+    input_format,
+    output_format,
+    token,
+    input_hash,
+    progress_id,
+    profile,
+):
+    options = task_time_limits(format_type)
+    # known before they are sent, a cancel request revokes them with the job
+    piece_ids = [str(uuid.uuid4()) for _ in segments]
+    add_pieces(progress_id, piece_ids)
+    header = group(
+        encode_segment_task.s(
+            path,
+            class_path,
+            input_format,
+            output_format,
+            token,
+            progress_id,
+            len(segments),
+            profile,
+            input_hash,
+        ).set(task_id=piece_id, **options)
+        for path, piece_id in zip(segments, piece_ids)
+    )
+    job = (
+        work_dir,
+        class_path,
+        input_format,
+        output_format,
+        token,
+        input_hash,
+        profile,
+    )
+    body = join_segments_task.s(*job).set(**options)
+    # a failed segment fails the chord, the join never runs to finish the job
+    body.on_error(fail_segmented_job.s(*job))
+    return chord(header, body)
+
+
+@shared_task(bind=True)
+def encode_segment_task(
+    self,
+    segment_path,
+    class_path,
+    input_format,
+    output_format,
+    token,
+    progress_id,
+    total,
+    profile=None,
+    input_hash=None,
+):
+    converter = get_converter_class(class_path)()
+    timer = StageTimer()
+    labels = {
+        "input_format": input_format,
+        "output_format": output_format,
+        "engine": converter.engine or UNKNOWN,
+    }
+
+    try:
+        if is_cancelled(progress_id):
+            raise Cancelled()
+        with timer.stage("segment_encode"), memory_budget(converter.limits["memory"]):
+            part = converter.encode_segment(
+                segment_path, input_format, output_format, profile
+            )
+
+    except Cancelled:
+        _finish_cancelled(
+            self,
+            progress_id,
+            input_format,
+            {output_format: token},
+            input_hash,
+            profile,
+            engine=labels["engine"],
+            work_dir=os.path.dirname(segment_path),
+        )
+        raise Ignore()
+
+    except (InvalidInput, BudgetExceeded) as e:
+        FAILURES.labels(**labels, error=type(e).__name__).inc()
+        logger.error(
+            "segment failed",
+            extra={"token": token, **labels, "segment": segment_path, "reason": str(e)},
+        )
+        raise
+
     except Exception as e:
-        print(
-            f"[cleanup_temp_folder] - failed to scan directory {settings.TEMP_DIR}: {e}"
+        FAILURES.labels(**labels, error=type(e).__name__).inc()
+        logger.exception(
+            "segment failed",
+            extra={"token": token, **labels, "segment": segment_path},
+        )
+        retries = self.request.retries
+        if retries < settings.CONVERSION_MAX_RETRIES:
+            RETRIES.labels(**labels).inc()
+        raise self.retry(
+            exc=e,
+            countdown=settings.CONVERSION_RETRY_BACKOFF * 2**retries,
+            max_retries=settings.CONVERSION_MAX_RETRIES,
+        )
+
+    finally:
+        timer.observe(**labels)
+
+    counter = f"segments:{token}"
+    done = redis_client.incr(counter)
+    redis_client.expire(counter, settings.WORK_DIR_TTL)
+    # a failed sibling already finished the job, don't flip it back to progress
+    if self.AsyncResult(progress_id).state not in READY_STATES:
+        ProgressRecorder(_ProgressOf(self, progress_id)).set_progress(
+            SEGMENTS_START + (SEGMENTS_END - SEGMENTS_START) * done // total, 100
+        )
+    return part
+
+
+@shared_task(bind=True)
+def join_segments_task(
+    self,
+    parts,
+    work_dir,
+    class_path,
+    input_format,
+    output_format,
+    token,
+    input_hash,
+    profile=None,
+):
+    converter = get_converter_class(class_path)()
+    timer = StageTimer()
+    labels = {
+        "input_format": input_format,
+        "output_format": output_format,
+        "engine": converter.engine or UNKNOWN,
+    }
+    outcome = None
+    cancelled = False
+
+    try:
+        if is_cancelled(self.request.id):
+            raise Cancelled()
+        output_path = os.path.join(work_dir, f"output.{output_format}")
+        with timer.stage("segment_join"):
+            converter.join(parts, output_path)
+
+        filename = f"{token}{uuid.uuid4().hex[:8]}.{output_format}"
+        with timer.stage("result_write"):
+            job_output(token, os.path.getsize(output_path))
+            get_result_storage().save_file(filename, output_path)
+            redis_client.setex(f"path:{token}", settings.FILE_TTL, filename)
+        outcome = outcome_of(None)
+
+        logger.info(
+            "conversion finished",
+            extra={"token": token, **labels, "segments": len(parts)},
+        )
+        return filename
+
+    except Cancelled:
+        cancelled = True
+        _finish_cancelled(
+            self,
+            self.request.id,
+            input_format,
+            {output_format: token},
+            input_hash,
+            profile,
+            engine=labels["engine"],
+            work_dir=work_dir,
+        )
+        raise Ignore()
+
+    except Exception as e:
+        FAILURES.labels(**labels, error=type(e).__name__).inc()
+        outcome = outcome_of(e)
+        logger.exception("segment join failed", extra={"token": token, **labels})
+        raise
+
+    finally:
+        timer.observe(**labels)
+        if not cancelled:
+            _job_done(token, self.request.id, labels, outcome)
+            shutil.rmtree(work_dir, ignore_errors=True)
+            redis_client.delete(f"segments:{token}")
+            if input_hash:
+                release_inflight(
+                    input_hash, input_format, output_format, token, profile
+                )
+
+
+@shared_task
+def fail_segmented_job(
+    request,
+    exc,
+    traceback,
+    work_dir,
+    class_path,
+    input_format,
+    output_format,
+    token,
+    input_hash,
+    profile=None,
+):
+    # the chord reports a ChordError, the segment that failed stored the cause
+    for piece_id in job_pieces(request.id):
+        piece = fail_segmented_job.AsyncResult(piece_id)
+        if piece.failed():
+            exc = piece.result
+            break
+    labels = {
+        "input_format": input_format,
+        "output_format": output_format,
+        "engine": get_converter_class(class_path).engine or UNKNOWN,
+    }
+    logger.error(
+        "segmented conversion failed",
+        extra={"token": token, **labels, "reason": str(exc)},
+    )
+    _job_done(token, request.id, labels, outcome_of(exc))
+    shutil.rmtree(work_dir, ignore_errors=True)
+    redis_client.delete(f"segments:{token}")
+    if input_hash:
+        if isinstance(exc, InvalidInput):
+            remember_failure(input_hash, input_format, output_format, str(exc))
+        release_inflight(input_hash, input_format, output_format, token, profile)
+
+
+@shared_task(bind=True)
+def cleanup_temp_folder(self):
+    now = time.time()
+
+    try:
+        # no-op for object stores, their lifecycle rule expires results
+        get_result_storage().expire(settings.FILE_TTL)
+
+        # leftovers of segmented and batched jobs that never finished
+        for work_dir in (settings.SEGMENT_DIR, settings.BATCH_DIR):
+            with os.scandir(work_dir) as entries:
+                for entry in entries:
+                    try:
+                        if now - entry.stat().st_mtime <= settings.WORK_DIR_TTL:
+                            continue
+                        if entry.is_dir():
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                        else:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                    logger.info("removed stale work entry", extra={"path": entry.path})
+    except Exception as e:
+        logger.exception(
+            "failed to scan directory", extra={"path": str(settings.TEMP_DIR)}
         )
         raise self.retry(exc=e, countdown=10, max_retries=3)
+
+
+@shared_task
+def flush_job_history():
+    flushed = flush_history()
+    if flushed:
+        logger.info("job history flushed", extra={"jobs": flushed})
+
+
+@shared_task
+def rollup_job_history():
+    now = datetime.now(timezone.utc)
+    # yesterday too, its last jobs may have been flushed after midnight
+    for day in (now.date() - timedelta(days=1), now.date()):
+        rollup_day(day)
+    prune_history(now)
+
+
+@shared_task
+def deliver_webhook(token, hook, result, attempt=0):
+    # attempts are counted here, waiting for a free slot doesn't use one up
+    api_key_id = hook["api_key_id"]
+    if not acquire_slot(api_key_id):
+        deliver_webhook.apply_async(
+            (token, hook, result),
+            {"attempt": attempt},
+            countdown=settings.WEBHOOK_THROTTLE_DELAY,
+        )
+        return
+
+    try:
+        send_webhook(token, hook, result)
+    except WebhookError as e:
+        attempt += 1
+        extra = {"token": token, "url": hook["url"], "attempt": attempt}
+        if isinstance(e, WebhookRejected) or attempt >= settings.WEBHOOK_MAX_ATTEMPTS:
+            logger.warning("webhook dead-lettered", extra={**extra, "reason": str(e)})
+            dead_letter(token, hook, result, attempt, e)
+            return
+        logger.info("webhook delivery failed", extra={**extra, "reason": str(e)})
+        deliver_webhook.apply_async(
+            (token, hook, result),
+            {"attempt": attempt},
+            countdown=settings.WEBHOOK_RETRY_BACKOFF * 2 ** (attempt - 1),
+        )
+    else:
+        logger.info("webhook delivered", extra={"token": token, "url": hook["url"]})
+    finally:
+        release_slot(api_key_id)
+
+
+@shared_task
+def preview_task(key, file, input_format, size):
+    # the web process waits on the cache entry, the result carries errors only
+    store_preview(key, file, input_format, size)
@@ -0,0 +1,5 @@
+import os
+
+# celery reads these before the project's settings, tests run without a broker
+os.environ.setdefault("CELERY_BROKER_URL", "memory://")
+os.environ.setdefault("CELERY_RESULT_BACKEND", "cache+memory://")
@@ -0,0 +1,53 @@
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from converter.benchmarks.loadtest import fake_redis
+from converter.models import ConverterMap, FileFormat, FormatConversion
+
+
+CONVERTERS = {
+    "image": "converter.utils.converters.ImageConverter",
+    "document": "converter.utils.converters.DocConverter",
+    "audio": "converter.utils.converters.AudioConverter",
+    "video": "converter.utils.converters.VideoConverter",
+}
+
+
+class StandInsMixin:
+    # the catalog lives in the database, tests add the pairs they use
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        redis = fake_redis()
+        self.redis_server = redis.__enter__()
+        self.addCleanup(redis.__exit__, None, None, None)
+
+    @staticmethod
+    def add_conversion(input_format, output_format, file_type, **fields):
+        ConverterMap.objects.get_or_create(
+            format_type=file_type, defaults={"class_path": CONVERTERS[file_type]}
+        )
+        formats = [
+            FileFormat.objects.get_or_create(
+                name=name, defaults={"file_type": file_type}
+            )[0]
+            for name in (input_format, output_format)
+        ]
+        return FormatConversion.objects.create(
+            input_format=formats[0], output_format=formats[1], **fields
+        )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class ConverterTestCase(StandInsMixin, TestCase):
+    pass
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class ConverterTransactionTestCase(StandInsMixin, TransactionTestCase):
+    # for code that reads the database from another thread, sync_to_async
+    # with thread_sensitive=False can't see a test's open transaction
+    pass
@@ -0,0 +1,217 @@
+import json
+import os
+import subprocess
+import tempfile
+import time
+from unittest import mock
+from celery.result import AsyncResult
+from celery.utils import uuid
+from django.test import override_settings
+from converter import tasks
+from converter.utils import batching, converters
+from converter.utils.batching import add_job, claim_batch, gather_batch, stage_input
+from converter.utils.converters import DocConverter
+from converter.utils.errors import BudgetExceeded, EngineUnavailable
+from converter.utils.redis_ext_client import redis_client
+from .base import CONVERTERS, ConverterTestCase
+
+
+def fake_libreoffice(cmd, timeout=None, memory=None, skip=()):
+    # writes an output for every input, as a batch run does
+    out_dir = cmd[cmd.index("--outdir") + 1]
+    for path in cmd[cmd.index("--outdir") + 2 :]:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if stem in skip:
+            continue
+        with open(os.path.join(out_dir, f"{stem}.pdf"), "wb") as f:
+            f.write(b"%PDF " + stem.encode())
+
+
+class BatchTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        paths = override_settings(TEMP_DIR=work_dir.name, BATCH_DIR=work_dir.name)
+        paths.enable()
+        self.addCleanup(paths.disable)
+
+    def job(self, token, staged_at=None):
+        job = {
+            # results of earlier tests stay in the memory backend
+            "task_id": uuid(),
+            "token": token,
+            "class_path": CONVERTERS["document"],
+            "input_path": stage_input(token, "docx", b"PK\x03\x04" + token.encode()),
+            "input_format": "docx",
+            "output_format": "pdf",
+            "input_hash": None,
+            "profile": None,
+        }
+        add_job("pdf", job)
+        if staged_at is not None:
+            # rewritten in place, add_job stamps the time itself
+            job["staged_at"] = staged_at
+            redis_client.lset("docbatch:pdf", -1, json.dumps(job))
+        return {**job, "staged_at": staged_at or time.time()}
+
+    def lead(self):
+        task = mock.Mock(backend=tasks.doc_batch_task.backend)
+        with mock.patch.object(tasks, "gather_batch"), self.assertLogs(
+            "converter.tasks", "INFO"
+        ):
+            tasks._lead_batch(task, "pdf")
+
+    def test_batch_converts_every_job(self):
+        jobs = [self.job("a"), self.job("b")]
+        with mock.patch.object(converters, "run_engine", fake_libreoffice):
+            self.lead()
+        for job in jobs:
+            self.assertEqual(AsyncResult(job["task_id"]).state, "SUCCESS")
+            self.assertFalse(os.path.exists(job["input_path"]))
+
+    @override_settings(DOC_BATCH_FINISH_TIME=10)
+    def test_batch_runs_in_the_leaders_time_limit(self):
+        self.job("a")
+        engine = mock.Mock(wraps=fake_libreoffice)
+        with mock.patch.object(converters, "run_engine", engine):
+            self.lead()
+        soft_limit = DocConverter().limits["soft_time_limit"]
+        self.assertLess(engine.call_args.kwargs["timeout"], soft_limit)
+
+    def test_timed_out_batch_falls_back_per_document(self):
+        jobs = [self.job("a"), self.job("b")]
+        timeout = subprocess.TimeoutExpired("libreoffice", 1)
+        with mock.patch.object(
+            converters, "run_engine", side_effect=timeout
+        ), mock.patch.object(tasks.doc_job_task, "apply_async") as requeue:
+            self.lead()
+        self.assertEqual(
+            [call.args[0][0]["token"] for call in requeue.call_args_list], ["a", "b"]
+        )
+        # each one runs in a time limit of its own
+        self.assertEqual(
+            requeue.call_args.kwargs["soft_time_limit"],
+            DocConverter().limits["soft_time_limit"],
+        )
+        for job in jobs:
+            self.assertFalse(AsyncResult(job["task_id"]).ready())
+            self.assertTrue(os.path.exists(job["input_path"]))
+
+    def test_document_alone_gets_a_verdict(self):
+        job = self.job("a")
+        redis_client.delete("docbatch:pdf")
+        timeout = subprocess.TimeoutExpired("libreoffice", 1)
+        with mock.patch.object(
+            converters, "run_engine", side_effect=timeout
+        ), self.assertLogs("converter.tasks", "INFO"):
+            tasks.doc_job_task.apply((job,))
+        result = AsyncResult(job["task_id"])
+        self.assertEqual(result.state, "FAILURE")
+        self.assertIsInstance(result.result, BudgetExceeded)
+
+    def test_expired_jobs_are_failed_not_converted(self):
+        stale = self.job("old", staged_at=time.time() - 3600)
+        fresh = self.job("new")
+        engine = mock.Mock(wraps=fake_libreoffice)
+        with mock.patch.object(converters, "run_engine", engine):
+            self.lead()
+        self.assertEqual(AsyncResult(stale["task_id"]).state, "FAILURE")
+        self.assertEqual(AsyncResult(fresh["task_id"]).state, "SUCCESS")
+        self.assertNotIn(stale["input_path"], engine.call_args.args[0])
+        self.assertFalse(os.path.exists(stale["input_path"]))
+
+    @override_settings(DOC_BATCH_WINDOW=60, DOC_BATCH_MAX_SIZE=2)
+    def test_full_batch_is_taken_at_once(self):
+        self.job("a")
+        self.job("b")
+        start = time.monotonic()
+        gather_batch("pdf")
+        self.assertLess(time.monotonic() - start, 5)
+
+    @override_settings(DOC_BATCH_WINDOW=0.1)
+    def test_partial_batch_waits_out_the_window(self):
+        self.job("a")
+        start = time.monotonic()
+        gather_batch("pdf")
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+    @override_settings(CONVERSION_MAX_RETRIES=0)
+    def test_failed_write_leaves_the_others_alone(self):
+        jobs = [self.job("a"), self.job("b")]
+        store = tasks._store_result
+
+        def flaky_store(token, output_format, out_file):
+            if token == "a":
+                raise OSError("storage unreachable")
+            return store(token, output_format, out_file)
+
+        with mock.patch.object(
+            converters, "run_engine", fake_libreoffice
+        ), mock.patch.object(tasks, "_store_result", flaky_store):
+            self.lead()
+        self.assertEqual(AsyncResult(jobs[0]["task_id"]).state, "FAILURE")
+        self.assertEqual(AsyncResult(jobs[1]["task_id"]).state, "SUCCESS")
+        for job in jobs:
+            self.assertFalse(os.path.exists(job["input_path"]))
+
+    def test_job_that_raises_while_finishing_leaves_the_others_alone(self):
+        jobs = [self.job("a"), self.job("b")]
+        finish = tasks._finish_batch_job
+
+        def broken_finish(task, job, outcome):
+            if job["token"] == "a":
+                raise ConnectionError("redis went away")
+            return finish(task, job, outcome)
+
+        with mock.patch.object(
+            converters, "run_engine", fake_libreoffice
+        ), mock.patch.object(tasks, "_finish_batch_job", broken_finish):
+            self.lead()
+        self.assertEqual(AsyncResult(jobs[1]["task_id"]).state, "SUCCESS")
+
+    @override_settings(CONVERSION_MAX_RETRIES=2, CONVERSION_RETRY_BACKOFF=5)
+    def test_missing_output_is_retried(self):
+        jobs = [self.job("a"), self.job("b")]
+        engine = mock.Mock(
+            side_effect=lambda *a, **kw: fake_libreoffice(*a, **kw, skip={"a"})
+        )
+        with mock.patch.object(converters, "run_engine", engine), mock.patch.object(
+            tasks.doc_job_task, "apply_async"
+        ) as requeue:
+            self.lead()
+        ((job,),) = requeue.call_args.args
+        self.assertEqual((job["token"], job["retries"]), ("a", 1))
+        self.assertEqual(requeue.call_args.kwargs["countdown"], 5)
+        self.assertFalse(AsyncResult(jobs[0]["task_id"]).ready())
+        self.assertTrue(os.path.exists(jobs[0]["input_path"]))
+        self.assertEqual(AsyncResult(jobs[1]["task_id"]).state, "SUCCESS")
+
+        # the last attempt fails the job
+        with mock.patch.object(converters, "run_engine", engine), self.assertLogs(
+            "converter.tasks", "INFO"
+        ):
+            tasks.doc_job_task.apply(({**job, "retries": 2},))
+        result = AsyncResult(jobs[0]["task_id"])
+        self.assertEqual(result.state, "FAILURE")
+        self.assertIsInstance(result.result, EngineUnavailable)
+        self.assertFalse(os.path.exists(jobs[0]["input_path"]))
+
+    def test_stranded_batch_is_reclaimed(self):
+        self.job("a", staged_at=time.time() - 120)
+        with mock.patch.object(
+            tasks.doc_batch_task, "apply_async"
+        ) as reclaim, self.assertLogs("converter.tasks", "WARNING"):
+            tasks.reclaim_doc_batches()
+        reclaim.assert_called_once()
+        self.assertEqual(reclaim.call_args.args[0], ("pdf",))
+
+    def test_gathering_batch_is_left_alone(self):
+        self.job("a", staged_at=time.time() - 120)
+        self.assertTrue(claim_batch("pdf"))
+        self.assertEqual(list(batching.stranded_batches()), [])
+
+    def test_fresh_jobs_are_left_alone(self):
+        # their leader may be about to claim the batch
+        self.job("a")
+        self.assertEqual(list(batching.stranded_batches()), [])
@@ -0,0 +1,143 @@
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+from converter.benchmarks.fixtures import build_fixtures
+from converter.benchmarks.runner import compare, run_isolated
+from converter.management.commands import benchmark_converters
+from converter.models import FormatType
+
+
+class EchoConverter:
+    def convert(self, file, input_format, output_format):
+        return io.BytesIO(file * 2)
+
+
+class BrokenConverter:
+    def convert(self, file, input_format, output_format):
+        raise ValueError("broken input")
+
+
+class StuckConverter:
+    def convert(self, file, input_format, output_format):
+        time.sleep(60)
+
+
+def result(key, **metrics):
+    values = {"wall_s": 1.0, "cpu_s": 1.0, "peak_rss_kb": 1000, "output_bytes": 100}
+    return {"key": key, "status": "ok", **values, **metrics}
+
+
+class RunIsolatedTests(SimpleTestCase):
+    def run_converter(self, name, timeout=30):
+        return run_isolated(f"{__name__}.{name}", b"data", "png", "jpeg", timeout)
+
+    def test_measures_the_conversion(self):
+        measured = self.run_converter("EchoConverter")
+        self.assertEqual(measured["status"], "ok")
+        self.assertEqual(measured["output_bytes"], 8)
+        self.assertGreater(measured["peak_rss_kb"], 0)
+        self.assertGreaterEqual(measured["wall_s"], 0)
+
+    def test_failure_is_reported(self):
+        self.assertEqual(
+            self.run_converter("BrokenConverter"),
+            {"status": "error", "error": "broken input"},
+        )
+
+    def test_stuck_conversion_is_killed(self):
+        self.assertEqual(
+            self.run_converter("StuckConverter", timeout=0.5),
+            {"status": "error", "error": "timed out after 0.5s"},
+        )
+
+
+class FixtureTests(SimpleTestCase):
+    def test_fixtures_are_the_same_every_run(self):
+        def build():
+            fixtures = build_fixtures(FormatType.IMAGE, ["png", "bmp"], None, True)
+            return [(f.key, f.data) for f in fixtures]
+
+        first = build()
+        self.assertEqual([key for key, _ in first], ["bmp@256px", "png@256px"])
+        self.assertEqual(build(), first)
+
+    def test_sizes_can_be_picked(self):
+        fixtures = build_fixtures(
+            FormatType.DOCUMENT, ["markdown", "html"], None, sizes=(3,)
+        )
+        by_key = {f.key: f.data for f in fixtures}
+        self.assertEqual(sorted(by_key), ["html@3p", "markdown@3p"])
+        self.assertTrue(by_key["html@3p"].startswith(b"<!DOCTYPE html>"))
+
+
+class CompareTests(SimpleTestCase):
+    def test_regressions_above_the_threshold(self):
+        baseline = {"results": [result("png->jpeg"), result("png->webp")]}
+        results = [
+            result("png->jpeg", wall_s=1.5, peak_rss_kb=1100),
+            result("png->webp", output_bytes=200),
+        ]
+        regressions = compare(results, baseline, 0.15)
+        self.assertEqual(
+            [(r["key"], r["metric"]) for r in regressions],
+            [("png->jpeg", "wall_s"), ("png->webp", "output_bytes")],
+        )
+        self.assertAlmostEqual(regressions[0]["change"], 0.5)
+
+    def test_noise_and_missing_results_are_ignored(self):
+        baseline = {
+            "results": [
+                result("fast", wall_s=0.001),
+                {"key": "failed", "status": "error", "error": "x"},
+            ]
+        }
+        results = [
+            # three times slower, but only by a millisecond or two
+            result("fast", wall_s=0.003),
+            result("failed", wall_s=100),
+            result("new", wall_s=100),
+            {"key": "broken", "status": "error", "error": "x"},
+        ]
+        self.assertEqual(compare(results, baseline, 0.15), [])
+
+
+class BenchmarkCommandTests(SimpleTestCase):
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.report = os.path.join(work_dir.name, "report.json")
+        self.baseline = os.path.join(work_dir.name, "baseline.json")
+        with open(self.baseline, "w") as f:
+            json.dump({"results": [result("png@256px->jpeg")]}, f)
+
+    def run_command(self, *results):
+        out = io.StringIO()
+        with mock.patch.object(
+            benchmark_converters, "run_benchmarks", return_value=iter(results)
+        ):
+            call_command(
+                "benchmark_converters",
+                output=self.report,
+                baseline=self.baseline,
+                stdout=out,
+            )
+        return out.getvalue()
+
+    def test_report_is_saved(self):
+        out = self.run_command(result("png@256px->jpeg"))
+        self.assertIn("No regressions against baseline", out)
+        with open(self.report) as f:
+            report = json.load(f)
+        self.assertEqual(report["results"], [result("png@256px->jpeg")])
+        self.assertIn("packages", report["environment"])
+
+    def test_regression_fails_the_command(self):
+        with self.assertRaisesMessage(CommandError, "1 regressions above 15%"):
+            self.run_command(result("png@256px->jpeg", cpu_s=2.0))
+        # saved anyway, it becomes the next baseline once the change is accepted
+        self.assertTrue(os.path.exists(self.report))
@@ -0,0 +1,116 @@
+from unittest import mock
+from asgiref.sync import async_to_sync
+from converter.models import FormatType
+from converter.utils import cancellation, submission
+from converter.utils.cancellation import (
+    CANCELLED,
+    DETACHED,
+    FINISHED,
+    cancel,
+    is_cancelled,
+)
+from converter.utils.redis_ext_client import redis_client
+from .base import ConverterTransactionTestCase
+from .test_submission import png
+
+
+class CancelTests(ConverterTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("png", "webp", FormatType.IMAGE)
+        app = mock.patch.object(cancellation, "current_app")
+        self.broadcast = app.start().control.broadcast
+        self.addCleanup(app.stop)
+        enqueue = mock.patch.object(submission, "enqueue")
+        self.enqueue = enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def submit(self, output_format="jpeg"):
+        # identical submissions of the same file coalesce into one job
+        return async_to_sync(submission.submit_conversion)(png(), "png", output_format)
+
+    def cancel(self, token):
+        return async_to_sync(cancel)(token)
+
+    def task_id(self, token):
+        return redis_client.get(f"conv:{token}").decode()
+
+    def watchers(self, task_id):
+        return int(redis_client.get(f"watchers:{task_id}"))
+
+    def test_last_watcher_cancels_the_job(self):
+        token = self.submit()
+        self.assertEqual(self.cancel(token), CANCELLED)
+        task_id = self.task_id(token)
+        self.assertTrue(is_cancelled(task_id))
+        self.broadcast.assert_called_once_with(
+            "cancel_jobs", arguments={"task_ids": [task_id]}
+        )
+
+    def test_coalesced_job_is_cancelled_once_nobody_waits(self):
+        first, second = self.submit(), self.submit()
+        self.enqueue.assert_awaited_once()
+        task_id = self.task_id(first)
+        self.assertEqual(self.cancel(second), DETACHED)
+        self.assertFalse(is_cancelled(task_id))
+        self.assertEqual(self.watchers(task_id), 1)
+        self.broadcast.assert_not_called()
+
+        self.assertEqual(self.cancel(first), CANCELLED)
+        self.assertTrue(is_cancelled(task_id))
+        self.broadcast.assert_called_once_with(
+            "cancel_jobs", arguments={"task_ids": [task_id]}
+        )
+
+    def test_leader_may_cancel_first(self):
+        first, second = self.submit(), self.submit()
+        self.assertEqual(self.cancel(first), DETACHED)
+        self.assertEqual(self.cancel(second), CANCELLED)
+        self.assertTrue(is_cancelled(self.task_id(first)))
+
+    def test_repeated_cancel_detaches_once(self):
+        first, second = self.submit(), self.submit()
+        task_id = self.task_id(first)
+        for _ in range(3):
+            self.assertEqual(self.cancel(second), DETACHED)
+        self.assertEqual(self.watchers(task_id), 1)
+        self.assertFalse(is_cancelled(task_id))
+        # the other submission still stops it
+        self.assertEqual(self.cancel(first), CANCELLED)
+
+    def test_targets_of_one_submission_are_cancelled_together(self):
+        tokens = async_to_sync(submission.submit_conversions)(
+            png(), "png", ["jpeg", "webp"]
+        )
+        self.assertEqual(self.cancel(tokens["jpeg"]), CANCELLED)
+        self.assertTrue(is_cancelled(self.task_id(tokens["webp"])))
+        self.assertEqual(self.cancel(tokens["webp"]), CANCELLED)
+        self.broadcast.assert_called_once()
+
+    def test_cancelled_job_stays_cancelled(self):
+        token = self.submit()
+        self.cancel(token)
+        self.assertEqual(self.cancel(token), CANCELLED)
+        self.broadcast.assert_called_once()
+
+    def test_pieces_are_cancelled_with_the_job(self):
+        token = self.submit()
+        task_id = self.task_id(token)
+        cancellation.add_pieces(task_id, ["p1", "p2"])
+        self.cancel(token)
+        self.assertTrue(is_cancelled("p1") and is_cancelled("p2"))
+        task_ids = self.broadcast.call_args.kwargs["arguments"]["task_ids"]
+        self.assertEqual(sorted(task_ids), sorted([task_id, "p1", "p2"]))
+
+    def test_finished_job_is_not_cancelled(self):
+        first, second = self.submit(), self.submit()
+        # stored under the token of the submission that led the job
+        redis_client.set(f"path:{first}", "a.jpeg")
+        self.assertEqual(self.cancel(second), FINISHED)
+        task_id = self.task_id(first)
+        self.assertFalse(is_cancelled(task_id))
+        self.assertEqual(self.watchers(task_id), 2)
+
+    def test_unknown_token(self):
+        self.assertIsNone(self.cancel("missing"))
@@ -0,0 +1,194 @@
+import io
+import os
+import subprocess
+import wave
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+from converter.models import FormatType
+from converter.utils import clips
+from converter.utils.clips import clip_tag, input_args, parse_time, probe_duration
+from converter.utils.converters import AudioConverter
+from converter.utils.submission import Rejected, _check_clip, _requested_clip
+from .base import ConverterTestCase
+from .test_submission import SubmissionTestCase, upload
+
+
+def tone(seconds):
+    out = io.BytesIO()
+    with wave.open(out, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(8000)
+        f.writeframes(b"\x00\x10" * int(8000 * seconds))
+    return out.getvalue()
+
+
+class ParseTimeTests(SimpleTestCase):
+    def test_valid_times(self):
+        self.assertIsNone(parse_time(None))
+        self.assertIsNone(parse_time(""))
+        self.assertEqual(parse_time("90"), 90)
+        self.assertEqual(parse_time(2.5), 2.5)
+        self.assertEqual(parse_time("01:30"), 90)
+        self.assertEqual(parse_time(" 1:00:01.5 "), 3601.5)
+
+    def test_invalid_times(self):
+        for value in ("-1", "1:-2", "nan", "inf", "1:2:3:4", "1m", ":"):
+            with self.subTest(value), self.assertRaises(ValueError):
+                parse_time(value)
+
+    def test_ffmpeg_arguments(self):
+        self.assertEqual(input_args(None), [])
+        self.assertEqual(
+            input_args({"start": 1.5, "end": 4}), ["-ss", "1.500", "-t", "2.500"]
+        )
+        self.assertEqual(input_args({"start": 2, "end": None}), ["-ss", "2.000"])
+
+    def test_tags(self):
+        self.assertEqual(clip_tag(None), "")
+        self.assertEqual(clip_tag({"start": 1.5, "end": 4.0}), "1.5-4")
+        self.assertEqual(clip_tag({"start": 0, "end": None}), "0-end")
+
+
+class RequestedClipTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("wav", "flac", FormatType.AUDIO, audio_codec="flac")
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+
+    def rejected(self, *args):
+        with self.assertRaises(Rejected) as cm:
+            _requested_clip(*args)
+        self.assertEqual(cm.exception.status, 422)
+        return str(cm.exception)
+
+    def test_no_range(self):
+        self.assertIsNone(_requested_clip("wav", None, "", None))
+
+    def test_range(self):
+        self.assertEqual(
+            _requested_clip("wav", "1", "0:04", None), {"start": 1, "end": 4}
+        )
+        self.assertEqual(
+            _requested_clip("wav", None, None, "10"), {"start": 0, "end": 10}
+        )
+        # the shorter of the two wins
+        self.assertEqual(_requested_clip("wav", "2", "30", "5"), {"start": 2, "end": 7})
+        self.assertEqual(
+            _requested_clip("wav", "2", None, None), {"start": 2, "end": None}
+        )
+
+    def test_invalid_ranges(self):
+        self.assertIn("seconds or [hh:]mm:ss", self.rejected("wav", "x", None, None))
+        self.assertEqual(
+            self.rejected("wav", "5", "5", None), "The clip must end after it starts"
+        )
+        self.rejected("wav", "5", "2", None)
+        self.rejected("wav", None, None, "0")
+
+    def test_only_media_is_trimmed(self):
+        self.assertEqual(
+            self.rejected("png", "1", None, None), "png files can't be trimmed"
+        )
+
+
+class CheckClipTests(SimpleTestCase):
+    def check(self, clip, file_bin=None):
+        file_bin = tone(3) if file_bin is None else file_bin
+        return async_to_sync(_check_clip)(file_bin, "wav", clip)
+
+    def test_clip_within_the_file(self):
+        self.assertEqual(self.check({"start": 1, "end": 2}), {"start": 1, "end": 2})
+
+    def test_end_past_the_file_is_dropped(self):
+        self.assertEqual(self.check({"start": 1, "end": 60}), {"start": 1, "end": None})
+
+    def test_whole_file_is_no_clip(self):
+        # shares its job with an untrimmed submission of the file
+        self.assertIsNone(self.check({"start": 0, "end": 60}))
+
+    def test_start_past_the_file(self):
+        with self.assertRaisesMessage(Rejected, "starts at 5s, the file is 3s long"):
+            self.check({"start": 5, "end": None})
+
+    def test_unknown_duration_keeps_the_clip(self):
+        self.assertIsNone(probe_duration(b"not audio", "wav"))
+        clip = {"start": 5, "end": None}
+        self.assertEqual(self.check(clip, b"not audio"), clip)
+
+    def test_slow_probe_keeps_the_clip(self):
+        timeout = subprocess.TimeoutExpired("ffmpeg", 15)
+        with mock.patch.object(clips.subprocess, "run", side_effect=timeout):
+            self.assertIsNone(probe_duration(tone(3), "wav"))
+            clip = {"start": 5, "end": None}
+            self.assertEqual(self.check(clip), clip)
+
+    def test_web_tier_without_ffmpeg(self):
+        with mock.patch.dict(os.environ, {"FFMPEG_BINARY": "/nonexistent/ffmpeg"}):
+            self.assertIsNone(probe_duration(tone(3), "wav"))
+
+
+class TrimmedConversionTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("wav", "flac", FormatType.AUDIO, audio_codec="flac")
+        self.add_conversion("wav", "ogg", FormatType.AUDIO, audio_codec="libvorbis")
+        self.converter = AudioConverter()
+
+    def duration(self, result, output_format):
+        return probe_duration(result.read(), output_format)
+
+    def test_convert_keeps_the_range(self):
+        clip = {"start": 1, "end": 2.5}
+        result = self.converter.convert(tone(4), "wav", "flac", clip=clip)
+        self.assertAlmostEqual(self.duration(result, "flac"), 1.5, delta=0.05)
+
+    def test_open_range_runs_to_the_end(self):
+        clip = {"start": 3, "end": None}
+        result = self.converter.convert(tone(4), "wav", "flac", clip=clip)
+        self.assertAlmostEqual(self.duration(result, "flac"), 1, delta=0.05)
+
+    def test_every_target_gets_the_range(self):
+        clip = {"start": 1, "end": 2.5}
+        results = self.converter.convert_many(
+            tone(4), "wav", ["flac", "ogg"], clip=clip
+        )
+        for output_format, result in results.items():
+            with self.subTest(output_format):
+                self.assertAlmostEqual(
+                    self.duration(result, output_format), 1.5, delta=0.05
+                )
+
+
+class TrimmedSubmissionTests(SubmissionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("wav", "flac", FormatType.AUDIO, audio_codec="flac")
+
+    def test_clip_is_passed_to_the_worker(self):
+        response = self.submit(
+            file=upload("a.wav", tone(3)), output_format="flac", start="1", end="2"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            self.enqueue.call_args.kwargs["kwargs"]["clip"], {"start": 1, "end": 2}
+        )
+
+    def test_out_of_range_clip_is_rejected(self):
+        response = self.submit(
+            file=upload("a.wav", tone(3)), output_format="flac", start="10"
+        )
+        self.assertEqual(response.status_code, 422)
+        self.enqueue.assert_not_called()
+
+    def test_slow_probe_is_left_to_the_worker(self):
+        timeout = subprocess.TimeoutExpired("ffmpeg", 15)
+        with mock.patch.object(clips.subprocess, "run", side_effect=timeout):
+            response = self.submit(
+                file=upload("a.wav", tone(3)), output_format="flac", start="10"
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            self.enqueue.call_args.kwargs["kwargs"]["clip"], {"start": 10, "end": None}
+        )
@@ -0,0 +1,140 @@
+import io
+import json
+import tempfile
+from unittest import mock
+from asgiref.sync import async_to_sync
+from celery import current_app
+from celery.utils import uuid
+from django.test import override_settings
+from django.contrib.auth import get_user_model
+from converter.models import FormatType
+from converter.utils import submission
+from converter.utils.followers import result_token
+from converter.utils.inflight import claim_inflight, release_inflight
+from converter.utils.redis_ext_client import redis_client
+from converter.utils.storage import get_result_storage
+from .base import ConverterTestCase, ConverterTransactionTestCase
+from .test_submission import png
+
+
+CLIP = {"start": 1.0, "end": 2.0}
+
+
+def claim(token, **kwargs):
+    return async_to_sync(claim_inflight)("digest", "mp4", "avi", token, 60, **kwargs)
+
+
+def start(token):
+    # a leader's task, pending until a worker stores its result
+    task_id = uuid()
+    redis_client.set(f"conv:{token}", task_id)
+    return task_id
+
+
+class ClaimInflightTests(ConverterTestCase):
+    def test_first_submission_leads(self):
+        start("a")
+        self.assertEqual(claim("a"), "a")
+        self.assertEqual(claim("b"), "a")
+
+    def test_failed_leader_is_taken_over(self):
+        task_id = start("a")
+        claim("a")
+        current_app.backend.mark_as_failure(task_id, RuntimeError("killed"))
+        start("b")
+        self.assertEqual(claim("b"), "b")
+        self.assertEqual(claim("c"), "b")
+
+    def test_cancelled_leader_is_taken_over(self):
+        task_id = start("a")
+        claim("a")
+        redis_client.set(f"cancelled:{task_id}", 1)
+        self.assertEqual(claim("b"), "b")
+
+    def test_leader_without_a_task_is_taken_over(self):
+        claim("a")
+        self.assertEqual(claim("b"), "b")
+
+    def test_other_jobs_on_the_same_file_lead_their_own(self):
+        start("a")
+        claim("a")
+        self.assertEqual(claim("b", profile="small"), "b")
+        start("c")
+        self.assertEqual(claim("c", clip=CLIP), "c")
+        self.assertEqual(claim("d", clip={"start": 1.0, "end": None}), "d")
+        self.assertEqual(claim("e", clip=dict(CLIP)), "c")
+
+    def test_only_the_leader_releases(self):
+        start("a")
+        claim("a")
+        release_inflight("digest", "mp4", "avi", "b")
+        self.assertEqual(claim("b"), "a")
+        release_inflight("digest", "mp4", "avi", "a")
+        start("b")
+        self.assertEqual(claim("b"), "b")
+
+
+class CoalescedSubmissionTests(ConverterTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("png", "webp", FormatType.IMAGE)
+        enqueue = mock.patch.object(submission, "enqueue")
+        self.enqueue = enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def submit(self, output_formats, **kwargs):
+        return async_to_sync(submission.submit_conversions)(
+            png(), "png", output_formats, **kwargs
+        )
+
+    def test_identical_submissions_share_one_job(self):
+        first = self.submit(["jpeg"])["jpeg"]
+        second = self.submit(["jpeg"])["jpeg"]
+        self.enqueue.assert_awaited_once()
+        # a token of its own, for the job the first submission leads
+        self.assertNotEqual(second, first)
+        task_id = redis_client.get(f"conv:{first}").decode()
+        self.assertEqual(redis_client.get(f"conv:{second}").decode(), task_id)
+        # both submissions wait on the job, one cancel only detaches
+        self.assertEqual(redis_client.get(f"watchers:{task_id}"), b"2")
+
+    def test_result_is_found_under_every_token(self):
+        first = self.submit(["jpeg"])["jpeg"]
+        second = self.submit(["jpeg"])["jpeg"]
+        self.assertEqual(result_token(second), first)
+        self.assertEqual(result_token(first), first)
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            TEMP_DIR=location
+        ):
+            get_result_storage.cache_clear()
+            self.addCleanup(get_result_storage.cache_clear)
+            get_result_storage().save("a.jpeg", io.BytesIO(b"jpeg"))
+            redis_client.set(f"path:{first}", "a.jpeg")
+            user = get_user_model().objects.create_user("api", password="x")
+            self.client.force_login(user)
+            response = self.client.get(f"/api/converter/result/{second}/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"jpeg")
+
+    def test_callbacks_wait_on_the_leader(self):
+        hook = {"url": "https://example.com/", "api_key_id": 1, "base_url": "/"}
+        first = self.submit(["jpeg"], callback=hook)["jpeg"]
+        second = self.submit(["jpeg"], callback=hook)["jpeg"]
+        hooks = [json.loads(h) for h in redis_client.lrange(f"hooks:{first}", 0, -1)]
+        self.assertEqual(hooks, [hook, {**hook, "token": second}])
+
+    def test_only_new_targets_are_enqueued(self):
+        first = self.submit(["jpeg"])
+        tokens = self.submit(["jpeg", "webp"])
+        self.assertEqual(result_token(tokens["jpeg"]), first["jpeg"])
+        self.assertEqual(self.enqueue.await_count, 2)
+        task, *args = self.enqueue.call_args.args
+        self.assertEqual(task, submission.CONVERT_TASK)
+        self.assertEqual(args[2:], ["webp", tokens["webp"]])
+
+    def test_another_profile_is_a_separate_job(self):
+        first = self.submit(["jpeg"])
+        second = self.submit(["jpeg"], profile="small")
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.enqueue.await_count, 2)
@@ -0,0 +1,119 @@
+import gzip
+import io
+import os
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from converter.tasks import _store_result
+from converter.utils import compression
+from converter.utils.compression import (
+    accepts,
+    compress,
+    decompress_file,
+    result_encoding,
+    split_encoding,
+)
+from converter.utils.redis_ext_client import redis_client
+from converter.utils.storage import get_result_storage
+from .base import ConverterTestCase
+
+
+# hex digits compress about in half, into many chunks
+TEXT = os.urandom(64 * 1024).hex().encode()
+
+
+class NegotiationTests(SimpleTestCase):
+    def test_accepted_encodings(self):
+        self.assertTrue(accepts("gzip, deflate, br", "gzip"))
+        self.assertTrue(accepts("GZip;q=0.5", "gzip"))
+        self.assertTrue(accepts("*", "zstd"))
+        self.assertFalse(accepts("", "gzip"))
+        self.assertFalse(accepts("br", "gzip"))
+
+    def test_refused_encodings(self):
+        self.assertFalse(accepts("gzip;q=0", "gzip"))
+        self.assertFalse(accepts("*, gzip;q=0", "gzip"))
+        self.assertFalse(accepts("*;q=0, br", "gzip"))
+        # a malformed weight is taken as a refusal
+        self.assertFalse(accepts("gzip;q=high", "gzip"))
+
+    def test_split_encoding(self):
+        self.assertEqual(split_encoding("a.html.gz"), ("a.html", "gzip"))
+        self.assertEqual(split_encoding("a.txt.zst"), ("a.txt", "zstd"))
+        self.assertEqual(split_encoding("a.csv.br"), ("a.csv", "br"))
+        self.assertEqual(split_encoding("a.pdf"), ("a.pdf", None))
+
+    def test_first_installed_encoding_is_used(self):
+        with mock.patch.object(compression, "zstandard", None), mock.patch.object(
+            compression, "brotli", None
+        ):
+            self.assertEqual(result_encoding("html"), "gzip")
+            self.assertIsNone(result_encoding("pdf"))
+            with override_settings(RESULT_ENCODINGS=("zstd",)):
+                self.assertIsNone(result_encoding("html"))
+
+
+class DecompressTests(SimpleTestCase):
+    def test_file_is_inflated_in_chunks(self):
+        f = io.BytesIO(compress(TEXT, "gzip"))
+        chunks = list(decompress_file(f, "gzip", chunk_size=1024))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), TEXT)
+        self.assertTrue(f.closed)
+
+    def test_same_input_compresses_the_same(self):
+        # no timestamp in the header, stored results are reproducible
+        self.assertEqual(compress(TEXT, "gzip"), compress(TEXT, "gzip"))
+
+
+class StoredResultTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        self.location = location.name
+        storage = override_settings(TEMP_DIR=self.location)
+        storage.enable()
+        self.addCleanup(storage.disable)
+        get_result_storage.cache_clear()
+        self.addCleanup(get_result_storage.cache_clear)
+        encodings = mock.patch.multiple(compression, zstandard=None, brotli=None)
+        encodings.start()
+        self.addCleanup(encodings.stop)
+
+    def store(self, output_format):
+        filename = _store_result("token", output_format, io.BytesIO(TEXT))
+        self.assertEqual(redis_client.get("path:token").decode(), filename)
+        return filename
+
+    def download(self, **headers):
+        return self.client.get("/converter/download-file/token/", headers=headers)
+
+    def test_text_results_are_stored_compressed(self):
+        filename = self.store("html")
+        self.assertTrue(filename.endswith(".html.gz"))
+        with open(os.path.join(self.location, filename), "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), TEXT)
+
+    def test_other_results_are_stored_as_they_are(self):
+        filename = self.store("pdf")
+        self.assertTrue(filename.endswith(".pdf"))
+        self.assertEqual(
+            os.path.getsize(os.path.join(self.location, filename)), len(TEXT)
+        )
+
+    def test_download_keeps_the_encoding_for_clients_that_accept_it(self):
+        self.store("html")
+        response = self.download(accept_encoding="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), TEXT)
+        self.assertIn('filename="token', response["Content-Disposition"])
+        self.assertIn('.html"', response["Content-Disposition"])
+
+    def test_download_is_inflated_for_other_clients(self):
+        self.store("html")
+        response = self.download(accept_encoding="identity")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(b"".join(response.streaming_content), TEXT)
@@ -0,0 +1,156 @@
+import io
+import os
+import sys
+import tempfile
+from unittest import mock
+import pypandoc
+from asgiref.sync import async_to_sync
+from django.test import override_settings
+from PIL import Image
+from converter.models import FormatConversion, FormatType
+from converter.tasks import convert_task
+from converter.utils import converters
+from converter.utils.converters import AudioConverter, DocConverter, ImageConverter
+from converter.utils.errors import (
+    BudgetExceeded,
+    ConversionError,
+    EngineUnavailable,
+    InvalidInput,
+)
+from converter.utils.failures import input_digest, input_key
+from converter.utils.limits import run_engine
+from converter.utils.redis_ext_client import redis_client
+from converter.utils.submission import convert_inline
+from .base import ConverterTestCase, ConverterTransactionTestCase
+
+
+MARKDOWN = b"# Title\n\nSome text.\n"
+# what the kernel's oom killer does to an engine
+KILLED = "import os; os.kill(os.getpid(), 9)"
+
+
+def no_pandoc():
+    return mock.patch.object(
+        pypandoc,
+        "get_pandoc_path",
+        side_effect=OSError("No pandoc was found: install pandoc"),
+    )
+
+
+def png():
+    out = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(out, format="PNG")
+    return out.getvalue()
+
+
+class ClassificationTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("markdown", "html", FormatType.DOCUMENT, engine="pandoc")
+        self.add_conversion("docx", "pdf", FormatType.DOCUMENT, engine="libreoffice")
+        self.add_conversion("png", "jpeg", FormatType.IMAGE, inline=True)
+
+    def test_missing_pandoc_is_not_an_input_fault(self):
+        with no_pandoc(), self.assertRaises(EngineUnavailable) as caught:
+            DocConverter().convert(MARKDOWN, "markdown", "html")
+        self.assertNotIsInstance(caught.exception, InvalidInput)
+
+    def test_missing_engine_binary_is_not_an_input_fault(self):
+        with mock.patch.object(
+            pypandoc, "get_pandoc_path", return_value="/nonexistent/pandoc"
+        ), self.assertRaises(EngineUnavailable):
+            DocConverter().convert(MARKDOWN, "markdown", "html")
+
+    def test_libreoffice_without_output_is_not_an_input_fault(self):
+        # exits cleanly, e.g. when another instance holds the profile
+        with mock.patch.object(converters, "run_engine"), self.assertRaises(
+            EngineUnavailable
+        ):
+            DocConverter().convert(b"PK\x03\x04", "docx", "pdf")
+
+    def test_batch_without_output_is_not_an_input_fault(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = os.path.join(work_dir, "a.docx")
+            with open(path, "wb") as f:
+                f.write(b"PK\x03\x04")
+            with mock.patch.object(converters, "run_engine"):
+                results = DocConverter().convert_batch([path], "pdf")
+        self.assertIsInstance(results[path], EngineUnavailable)
+
+    def test_corrupt_image_is_an_input_fault(self):
+        with self.assertRaises(InvalidInput):
+            ImageConverter().convert(b"\x89PNG\r\n\x1a\nbroken", "png", "jpeg")
+
+    def test_classified_errors_pass_through(self):
+        error = EngineUnavailable("gone")
+        self.assertIs(DocConverter()._conversion_error(error), error)
+
+    @override_settings(CONVERSION_MAX_RETRIES=0)
+    def test_task_does_not_remember_missing_engine(self):
+        digest = input_digest(MARKDOWN)
+        with no_pandoc(), self.assertLogs("converter.tasks", "ERROR"):
+            result = convert_task.apply(
+                (MARKDOWN, "markdown", "html", "token"), {"input_hash": digest}
+            )
+        self.assertIsInstance(result.result, EngineUnavailable)
+        key = input_key("failed", digest, "markdown", "html")
+        self.assertFalse(redis_client.exists(key))
+
+    def test_task_remembers_invalid_input(self):
+        data = b"\x89PNG\r\n\x1a\nbroken"
+        digest = input_digest(data)
+        with self.assertLogs("converter.tasks", "WARNING"):
+            convert_task.apply((data, "png", "jpeg", "token"), {"input_hash": digest})
+        self.assertTrue(redis_client.exists(input_key("failed", digest, "png", "jpeg")))
+
+    @override_settings(CONVERSION_MAX_RETRIES=0, DOC_BATCH_WINDOW=0)
+    def test_task_does_not_remember_a_killed_engine(self):
+        def killed(cmd, **kwargs):
+            run_engine([sys.executable, "-c", KILLED], **kwargs)
+
+        data = b"PK\x03\x04"
+        digest = input_digest(data)
+        with mock.patch.object(converters, "run_engine", killed), self.assertLogs(
+            "converter.tasks", "ERROR"
+        ):
+            result = convert_task.apply(
+                (data, "docx", "pdf", "token"), {"input_hash": digest}
+            )
+        self.assertIsInstance(result.result, BudgetExceeded)
+        key = input_key("failed", digest, "docx", "pdf")
+        self.assertFalse(redis_client.exists(key))
+
+    def test_catalog_errors_are_not_input_faults(self):
+        self.add_conversion("wav", "mp3", FormatType.AUDIO, audio_codec="libmp3lame")
+        with self.assertRaises(FormatConversion.DoesNotExist):
+            AudioConverter().convert_many(b"RIFF", "wav", ["mp3", "xyz"])
+
+    def test_missing_ffmpeg_is_not_an_input_fault(self):
+        self.add_conversion("wav", "mp3", FormatType.AUDIO, audio_codec="libmp3lame")
+        with mock.patch(
+            "imageio_ffmpeg.get_ffmpeg_exe", side_effect=RuntimeError("no ffmpeg")
+        ), self.assertRaises(EngineUnavailable):
+            AudioConverter().convert_many(b"RIFF", "wav", ["mp3"])
+
+    def test_engine_unavailable_is_a_conversion_error(self):
+        self.assertTrue(issubclass(EngineUnavailable, ConversionError))
+
+
+class InlineClassificationTests(ConverterTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion(
+            "markdown", "rtf", FormatType.DOCUMENT, engine="pandoc", inline=True
+        )
+        self.add_conversion("png", "jpeg", FormatType.IMAGE, inline=True)
+
+    def test_inline_falls_back_to_the_queue_on_engine_errors(self):
+        with no_pandoc():
+            result = async_to_sync(convert_inline)(MARKDOWN, "markdown", "rtf")
+        self.assertIsNone(result)
+        key = input_key("failed", input_digest(MARKDOWN), "markdown", "rtf")
+        self.assertFalse(redis_client.exists(key))
+
+    def test_inline_converts(self):
+        result = async_to_sync(convert_inline)(png(), "png", "jpeg")
+        self.assertTrue(result.startswith(b"\xff\xd8\xff"))
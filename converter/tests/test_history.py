@@ -0,0 +1,87 @@
+from unittest import mock
+from django.db import DatabaseError
+from django.utils import timezone
+from converter.models import ConversionJob, JobOutcome
+from converter.utils.history import (
+    FINISHED_KEY,
+    FLUSHING_KEY,
+    flush_history,
+    job_finished,
+    job_started,
+)
+from converter.utils.redis_ext_client import redis_client
+from .base import ConverterTestCase
+
+
+LABELS = {"input_format": "png", "output_format": "jpeg", "engine": "pillow"}
+
+
+def finish(token):
+    job_started(token)
+    job_finished(token, f"task-{token}", LABELS, JobOutcome.SUCCEEDED)
+
+
+class FlushHistoryTests(ConverterTestCase):
+    def tokens(self):
+        return sorted(ConversionJob.objects.values_list("token", flat=True))
+
+    def test_flush_writes_finished_jobs(self):
+        finish("a")
+        finish("b")
+        self.assertEqual(flush_history(), 2)
+        self.assertEqual(self.tokens(), ["a", "b"])
+        self.assertEqual(redis_client.keys("job*"), [])
+        self.assertIsNotNone(ConversionJob.objects.get(token="a").service_time)
+
+    def test_jobs_finished_during_a_flush_are_kept(self):
+        finish("a")
+        bulk_create = ConversionJob.objects.bulk_create
+        late = ["late"]
+
+        def insert(jobs):
+            while late:
+                finish(late.pop())
+            return bulk_create(jobs)
+
+        with mock.patch.object(ConversionJob.objects, "bulk_create", insert):
+            self.assertEqual(flush_history(), 2)
+        self.assertEqual(self.tokens(), ["a", "late"])
+        self.assertEqual(redis_client.llen(FINISHED_KEY), 0)
+
+    def test_overlapping_flush_writes_nothing(self):
+        finish("a")
+        bulk_create = ConversionJob.objects.bulk_create
+        overlapping = []
+
+        def insert(jobs):
+            overlapping.append(flush_history())
+            return bulk_create(jobs)
+
+        with mock.patch.object(ConversionJob.objects, "bulk_create", insert):
+            flush_history()
+        self.assertEqual(overlapping, [0])
+        self.assertEqual(self.tokens(), ["a"])
+
+    def test_failed_insert_is_retried_by_the_next_flush(self):
+        finish("a")
+        with mock.patch.object(
+            ConversionJob.objects, "bulk_create", side_effect=DatabaseError
+        ), self.assertRaises(DatabaseError):
+            flush_history()
+        self.assertEqual(redis_client.llen(FLUSHING_KEY), 1)
+        self.assertEqual(flush_history(), 1)
+        self.assertEqual(self.tokens(), ["a"])
+        self.assertFalse(redis_client.exists(FLUSHING_KEY))
+
+    def test_batch_of_a_dead_flush_is_not_written_twice(self):
+        finish("a")
+        finish("b")
+        # moved aside, then the flush died after inserting part of it
+        for _ in range(2):
+            redis_client.lmove(FINISHED_KEY, FLUSHING_KEY, "LEFT", "RIGHT")
+        ConversionJob.objects.create(
+            token="a", outcome=JobOutcome.SUCCEEDED, finished_at=timezone.now()
+        )
+        self.assertEqual(flush_history(), 1)
+        self.assertEqual(self.tokens(), ["a", "b"])
+        self.assertFalse(redis_client.exists(FLUSHING_KEY))
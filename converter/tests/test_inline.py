@@ -0,0 +1,78 @@
+import io
+import subprocess
+import sys
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from PIL import Image
+from converter.models import ConversionJob, FormatType, JobOutcome
+from converter.utils.converters import ImageConverter
+from converter.utils.history import flush_history
+from converter.utils.redis_ext_client import redis_client
+from converter.utils.submission import Rejected, convert_inline
+from .base import ConverterTransactionTestCase
+
+
+def png(size=8):
+    out = io.BytesIO()
+    Image.new("RGB", (size, size), "red").save(out, format="PNG")
+    return out.getvalue()
+
+
+class InlineImportTests(ConverterTransactionTestCase):
+    def test_web_tier_does_not_load_the_heavy_engines(self):
+        # a fresh interpreter, the test process has them loaded already
+        code = (
+            "import sys, django; django.setup()\n"
+            "import converter.urls, converter.utils.converters\n"
+            "print(' '.join(m for m in ('moviepy', 'numpy', 'pypandoc', 'PIL')"
+            " if m in sys.modules))"
+        )
+        loaded = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.split()
+        self.assertEqual(loaded, [])
+
+
+class InlineHistoryTests(ConverterTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE, inline=True)
+        self.user = get_user_model().objects.create_user("inline", password="x")
+
+    def test_converted_job_is_recorded(self):
+        data = png()
+        result = async_to_sync(convert_inline)(
+            data, "png", "jpeg", user_id=self.user.pk
+        )
+        self.assertEqual(flush_history(), 1)
+        job = ConversionJob.objects.get()
+        self.assertEqual(job.outcome, JobOutcome.SUCCEEDED)
+        self.assertEqual((job.input_format, job.output_format), ("png", "jpeg"))
+        self.assertEqual(job.engine, ImageConverter.engine or "unknown")
+        self.assertEqual(job.format_type, FormatType.IMAGE)
+        self.assertEqual(job.input_size, len(data))
+        self.assertEqual(job.output_size, len(result))
+        self.assertEqual(job.user_id, self.user.pk)
+        self.assertEqual(job.task_id, "")
+        self.assertIsNotNone(job.service_time)
+
+    def test_invalid_input_is_recorded(self):
+        with self.assertRaises(Rejected):
+            # the header reads fine, the pixel data is cut off
+            async_to_sync(convert_inline)(png(64)[:60], "png", "jpeg")
+        flush_history()
+        self.assertEqual(ConversionJob.objects.get().outcome, JobOutcome.INVALID_INPUT)
+
+    def test_fallback_leaves_no_record(self):
+        # the queued job is recorded instead
+        with mock.patch.object(ImageConverter, "fits_inline", return_value=False):
+            result = async_to_sync(convert_inline)(png(), "png", "jpeg")
+        self.assertIsNone(result)
+        self.assertEqual(flush_history(), 0)
+        self.assertEqual(redis_client.keys("job:*"), [])
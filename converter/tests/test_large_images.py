@@ -0,0 +1,109 @@
+import io
+from django.test import override_settings
+from PIL import Image
+from converter.models import FormatType
+from converter.utils.converters import ImageConverter
+from converter.utils.errors import InvalidInput
+from .base import ConverterTestCase
+
+
+MB = 1024**2
+
+
+def picture(width, height, file_format="PNG", mode="RGB"):
+    out = io.BytesIO()
+    Image.new(mode, (width, height)).save(out, format=file_format)
+    return out.getvalue()
+
+
+def size_of(result):
+    with Image.open(result) as img:
+        return img.mode, img.size
+
+
+def header(width, height, mode="RGB", file_format="PNG"):
+    # the budget only looks at what the header says
+    return Image.open(io.BytesIO(picture(width, height, file_format, mode)))
+
+
+@override_settings(IMAGE_MAX_PIXELS=10_000, IMAGE_DOWNSCALE_OVERSIZE=True)
+class PixelBudgetTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("jpeg", "png", FormatType.IMAGE)
+        self.add_conversion("jpeg2000", "png", FormatType.IMAGE)
+        self.converter = ImageConverter()
+
+    def convert(self, data, input_format, output_format="png"):
+        return self.converter.convert(data, input_format, output_format)
+
+    def test_image_within_the_budget(self):
+        result = self.convert(picture(100, 100), "png", "jpeg")
+        self.assertEqual(size_of(result), ("RGB", (100, 100)))
+
+    def test_oversize_png_is_rejected_before_decoding(self):
+        with self.assertRaisesMessage(
+            InvalidInput, "Image is 200x100, more than the 10000 pixels allowed"
+        ):
+            self.convert(picture(200, 100), "png", "jpeg")
+
+    def test_oversize_jpeg_is_shrunk_while_decoding(self):
+        result = self.convert(picture(400, 400, "JPEG"), "jpeg")
+        self.assertEqual(size_of(result), ("RGB", (100, 100)))
+
+    def test_jpeg_beyond_the_largest_draft_scale(self):
+        with self.assertRaises(InvalidInput):
+            self.convert(picture(1000, 1000, "JPEG"), "jpeg")
+
+    def test_oversize_jpeg2000_skips_resolution_levels(self):
+        data = picture(400, 200, "JPEG2000")
+        with override_settings(IMAGE_MAX_PIXELS=40_000):
+            result = self.convert(data, "jpeg2000")
+        self.assertEqual(size_of(result), ("RGB", (200, 100)))
+
+    @override_settings(IMAGE_DOWNSCALE_OVERSIZE=False)
+    def test_downscaling_can_be_turned_off(self):
+        with self.assertRaises(InvalidInput):
+            self.convert(picture(400, 400, "JPEG"), "jpeg")
+
+    def test_mode_is_converted(self):
+        result = self.convert(picture(50, 50, mode="P"), "png", "jpeg")
+        self.assertEqual(size_of(result), ("RGB", (50, 50)))
+
+    def test_oversize_preview(self):
+        # a thumbnail of a large jpeg is fine, a png would be decoded in full
+        preview = self.converter.preview(picture(400, 400, "JPEG"), "jpeg", 32)
+        self.assertEqual(size_of(io.BytesIO(preview)), ("RGB", (32, 32)))
+        with self.assertRaises(InvalidInput):
+            self.converter.preview(picture(200, 100), "png", 32)
+
+    @override_settings(INLINE_MAX_PIXELS=5_000)
+    def test_inline_only_for_small_images(self):
+        self.assertTrue(self.converter.fits_inline(picture(50, 100), "png"))
+        self.assertFalse(self.converter.fits_inline(picture(100, 100), "png"))
+        self.assertFalse(self.converter.fits_inline(b"broken", "png"))
+
+
+@override_settings(IMAGE_MAX_PIXELS=100_000_000, IMAGE_MEMORY_SHARE=0.5)
+class MemoryShareTests(ConverterTestCase):
+    def budget(self, img):
+        with img:
+            return ImageConverter(memory=8 * MB)._pixel_budget(img)
+
+    def test_budget_follows_the_memory_limit(self):
+        # half of 8MB, at 4 bytes per rgb pixel
+        self.assertEqual(self.budget(header(8, 8)), MB)
+
+    def test_mode_changes_count_the_rgb_copy(self):
+        self.assertEqual(self.budget(header(8, 8, "L")), 4 * MB // 5)
+        self.assertEqual(self.budget(header(8, 8, "RGBA")), MB // 2)
+
+    def test_jpeg2000_counts_its_sample_buffers(self):
+        self.assertEqual(
+            self.budget(header(8, 8, file_format="JPEG2000")), 4 * MB // 16
+        )
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_pixel_cap(self):
+        self.assertEqual(self.budget(header(8, 8)), 1000)
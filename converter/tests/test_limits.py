@@ -0,0 +1,133 @@
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from django.test import SimpleTestCase, override_settings
+from converter.models import FormatType
+from converter.utils.converters import ImageConverter
+from converter.utils.errors import BudgetExceeded, EngineUnavailable
+from converter.utils.limits import (
+    DEFAULT_LIMITS,
+    conversion_task_options,
+    get_conversion_limits,
+    memory_budget,
+    run_engine,
+    task_time_limits,
+)
+from .base import ConverterTestCase
+
+
+MB = 1024**2
+
+
+def pid_alive(pid):
+    # a killed process nobody reaped yet is a zombie, it isn't running
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+class LimitsTests(ConverterTestCase):
+    @override_settings(CONVERSION_LIMITS={"image": {"soft_time_limit": 5}})
+    def test_limits_per_format_type(self):
+        self.assertEqual(
+            get_conversion_limits("image"), {**DEFAULT_LIMITS, "soft_time_limit": 5}
+        )
+        self.assertEqual(get_conversion_limits("video"), DEFAULT_LIMITS)
+        self.assertEqual(task_time_limits(None), {})
+
+    def test_task_options_follow_the_input_format(self):
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.assertEqual(
+            conversion_task_options("png"),
+            {"soft_time_limit": 60, "time_limit": 90},
+        )
+        # an unknown format falls back to celery's own limits
+        self.assertEqual(conversion_task_options("xyz"), {})
+
+    def test_converters_carry_their_limits(self):
+        converter = ImageConverter(soft_time_limit=3)
+        self.assertEqual(converter.limits["soft_time_limit"], 3)
+        self.assertEqual(converter.limits["memory"], 1024**3)
+
+    def test_budget_errors_are_classified(self):
+        converter = ImageConverter()
+        for error in (
+            MemoryError(),
+            subprocess.TimeoutExpired("convert", 1),
+            # moviepy's own ffmpeg runs fail with the engine's message
+            OSError("ffmpeg error: Cannot allocate memory"),
+        ):
+            with self.subTest(error):
+                self.assertIsInstance(
+                    converter._conversion_error(error), BudgetExceeded
+                )
+
+
+class RunEngineTests(SimpleTestCase):
+    def python(self, code, **kwargs):
+        run_engine([sys.executable, "-c", code], **kwargs)
+
+    def test_engine_runs(self):
+        self.python("pass", timeout=30)
+
+    def test_failed_engine(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.python("raise SystemExit(3)", timeout=30)
+
+    def test_missing_engine(self):
+        with self.assertRaisesMessage(EngineUnavailable, "is not installed"):
+            run_engine(["/nonexistent/soffice"], timeout=30)
+
+    def test_memory_budget_of_the_engine(self):
+        allocate = f"bytearray({512 * MB})"
+        with self.assertRaisesMessage(BudgetExceeded, "ran out of memory"):
+            self.python(allocate, timeout=30, memory=256 * MB)
+        self.python(allocate, timeout=30)
+
+    def test_killed_engine(self):
+        # what the kernel's oom killer does
+        with self.assertRaisesMessage(BudgetExceeded, "killed with SIGKILL"):
+            self.python("import os; os.kill(os.getpid(), 9)", timeout=30)
+
+    def test_crashed_engine_is_not_an_input_fault(self):
+        with self.assertRaisesMessage(EngineUnavailable, "crashed with SIGSEGV"):
+            self.python("import os; os.kill(os.getpid(), 11)", timeout=30)
+
+    def test_timeout_kills_the_whole_group(self):
+        # engines like libreoffice fork helpers that must not outlive them
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pid_file = os.path.join(tmp_dir, "pid")
+            cmd = f"sleep 60 & echo $! > {pid_file}; wait"
+            start = time.monotonic()
+            with self.assertRaises(subprocess.TimeoutExpired):
+                run_engine(["sh", "-c", cmd], timeout=0.5)
+            self.assertLess(time.monotonic() - start, 10)
+            with open(pid_file) as f:
+                helper = int(f.read())
+        for _ in range(50):
+            if not pid_alive(helper):
+                break
+            time.sleep(0.05)
+        self.assertFalse(pid_alive(helper))
+
+
+class MemoryBudgetTests(SimpleTestCase):
+    def test_allocations_above_the_budget_fail(self):
+        before = resource.getrlimit(resource.RLIMIT_AS)
+        with memory_budget(64 * MB):
+            soft, _ = resource.getrlimit(resource.RLIMIT_AS)
+            self.assertNotEqual(soft, resource.RLIM_INFINITY)
+            with self.assertRaises(MemoryError):
+                bytearray(256 * MB)
+        self.assertEqual(resource.getrlimit(resource.RLIMIT_AS), before)
+
+    @override_settings(CONVERSION_RLIMIT_SELF=False)
+    def test_threaded_workers_are_not_capped(self):
+        before = resource.getrlimit(resource.RLIMIT_AS)
+        with memory_budget(64 * MB):
+            self.assertEqual(resource.getrlimit(resource.RLIMIT_AS), before)
@@ -0,0 +1,82 @@
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+from converter.benchmarks.loadtest import (
+    JobSpec,
+    TaskClock,
+    build_report,
+    percentile,
+    summarize,
+)
+
+
+def job(pair="png->jpeg", ok=True, token=None, task_id=None, **fields):
+    return {
+        "pair": pair,
+        "ok": ok,
+        "token": token,
+        "task_id": task_id,
+        "end_to_end_s": 1.0,
+        **fields,
+    }
+
+
+class JobSpecTests(SimpleTestCase):
+    def test_parse(self):
+        spec = JobSpec.parse("mp4->webm:320x240:2")
+        self.assertEqual(spec.pair, "mp4->webm")
+        self.assertEqual((spec.size, spec.weight), ("320x240", 2))
+        self.assertEqual(JobSpec.parse("png->jpeg:1024").weight, 1)
+
+    def test_invalid_specs(self):
+        for value in ("png->jpeg", "png:1024", "->jpeg:1024", "png->jpeg:1024:x"):
+            with self.subTest(value), self.assertRaises(ValueError):
+                JobSpec.parse(value)
+
+    def test_command_rejects_invalid_specs(self):
+        with self.assertRaisesMessage(CommandError, "Invalid job spec 'png'"):
+            call_command("loadtest_conversions", job=["png"])
+
+
+class ReportTests(SimpleTestCase):
+    def test_percentiles(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3.0], 95), 3.0)
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(
+            summarize([]), {"p50": None, "p95": None, "p99": None, "mean": None}
+        )
+
+    def test_report(self):
+        clock = TaskClock()
+        clock.published = {"t1": 0.0, "t2": 1.0}
+        clock.started = {"t1": 0.5, "t2": 1.0}
+        clock.finished = {"t1": 2.5, "t2": 2.0}
+        results = [
+            job(token="a", task_id="t1"),
+            # followed the first job
+            job(token="c", task_id="t1"),
+            job(pair="png->webp", token="b", task_id="t2"),
+            job(inline=True),
+            job(ok=False, error="timed out"),
+        ]
+        report = build_report(results, clock, wall=2.0)
+        self.assertEqual(
+            {k: report[k] for k in ("jobs", "failed", "inline", "coalesced")},
+            {"jobs": 5, "failed": 1, "inline": 1, "coalesced": 1},
+        )
+        self.assertEqual(report["throughput_jobs_s"], 2.0)
+        self.assertEqual(report["queue_wait_s"]["p99"], 0.5)
+        # a coalesced submission counts its leader's times again
+        self.assertEqual(report["service_s"]["p50"], 2.0)
+        self.assertEqual(report["pairs"]["png->webp"]["service_s"]["p50"], 1.0)
+        self.assertEqual(sorted(report["pairs"]), ["png->jpeg", "png->webp"])
+        self.assertEqual(report["pairs"]["png->webp"]["jobs"], 1)
+        self.assertEqual(report["pairs"]["png->jpeg"]["coalesced"], 1)
+
+    def test_report_without_jobs(self):
+        report = build_report([], TaskClock(), wall=1.0)
+        self.assertEqual(report["jobs"], 0)
+        self.assertEqual(report["throughput_jobs_s"], 0)
+        self.assertEqual(report["pairs"], {})
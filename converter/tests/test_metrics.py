@@ -0,0 +1,177 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+from celery.utils import uuid
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+from prometheus_client.exposition import generate_latest
+from prometheus_client.parser import text_string_to_metric_families
+from converter.models import FormatType
+from converter.utils.converters import ImageConverter
+from converter.utils.metrics import (
+    StageTimer,
+    TempDirCollector,
+    build_registry,
+    prune_dead_processes,
+    queue_wait,
+    stamp_enqueue_time,
+)
+from .base import ConverterTestCase
+
+
+OUTSIDE = "203.0.113.5"
+
+
+class MetricsAccessTests(ConverterTestCase):
+    def scrape(self, address):
+        return self.client.get("/metrics/", REMOTE_ADDR=address)
+
+    def test_local_scrape(self):
+        response = self.scrape("127.0.0.1")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"conversion", response.content)
+
+    def test_outside_scrape_is_refused(self):
+        self.assertEqual(self.scrape(OUTSIDE).status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=["203.0.113.0/24"])
+    def test_allowed_network(self):
+        self.assertEqual(self.scrape(OUTSIDE).status_code, 200)
+        self.assertEqual(self.scrape("127.0.0.1").status_code, 403)
+
+    def test_staff_may_view_from_anywhere(self):
+        users = get_user_model().objects
+        self.client.force_login(users.create_user("user", password="x"))
+        self.assertEqual(self.scrape(OUTSIDE).status_code, 403)
+        self.client.force_login(users.create_user("staff", password="x", is_staff=True))
+        self.assertEqual(self.scrape(OUTSIDE).status_code, 200)
+
+
+def samples(name, **labels):
+    # read back through the registry a scrape uses, worker processes included
+    text = generate_latest(build_registry()).decode()
+    return {
+        sample.name: sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+        if sample.name.startswith(name)
+        and all(sample.labels.get(k) == v for k, v in labels.items())
+        and "le" not in sample.labels
+    }
+
+
+class StageTimerTests(SimpleTestCase):
+    def test_stages_are_observed_with_the_final_labels(self):
+        # a format of its own, counts from other tests don't mix in
+        input_format = uuid()
+        timer = StageTimer()
+        with timer.stage("engine"):
+            pass
+        timer.add("engine", 2)
+        timer.add("queue_wait", -1)
+        timer.observe(input_format, "jpeg", None)
+
+        labels = {"input_format": input_format, "stage": "engine", "engine": "unknown"}
+        engine = samples("converter_stage_seconds", **labels)
+        self.assertEqual(engine["converter_stage_seconds_count"], 1)
+        self.assertGreaterEqual(engine["converter_stage_seconds_sum"], 2)
+        # clocks of different machines may disagree, never below zero
+        labels["stage"] = "queue_wait"
+        wait = samples("converter_stage_seconds", **labels)
+        self.assertEqual(wait["converter_stage_seconds_sum"], 0)
+
+    def test_observed_once(self):
+        input_format = uuid()
+        timer = StageTimer()
+        timer.add("engine", 1)
+        timer.observe(input_format)
+        timer.observe(input_format)
+        counts = samples("converter_stage_seconds_count", input_format=input_format)
+        self.assertEqual(counts["converter_stage_seconds_count"], 1)
+
+    def test_queue_wait(self):
+        headers = {}
+        stamp_enqueue_time(headers=headers)
+        request = mock.Mock(enqueued_at=headers["enqueued_at"] - 3)
+        self.assertAlmostEqual(queue_wait(request), 3, delta=1)
+        self.assertIsNone(queue_wait(mock.Mock(spec=[])))
+
+
+class ConversionStagesTests(ConverterTestCase):
+    def test_conversion_records_its_engine_time(self):
+        self.add_conversion("bmp", "png", FormatType.IMAGE)
+        image = io.BytesIO()
+        Image.new("RGB", (8, 8)).save(image, format="BMP")
+        before = samples("converter_stage_seconds_count", input_format="bmp")
+        ImageConverter().convert(image.getvalue(), "bmp", "PNG")
+        after = samples(
+            "converter_stage_seconds_count",
+            input_format="bmp",
+            output_format="png",
+            stage="engine",
+            engine="pillow",
+        )
+        self.assertEqual(
+            after["converter_stage_seconds_count"],
+            before.get("converter_stage_seconds_count", 0) + 1,
+        )
+
+
+class TempDirCollectorTests(SimpleTestCase):
+    def test_results_awaiting_download(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.mkdir(os.path.join(temp_dir, "segments"))
+            for name, size in (("a.pdf", 10), ("b.png", 5)):
+                with open(os.path.join(temp_dir, name), "wb") as f:
+                    f.write(b"x" * size)
+            with override_settings(TEMP_DIR=temp_dir):
+                families = {f.name: f for f in TempDirCollector().collect()}
+        self.assertEqual(families["converter_temp_dir_files"].samples[0].value, 2)
+        self.assertEqual(families["converter_temp_dir_bytes"].samples[0].value, 15)
+
+    @override_settings(TEMP_DIR="/nonexistent")
+    def test_missing_dir_is_skipped(self):
+        self.assertEqual(list(TempDirCollector().collect()), [])
+
+
+class PruneDeadProcessesTests(SimpleTestCase):
+    def test_only_files_of_gone_processes_are_removed(self):
+        gone = subprocess.Popen([sys.executable, "-c", ""])
+        gone.wait()
+        live = os.getpid()
+        names = [
+            f"counter_{gone.pid}.db",
+            f"gauge_livemax_{gone.pid}.db",
+            f"counter_{live}.db",
+            f"histogram_{live}.db",
+            "notes.txt",
+        ]
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            for name in names:
+                open(os.path.join(metrics_dir, name), "wb").close()
+            with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": metrics_dir}):
+                prune_dead_processes()
+            self.assertEqual(
+                sorted(os.listdir(metrics_dir)),
+                [f"counter_{live}.db", f"histogram_{live}.db", "notes.txt"],
+            )
+
+
+class ExpositionTests(ConverterTestCase):
+    def test_openmetrics_on_request(self):
+        response = self.client.get(
+            "/metrics/", HTTP_ACCEPT="application/openmetrics-text; version=1.0.0"
+        )
+        self.assertTrue(
+            response["Content-Type"].startswith("application/openmetrics-text")
+        )
+        self.assertTrue(response.content.endswith(b"# EOF\n"))
+
+    def test_text_format_by_default(self):
+        response = self.client.get("/metrics/")
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(b"converter_temp_dir_files", response.content)
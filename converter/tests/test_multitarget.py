@@ -0,0 +1,141 @@
+import tempfile
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.test import override_settings
+from PIL import Image
+from converter.models import FormatType
+from converter.tasks import convert_many_task
+from converter.utils.converters import AudioConverter, ImageConverter, VideoConverter
+from converter.utils import submission
+from converter.utils.errors import InvalidInput
+from converter.utils.failures import input_digest, input_key
+from converter.utils.inflight import claim_inflight
+from converter.utils.redis_ext_client import redis_client
+from converter.utils.storage import get_result_storage
+from .base import ConverterTestCase
+from .test_clips import tone
+from .test_coalescing import start
+from .test_segments import duration, video
+from .test_submission import SubmissionTestCase, png
+
+
+def claim(digest, output_format, token):
+    return async_to_sync(claim_inflight)(digest, "png", output_format, token, 60)
+
+
+class ConvertManyTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("png", "webp", FormatType.IMAGE)
+        self.add_conversion("wav", "mp3", FormatType.AUDIO, audio_codec="libmp3lame")
+        self.add_conversion("wav", "ogg", FormatType.AUDIO, audio_codec="libvorbis")
+        self.add_conversion("mp4", "avi", FormatType.VIDEO, video_codec="mpeg4")
+        self.add_conversion("mp4", "webm", FormatType.VIDEO, video_codec="libvpx")
+
+    def test_image_is_decoded_once(self):
+        converter = ImageConverter()
+        with mock.patch.object(
+            converter, "_open_image", wraps=converter._open_image
+        ) as decode:
+            results = converter.convert_many(png(), "png", ["jpeg", "webp"])
+        self.assertEqual(decode.call_count, 1)
+        for output_format, result in results.items():
+            with Image.open(result) as img:
+                self.assertEqual(img.format, output_format.upper())
+                self.assertEqual(img.size, (8, 8))
+
+    def test_broken_image_fails_every_target(self):
+        with self.assertRaises(InvalidInput):
+            ImageConverter().convert_many(b"\x89PNG broken", "png", ["jpeg", "webp"])
+
+    def test_audio_targets_share_one_engine_run(self):
+        converter = AudioConverter()
+        with mock.patch.object(
+            converter, "_run_engine", wraps=converter._run_engine
+        ) as engine:
+            results = converter.convert_many(tone(1), "wav", ["mp3", "ogg"])
+        self.assertEqual(engine.call_count, 1)
+        head = results["mp3"].read(3)
+        self.assertTrue(head == b"ID3" or head[0] == 0xFF)
+        self.assertEqual(results["ogg"].read(4), b"OggS")
+
+    def test_video_targets_share_one_engine_run(self):
+        converter = VideoConverter()
+        with mock.patch.object(
+            converter, "_run_engine", wraps=converter._run_engine
+        ) as engine:
+            results = converter.convert_many(video(1), "mp4", ["avi", "webm"])
+        self.assertEqual(engine.call_count, 1)
+        for output_format, result in results.items():
+            with tempfile.NamedTemporaryFile(suffix=f".{output_format}") as f:
+                f.write(result.read())
+                f.flush()
+                self.assertAlmostEqual(duration(f.name), 1, delta=0.2)
+
+
+class ConvertManyTaskTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("png", "webp", FormatType.IMAGE)
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        storage = override_settings(TEMP_DIR=location.name)
+        storage.enable()
+        self.addCleanup(storage.disable)
+        get_result_storage.cache_clear()
+        self.addCleanup(get_result_storage.cache_clear)
+
+    def test_each_target_is_stored_under_its_token(self):
+        targets = {"jpeg": "a", "webp": "b"}
+        with self.assertLogs("converter.tasks", "INFO"):
+            paths = convert_many_task.apply((png(), "png", targets)).get()
+        self.assertEqual(sorted(paths), ["jpeg", "webp"])
+        for output_format, token in targets.items():
+            self.assertEqual(
+                redis_client.get(f"path:{token}").decode(), paths[output_format]
+            )
+            with get_result_storage().open(paths[output_format]) as f:
+                with Image.open(f) as img:
+                    self.assertEqual(img.format, output_format.upper())
+
+    def test_unsupported_targets_are_skipped(self):
+        with self.assertLogs("converter.tasks", "WARNING"):
+            paths = convert_many_task.apply(
+                (png(), "png", {"jpeg": "a", "gif": "b"})
+            ).get()
+        self.assertEqual(list(paths), ["jpeg"])
+        self.assertIsNone(redis_client.get("path:b"))
+
+    def test_invalid_input_is_remembered_for_every_target(self):
+        data = b"\x89PNG\r\n\x1a\nbroken"
+        digest = input_digest(data)
+        for output_format, token in (("jpeg", "a"), ("webp", "b")):
+            start(token)
+            self.assertEqual(claim(digest, output_format, token), token)
+        with self.assertLogs("converter.tasks", "WARNING"):
+            result = convert_many_task.apply(
+                (data, "png", {"jpeg": "a", "webp": "b"}), {"input_hash": digest}
+            )
+        self.assertIsInstance(result.result, InvalidInput)
+        for output_format in ("jpeg", "webp"):
+            key = input_key("failed", digest, "png", output_format)
+            self.assertTrue(redis_client.exists(key))
+            # the job is over, the next submission leads a new one
+            start("c")
+            self.assertEqual(claim(digest, output_format, "c"), "c")
+
+
+class ManyTargetsSubmitTests(SubmissionTestCase):
+    @override_settings(MAX_CONVERSION_TARGETS=1)
+    def test_too_many_targets(self):
+        response = self.submit(output_format="jpeg,webp")
+        self.assertEqual(response.status_code, 422)
+        self.enqueue.assert_not_called()
+
+    def test_repeated_targets_are_one(self):
+        response = self.submit(output_format="jpeg,jpeg")
+        self.assertIn("result token", response.json())
+        call = self.enqueue.call_args
+        self.assertEqual(call.args[0], submission.CONVERT_TASK)
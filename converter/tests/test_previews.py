@@ -0,0 +1,171 @@
+import io
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+from celery.exceptions import TimeoutError as ResultTimeout
+from converter.models import FormatType
+from converter.tasks import preview_task
+from converter.utils import previews
+from converter.utils.errors import InvalidInput, PreviewUnavailable
+from converter.utils.previews import get_preview, preview_size, render_preview
+from .base import ConverterTestCase, ConverterTransactionTestCase
+from .test_clips import tone
+from .test_segments import video
+from .test_submission import upload
+
+
+def picture(width, height, file_format="PNG"):
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), "green").save(out, format=file_format)
+    return out.getvalue()
+
+
+def size_of(preview):
+    with Image.open(io.BytesIO(preview)) as img:
+        return img.format, img.size
+
+
+class PreviewSizeTests(SimpleTestCase):
+    @override_settings(PREVIEW_SIZE=320, PREVIEW_MAX_SIZE=1024)
+    def test_requested_size_is_bounded(self):
+        self.assertEqual(preview_size("200"), 200)
+        self.assertEqual(preview_size(None), 320)
+        self.assertEqual(preview_size("big"), 320)
+        self.assertEqual(preview_size("1"), 16)
+        self.assertEqual(preview_size("100000"), 1024)
+
+
+class RenderPreviewTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("jpeg", "png", FormatType.IMAGE)
+        self.add_conversion("mp4", "avi", FormatType.VIDEO)
+        self.add_conversion("wav", "mp3", FormatType.AUDIO)
+
+    def test_image_keeps_its_aspect(self):
+        preview = render_preview(picture(2000, 1000), "png", 320)
+        self.assertEqual(size_of(preview), ("JPEG", (320, 160)))
+
+    def test_jpeg_is_decoded_reduced(self):
+        preview = render_preview(picture(4000, 3000, "JPEG"), "JPG", 100)
+        self.assertEqual(size_of(preview), ("JPEG", (100, 75)))
+
+    def test_small_image_is_not_enlarged(self):
+        preview = render_preview(picture(40, 20), "png", 320)
+        self.assertEqual(size_of(preview), ("JPEG", (40, 20)))
+
+    def test_video_frame(self):
+        preview = render_preview(video(2), "mp4", 32)
+        self.assertEqual(size_of(preview), ("JPEG", (32, 24)))
+
+    def test_video_shorter_than_the_preview_position(self):
+        preview = render_preview(video(0.5), "mp4", 32)
+        self.assertEqual(size_of(preview)[0], "JPEG")
+
+    def test_formats_without_a_preview(self):
+        with self.assertRaisesMessage(PreviewUnavailable, "No preview for wav files"):
+            render_preview(tone(1), "wav", 64)
+        with self.assertRaises(PreviewUnavailable):
+            render_preview(b"data", "xyz", 64)
+
+    def test_broken_input(self):
+        with self.assertRaises(InvalidInput):
+            render_preview(picture(40, 20)[:60], "png", 64)
+
+
+async def run_worker(task_name, *args, **options):
+    # the queued preview, rendered right away like a worker would
+    return await sync_to_async(preview_task.apply, thread_sensitive=False)(args)
+
+
+class PreviewViewTests(ConverterTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("wav", "mp3", FormatType.AUDIO)
+        self.add_conversion("mp4", "avi", FormatType.VIDEO)
+        enqueue = mock.patch.object(previews, "enqueue", side_effect=run_worker)
+        self.enqueue = enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def test_preview(self):
+        response = self.client.post(
+            "/converter/preview/png/?size=50",
+            {"file": upload("a.png", picture(100, 100))},
+        )
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(size_of(response.content), ("JPEG", (50, 50)))
+        self.enqueue.assert_not_called()
+
+    def test_video_is_rendered_by_a_worker(self):
+        with mock.patch.object(
+            previews, "render_preview", wraps=render_preview
+        ) as render:
+            response = self.client.post(
+                "/converter/preview/mp4/?size=32",
+                {"file": upload("a.mp4", video(2))},
+            )
+        self.assertEqual(size_of(response.content), ("JPEG", (32, 24)))
+        self.assertEqual(self.enqueue.call_args.args[0], previews.PREVIEW_TASK)
+        # once, by the task
+        self.assertEqual(render.call_count, 1)
+
+    def test_images_queue_up_when_the_web_process_is_busy(self):
+        slots = previews._web_slots
+        for _ in range(settings.PREVIEW_WEB_CONCURRENCY):
+            slots.acquire()
+        try:
+            preview = async_to_sync(get_preview)(picture(100, 100), "png", 50)
+        finally:
+            for _ in range(settings.PREVIEW_WEB_CONCURRENCY):
+                slots.release()
+        self.assertEqual(size_of(preview), ("JPEG", (50, 50)))
+        self.enqueue.assert_called_once()
+
+    def test_slow_worker(self):
+        result = mock.Mock()
+        result.get.side_effect = ResultTimeout()
+        self.enqueue.side_effect = None
+        self.enqueue.return_value = result
+        response = self.client.post(
+            "/converter/preview/mp4/", {"file": upload("a.mp4", video(1))}
+        )
+        self.assertEqual(response.status_code, 503)
+
+    def test_previews_are_rendered_once(self):
+        file_bin = picture(100, 100)
+        with mock.patch.object(
+            previews, "render_preview", wraps=render_preview
+        ) as render:
+            first = async_to_sync(get_preview)(file_bin, "png", 50)
+            self.assertEqual(async_to_sync(get_preview)(file_bin, "png", 50), first)
+            self.assertEqual(render.call_count, 1)
+            async_to_sync(get_preview)(file_bin, "png", 60)
+            self.assertEqual(render.call_count, 2)
+
+    def test_errors(self):
+        response = self.client.post(
+            "/converter/preview/wav/", {"file": upload("a.wav", tone(1))}
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/converter/preview/png/", {"file": upload("a.png", b"\x89PNG broken")}
+        )
+        self.assertEqual(response.status_code, 422)
+        response = self.client.post(
+            "/converter/preview/mp4/", {"file": upload("a.mp4", b"broken")}
+        )
+        self.assertEqual(response.status_code, 422)
+
+    def test_api_preview(self):
+        user = get_user_model().objects.create_user("api", password="x")
+        self.client.force_login(user)
+        response = self.client.post(
+            "/api/converter/preview/",
+            {"file": upload("a.png", picture(100, 50)), "size": "40"},
+        )
+        self.assertEqual(size_of(response.content), ("JPEG", (40, 20)))
@@ -0,0 +1,76 @@
+import importlib
+from django.apps import apps
+from converter.models import EncodingProfile, FormatType
+from converter.utils.cache_func import get_encoding_options
+from .base import ConverterTestCase
+
+
+migration = importlib.import_module("converter.migrations.0008_distinct_fast_profiles")
+
+
+class ProfilesTestCase(ConverterTestCase):
+    def add_profiles(self, input_format, output_format, file_type, **profiles):
+        conversion = self.add_conversion(input_format, output_format, file_type)
+        for name, options in profiles.items():
+            EncodingProfile.objects.create(
+                conversion=conversion, name=name, options=options
+            )
+        return conversion
+
+
+class EncodingOptionsTests(ProfilesTestCase):
+    def test_profile_of_the_pair(self):
+        self.add_profiles(
+            "mov", "mp4", FormatType.VIDEO, fast={"crf": 23}, balanced={"crf": 20}
+        )
+        self.assertEqual(get_encoding_options("mov", "mp4", "fast"), {"crf": 23})
+        self.assertEqual(get_encoding_options("MOV", "mp4", "balanced"), {"crf": 20})
+
+    def test_fast_falls_back_to_balanced(self):
+        self.add_profiles(
+            "mp4", "ogv", FormatType.VIDEO, balanced={"q": 7}, small={"q": 5}
+        )
+        self.assertEqual(get_encoding_options("mp4", "ogv", "fast"), {"q": 7})
+
+    def test_only_fast_falls_back(self):
+        self.add_profiles("png", "gif", FormatType.IMAGE, balanced={"a": 1})
+        self.assertEqual(get_encoding_options("png", "gif", "small"), {})
+
+    def test_pairs_without_profiles_keep_the_engine_defaults(self):
+        self.add_conversion("docx", "pdf", FormatType.DOCUMENT)
+        self.assertEqual(get_encoding_options("docx", "pdf", "fast"), {})
+        self.assertEqual(get_encoding_options("docx", "pdf", None), {})
+
+
+class DistinctFastProfilesTests(ProfilesTestCase):
+    def options(self, conversion):
+        return dict(conversion.profiles.values_list("name", "options"))
+
+    def test_qscale_profiles_differ(self):
+        conversion = self.add_conversion(
+            "mov", "avi", FormatType.VIDEO, video_codec="mpeg4"
+        )
+        for name, q in (("fast", "4"), ("balanced", "4"), ("small", "8")):
+            EncodingProfile.objects.create(
+                conversion=conversion,
+                name=name,
+                options={"ffmpeg_params": ["-q:v", q], "audio_bitrate": "128k"},
+            )
+        migration.separate_profiles(apps, None)
+        options = self.options(conversion)
+        self.assertNotEqual(options["fast"], options["balanced"])
+        self.assertEqual(options["balanced"]["ffmpeg_params"][-2:], ["-mbd", "rd"])
+        self.assertEqual(options["small"]["audio_bitrate"], "128k")
+
+    def test_repeated_fast_profiles_are_dropped(self):
+        same = {"ffmpeg_params": ["-q:a", "5"]}
+        vorbis = self.add_profiles(
+            "wav", "ogg", FormatType.AUDIO, fast=same, balanced=same, small={}
+        )
+        flac = self.add_profiles(
+            "wav", "flac", FormatType.AUDIO, fast={"l": 0}, balanced={"l": 5}
+        )
+        migration.separate_profiles(apps, None)
+        self.assertEqual(sorted(self.options(vorbis)), ["balanced", "small"])
+        self.assertEqual(sorted(self.options(flac)), ["balanced", "fast"])
+        self.assertEqual(get_encoding_options("wav", "ogg", "fast"), same)
@@ -0,0 +1,142 @@
+import marshal
+import os
+import pstats
+import tempfile
+import time
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.test import SimpleTestCase
+from converter.models import (
+    ConversionProfile,
+    FileFormat,
+    FormatType,
+    ProfilerMode,
+    ProfilingRule,
+)
+from converter.utils.profiling import (
+    DeterministicProfiler,
+    SamplingProfiler,
+    start_profiling,
+)
+from .base import ConverterTestCase
+
+
+LABELS = {"input_format": "png", "output_format": "jpeg", "engine": "pillow"}
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfilerTests(SimpleTestCase):
+    def test_sampling_profiler_collects_stacks(self):
+        profiler = SamplingProfiler(interval=0.002)
+        profiler.start()
+        busy_loop(0.2)
+        profiler.stop()
+        lines = profiler.dump().decode().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        # collapsed format, outermost frame first
+        self.assertIn("busy_loop (", stack.split(";")[-1])
+        self.assertGreater(int(count), 10)
+
+    def test_cprofile_dump_loads_in_pstats(self):
+        profiler = DeterministicProfiler()
+        profiler.start()
+        busy_loop(0.01)
+        profiler.stop()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "profile.pstats")
+            with open(path, "wb") as f:
+                f.write(profiler.dump())
+            stats = pstats.Stats(path)
+        functions = {name for _, _, name in stats.stats}
+        self.assertIn("busy_loop", functions)
+
+
+class ProfilingRulesTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("png", "webp", FormatType.IMAGE)
+
+    def add_rule(self, input_format=None, output_format=None, **fields):
+        formats = FileFormat.objects.filter
+        return ProfilingRule.objects.create(
+            input_format=input_format and formats(name=input_format).get(),
+            output_format=output_format and formats(name=output_format).get(),
+            **fields,
+        )
+
+    def test_no_rules(self):
+        self.assertIsNone(start_profiling("png", "jpeg"))
+
+    def test_most_specific_rule_decides(self):
+        self.add_rule(mode=ProfilerMode.SAMPLING)
+        self.add_rule("png", "jpeg", mode=ProfilerMode.CPROFILE)
+        profiling = start_profiling("png", "jpeg")
+        profiling.profiler.stop()
+        self.assertEqual(profiling.mode, ProfilerMode.CPROFILE)
+        profiling = start_profiling("png", "webp")
+        profiling.profiler.stop()
+        self.assertEqual(profiling.mode, ProfilerMode.SAMPLING)
+
+    def test_sampled_out(self):
+        self.add_rule("png", None, sample_rate=0)
+        # a matching rule that skipped the job doesn't fall through to the next
+        self.add_rule(sample_rate=1)
+        self.assertIsNone(start_profiling("png", "jpeg"))
+        profiling = start_profiling("jpeg", "png")
+        profiling.profiler.stop()
+        self.assertEqual(profiling.mode, ProfilerMode.SAMPLING)
+
+    def test_disabled_rules_are_ignored(self):
+        self.add_rule(enabled=False)
+        self.assertIsNone(start_profiling("png", "jpeg"))
+
+    def test_profile_is_saved(self):
+        self.add_rule(mode=ProfilerMode.CPROFILE)
+        profiling = start_profiling("png", "jpeg")
+        busy_loop(0.01)
+        profiling.finish("token", "task", LABELS, True)
+        profile = ConversionProfile.objects.get()
+        self.assertEqual(profile.filename, "token-png-jpeg.pstats")
+        self.assertTrue(profile.succeeded)
+        self.assertGreater(profile.duration, 0)
+        self.assertTrue(marshal.loads(bytes(profile.data)))
+
+    def test_failed_save_does_not_fail_the_conversion(self):
+        self.add_rule()
+        profiling = start_profiling("png", "jpeg")
+        with mock.patch.object(
+            ConversionProfile.objects, "create", side_effect=DatabaseError
+        ), self.assertLogs("converter.utils.profiling", "ERROR"):
+            profiling.finish("token", None, LABELS, False)
+
+
+class ProfileDownloadTests(ConverterTestCase):
+    def test_staff_download(self):
+        profile = ConversionProfile.objects.create(
+            token="token",
+            input_format="mp4",
+            output_format="webm",
+            mode=ProfilerMode.SAMPLING,
+            duration=1.0,
+            data=b"main (a.py:1) 3",
+        )
+        url = f"/admin/converter/conversionprofile/{profile.pk}/download/"
+        users = get_user_model().objects
+        self.client.force_login(users.create_user("user", password="x"))
+        self.assertNotEqual(self.client.get(url).status_code, 200)
+
+        self.client.force_login(users.create_superuser("admin", password="x"))
+        response = self.client.get(url)
+        self.assertEqual(response.content, b"main (a.py:1) 3")
+        self.assertEqual(
+            response["Content-Disposition"],
+            'attachment; filename="token-mp4-webm.collapsed.txt"',
+        )
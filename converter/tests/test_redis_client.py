@@ -0,0 +1,20 @@
+from asgiref.sync import async_to_sync
+from converter.utils.redis_ext_client import get_async_redis
+from .base import ConverterTestCase
+
+
+class AsyncRedisTests(ConverterTestCase):
+    def test_client_per_event_loop(self):
+        async def roundtrip(value):
+            await get_async_redis().set("key", value)
+            return await get_async_redis().get("key")
+
+        # async_to_sync runs every call on a new loop, as WSGI does per request
+        results = [async_to_sync(roundtrip)(value) for value in range(3)]
+        self.assertEqual(results, [b"0", b"1", b"2"])
+
+    def test_one_client_within_a_loop(self):
+        async def clients():
+            return get_async_redis() is get_async_redis()
+
+        self.assertTrue(async_to_sync(clients)())
@@ -0,0 +1,104 @@
+import os
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from converter.models import FormatType
+from converter.utils import scratch
+from converter.utils.converters import AudioConverter
+from converter.utils.scratch import memory_backed, scratch_dir
+from .base import ConverterTestCase
+from .test_clips import tone
+from .test_metrics import samples
+
+
+MB = 1024**2
+
+
+class ScratchTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        memory_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(memory_dir.cleanup)
+        self.memory_dir = memory_dir.name
+        limits = override_settings(
+            SCRATCH_MEMORY_DIR=self.memory_dir,
+            SCRATCH_MEMORY_MAX_INPUT=16 * MB,
+            SCRATCH_MEMORY_BUDGET=512 * MB,
+            SCRATCH_MEMORY_FACTOR=3,
+            SCRATCH_MIN_AVAILABLE=1024 * MB,
+        )
+        limits.enable()
+        self.addCleanup(limits.disable)
+        self.used = self.patch("_used_bytes", 0)
+        self.available = self.patch("_available_memory", 8192 * MB)
+
+    def patch(self, name, value):
+        patcher = mock.patch.object(scratch, name, return_value=value)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+
+class MemoryBackedTests(ScratchTestCase):
+    def test_small_inputs_go_to_memory(self):
+        self.assertTrue(memory_backed(MB))
+        self.used.assert_called_once_with(self.memory_dir)
+
+    def test_large_inputs_go_to_disk(self):
+        self.assertFalse(memory_backed(16 * MB + 1))
+
+    def test_host_budget(self):
+        self.used.return_value = 500 * MB
+        # three times the input, for the output and engine temp files
+        self.assertTrue(memory_backed(4 * MB))
+        self.assertFalse(memory_backed(5 * MB))
+
+    def test_available_memory_is_left_to_the_engines(self):
+        self.available.return_value = 1024 * MB + 3 * MB
+        self.assertTrue(memory_backed(MB))
+        self.assertFalse(memory_backed(2 * MB))
+        # unknown, e.g. outside linux
+        self.available.return_value = None
+        self.assertTrue(memory_backed(2 * MB))
+
+    def test_missing_memory_dir(self):
+        self.used.side_effect = FileNotFoundError
+        self.assertFalse(memory_backed(MB))
+
+    @override_settings(SCRATCH_MEMORY_DIR=None)
+    def test_disabled(self):
+        self.assertFalse(memory_backed(MB))
+        self.used.assert_not_called()
+
+    def test_used_bytes_of_a_real_dir(self):
+        self.used.stop()
+        self.assertGreaterEqual(scratch._used_bytes(self.memory_dir), 0)
+
+
+def count(medium):
+    return samples("converter_scratch_dirs", medium=medium).get(
+        "converter_scratch_dirs_total", 0
+    )
+
+
+class ScratchDirTests(ScratchTestCase):
+    def test_medium_is_counted(self):
+        memory, disk = count("memory"), count("disk")
+        with scratch_dir(MB) as path:
+            self.assertEqual(os.path.dirname(path), self.memory_dir)
+        with scratch_dir(32 * MB) as path:
+            self.assertEqual(os.path.dirname(path), tempfile.gettempdir())
+        self.assertEqual(count("memory"), memory + 1)
+        self.assertEqual(count("disk"), disk + 1)
+
+
+class EngineScratchTests(ConverterTestCase):
+    def test_engine_works_in_memory_and_cleans_up(self):
+        self.add_conversion("wav", "mp3", FormatType.AUDIO, audio_codec="libmp3lame")
+        memory = count("memory")
+        with tempfile.TemporaryDirectory() as memory_dir, override_settings(
+            SCRATCH_MEMORY_DIR=memory_dir
+        ), mock.patch.object(scratch, "memory_backed", return_value=True):
+            result = AudioConverter().convert(tone(1), "wav", "mp3")
+            self.assertTrue(result.read())
+            self.assertEqual(os.listdir(memory_dir), [])
+        self.assertEqual(count("memory"), memory + 1)
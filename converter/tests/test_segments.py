@@ -0,0 +1,165 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import warnings
+from unittest import mock
+from asgiref.sync import async_to_sync
+from celery.app.task import Context
+from celery.exceptions import ChordError
+from django.test import override_settings
+from converter.models import FormatType
+from converter.tasks import _segment_workflow, convert_task, fail_segmented_job
+from converter.utils.cancellation import add_pieces
+from converter.utils.clips import ffmpeg_binary
+from converter.utils.converters import VideoConverter
+from converter.utils.errors import ConversionError, InvalidInput
+from converter.utils.failures import input_key
+from converter.utils.history import FINISHED_KEY
+from converter.utils.inflight import claim_inflight
+from converter.utils.redis_ext_client import redis_client
+from .base import ConverterTestCase
+
+
+VIDEO_CONVERTER = "converter.utils.converters.VideoConverter"
+
+
+def video(seconds):
+    # one keyframe per second, the segment muxer can cut on every one
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "input.mp4")
+        cmd = [ffmpeg_binary(), "-v", "error", "-f", "lavfi"]
+        cmd += ["-i", f"testsrc=duration={seconds}:size=64x48:rate=10"]
+        subprocess.run([*cmd, "-c:v", "libx264", "-g", "10", path], check=True)
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def duration(path):
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    return ffmpeg_parse_infos(path)["duration"]
+
+
+class SegmentFailureTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+        self.job = (self.work_dir, VIDEO_CONVERTER, "mp4", "avi", "token", "digest")
+
+    def _claim(self):
+        return async_to_sync(claim_inflight)("digest", "mp4", "avi", "token", 60)
+
+    def test_workflow_finishes_failed_chords(self):
+        workflow = _segment_workflow(
+            VIDEO_CONVERTER,
+            "video",
+            self.work_dir,
+            ["segment_0000.mkv", "segment_0001.mkv"],
+            "mp4",
+            "avi",
+            "token",
+            "digest",
+            "progress",
+            None,
+        )
+        (errback,) = workflow.body.options["link_error"]
+        self.assertEqual(errback["task"], fail_segmented_job.name)
+        self.assertEqual(tuple(errback["args"]), (*self.job, None))
+
+    def test_failed_segment_finishes_the_job(self):
+        self._claim()
+        add_pieces("progress", ["piece-1", "piece-2"])
+        fail_segmented_job.backend.mark_as_done("piece-1", "part")
+        fail_segmented_job.backend.mark_as_failure("piece-2", InvalidInput("bad"))
+        open(os.path.join(self.work_dir, "segment_0000.mkv"), "wb").close()
+
+        with self.assertLogs("converter.tasks", "ERROR"):
+            fail_segmented_job(
+                Context(id="progress"), ChordError("piece-2 raised"), None, *self.job
+            )
+
+        (entry,) = [json.loads(e) for e in redis_client.lrange(FINISHED_KEY, 0, -1)]
+        self.assertEqual(entry["outcome"], "invalid_input")
+        self.assertEqual(entry["task_id"], "progress")
+        self.assertFalse(os.path.exists(self.work_dir))
+        self.assertTrue(
+            redis_client.exists(input_key("failed", "digest", "mp4", "avi"))
+        )
+        # released, the next submission leads its own job
+        self.assertFalse(redis_client.keys("inflight:*"))
+
+    def test_other_failures_are_not_remembered(self):
+        self._claim()
+        with self.assertLogs("converter.tasks", "ERROR"):
+            fail_segmented_job(
+                Context(id="progress"), ChordError("timeout"), None, *self.job
+            )
+        (entry,) = [json.loads(e) for e in redis_client.lrange(FINISHED_KEY, 0, -1)]
+        self.assertEqual(entry["outcome"], "failed")
+        self.assertFalse(redis_client.keys("failed:*"))
+        self.assertFalse(redis_client.keys("inflight:*"))
+
+
+class SegmentEncodingTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("mp4", "avi", FormatType.VIDEO, video_codec="mpeg4")
+        segment_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(segment_dir.cleanup)
+        self.segment_dir = segment_dir.name
+        segments = override_settings(
+            SEGMENT_DIR=self.segment_dir,
+            VIDEO_SEGMENT_MIN_SIZE=0,
+            VIDEO_SEGMENT_MIN_DURATION=3,
+            VIDEO_SEGMENT_DURATION=1,
+        )
+        segments.enable()
+        self.addCleanup(segments.disable)
+        self.converter = VideoConverter()
+
+    def test_segments_join_into_the_whole_video(self):
+        work_dir, segments = self.converter.split(video(4), "mp4")
+        self.assertEqual(len(segments), 4)
+        # only the segments are left once the input is cut
+        self.assertEqual(
+            sorted(os.listdir(work_dir)), [os.path.basename(p) for p in segments]
+        )
+        with warnings.catch_warnings():
+            # moviepy repeats the last frame of segments it reads short
+            warnings.simplefilter("ignore", UserWarning)
+            parts = [
+                self.converter.encode_segment(path, "mp4", "avi") for path in segments
+            ]
+        output_path = os.path.join(work_dir, "output.avi")
+        self.converter.join(parts, output_path)
+        # each part may run a frame long
+        self.assertAlmostEqual(duration(output_path), 4, delta=0.5)
+
+    @override_settings(VIDEO_SEGMENT_MIN_SIZE=1024 * 1024)
+    def test_small_inputs_are_not_split(self):
+        self.assertIsNone(self.converter.split(video(4), "mp4"))
+
+    def test_short_inputs_are_not_split(self):
+        self.assertIsNone(self.converter.split(video(2), "mp4"))
+        self.assertEqual(os.listdir(self.segment_dir), [])
+
+    def test_workers_without_shared_work_dirs_convert_in_one_piece(self):
+        with override_settings(
+            SHARED_WORK_DIRS=False, TEMP_DIR=self.segment_dir
+        ), mock.patch.object(
+            VideoConverter, "split"
+        ) as split, warnings.catch_warnings(), self.assertLogs(
+            "converter.tasks"
+        ):
+            warnings.simplefilter("ignore", UserWarning)
+            result = convert_task.apply((video(4), "mp4", "avi", "token"))
+        split.assert_not_called()
+        self.assertEqual(result.state, "SUCCESS")
+
+    def test_unreadable_input_leaves_no_work_dir(self):
+        with self.assertRaises(ConversionError):
+            self.converter.split(b"not a video" * 100, "mp4")
+        self.assertEqual(os.listdir(self.segment_dir), [])
@@ -0,0 +1,174 @@
+import io
+import wave
+import zipfile
+from django.test import SimpleTestCase
+from PIL import Image
+from converter.models import FormatType
+from converter.utils.metrics import REJECTIONS
+from converter.utils.sniffing import HEAD_SIZE, TEXT_FORMATS, content_mismatch, sniff
+from converter.utils.submission import Rejected, _check_upload
+from .base import ConverterTestCase
+from .test_submission import SubmissionTestCase, png, upload
+
+
+def image(file_format):
+    out = io.BytesIO()
+    # ico keeps only its standard sizes, 16 is the smallest
+    Image.new("RGB", (16, 16), "blue").save(out, format=file_format)
+    return out.getvalue()
+
+
+def wav():
+    out = io.BytesIO()
+    with wave.open(out, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(8000)
+        f.writeframes(b"\x00\x00" * 800)
+    return out.getvalue()
+
+
+def odt():
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w") as f:
+        f.writestr(
+            "mimetype",
+            "application/vnd.oasis.opendocument.text",
+            compress_type=zipfile.ZIP_STORED,
+        )
+        f.writestr("content.xml", "<office:document-content/>")
+    return out.getvalue()
+
+
+def docx():
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as f:
+        f.writestr("[Content_Types].xml", "<Types/>")
+        f.writestr("word/document.xml", "<w:document/>")
+    return out.getvalue()
+
+
+class SniffTests(SimpleTestCase):
+    def test_images(self):
+        for file_format, name in (
+            ("PNG", "png"),
+            ("JPEG", "jpeg"),
+            ("GIF", "gif"),
+            ("BMP", "bmp"),
+            ("TIFF", "tiff"),
+            ("WEBP", "webp"),
+            ("ICO", "ico"),
+            ("PPM", "ppm"),
+        ):
+            with self.subTest(file_format):
+                self.assertEqual(sniff(image(file_format)[:HEAD_SIZE]), {name})
+
+    def test_containers(self):
+        self.assertEqual(sniff(wav()), {"wav"})
+        self.assertEqual(sniff(odt()), {"odt"})
+        self.assertEqual(sniff(docx()), {"docx"})
+        self.assertEqual(sniff(b"%PDF-1.7\n"), {"pdf"})
+        self.assertEqual(sniff(b"\x00\x00\x00\x18ftypmp42"), {"mp4", "mov", "m4a"})
+
+    def test_id3_tag_is_skipped(self):
+        # a 20 byte tag, then a flac stream
+        tag = b"ID3\x04\x00\x00\x00\x00\x00\x14" + b"\x00" * 20
+        self.assertEqual(sniff(tag + b"fLaC\x00\x00\x00\x22"), {"flac"})
+        # tag longer than the head, could be any of them
+        long_tag = b"ID3\x04\x00\x00\x00\x00\x7f\x7f" + b"\x00" * 100
+        self.assertEqual(sniff(long_tag), {"mp3", "aac", "flac"})
+
+    def test_text(self):
+        self.assertEqual(sniff("# Résumé\n".encode()), {"markdown", "latex", "html"})
+        # a character cut off by the head
+        self.assertEqual(sniff("é".encode()[:1]), {"markdown", "latex", "html"})
+        self.assertEqual(sniff(b"text\x00with nul"), set())
+
+    def test_text_in_legacy_encodings(self):
+        html = "<p>Café — naïve</p>\n".encode("cp1252")
+        self.assertEqual(sniff(html), {"markdown", "latex", "html"})
+        self.assertEqual(sniff("Grüße\r\n".encode("latin-1")), TEXT_FORMATS)
+        # binary data without a nul still isn't text
+        self.assertEqual(sniff(bytes(range(1, 256))), set())
+
+    def test_truncated_headers(self):
+        self.assertEqual(sniff(png()[:20]), set())
+        self.assertEqual(sniff(png()[:23]), set())
+        self.assertEqual(sniff(b"GIF89a\x00\x00\x00\x00"), set())
+        self.assertEqual(sniff(b""), set())
+
+    def test_content_mismatch(self):
+        self.assertIsNone(content_mismatch("png", png()))
+        self.assertEqual(content_mismatch("png", image("JPEG")), {"jpeg"})
+        self.assertEqual(content_mismatch("pdf", b"\x00\x01\x02"), set())
+        # no signature to check these against, unless the content is something else
+        self.assertIsNone(content_mismatch("tga", b"\x00\x00\x02\x00"))
+        self.assertEqual(content_mismatch("tga", png()), {"png"})
+
+
+class CheckUploadTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("pdf", "docx", FormatType.DOCUMENT)
+
+    def rejected(self, head, input_format, output_formats=("jpeg",)):
+        with self.assertRaises(Rejected) as cm:
+            _check_upload(head, input_format, list(output_formats))
+        return cm.exception
+
+    def test_valid_upload(self):
+        self.assertEqual(_check_upload(png(), "png", ["jpeg"]), "png")
+        # named after the content when the upload has no extension
+        self.assertEqual(_check_upload(png(), "", ["jpeg"]), "png")
+
+    def test_content_of_another_format(self):
+        e = self.rejected(b"%PDF-1.7\n", "png")
+        self.assertEqual(e.status, 415)
+        self.assertEqual(str(e), "The file content is PDF, not PNG")
+        e = self.rejected(b"<html></html>", "png")
+        self.assertEqual(str(e), "The file content is TEXT, not PNG")
+
+    def test_unrecognised_content(self):
+        e = self.rejected(b"\x00\x01\x02\x03", "png")
+        self.assertEqual(e.status, 415)
+        self.assertEqual(str(e), "This is not a valid PNG file")
+
+    def test_format_not_told_by_the_content(self):
+        e = self.rejected(b"\x00\x01\x02\x03", "")
+        self.assertEqual(e.status, 415)
+        # several text formats match, the extension has to decide
+        self.rejected(b"plain words", "")
+
+    def test_pair_is_checked_before_the_content(self):
+        e = self.rejected(b"\x01\x02", "png", ["webp"])
+        self.assertEqual(e.status, 422)
+        self.assertEqual(str(e), "png can't be converted to webp")
+        self.assertEqual(self.rejected(png(), "xyz").status, 422)
+
+    def test_rejections_are_counted(self):
+        counter = REJECTIONS.labels(reason="content_mismatch")
+        before = counter._value.get()
+        self.rejected(b"%PDF-1.7\n", "png")
+        self.assertEqual(counter._value.get(), before + 1)
+
+
+class SniffedSubmissionTests(SubmissionTestCase):
+    def test_mismatched_upload_is_not_queued(self):
+        response = self.submit(
+            file=upload("a.png", b"%PDF-1.7\n"), output_format="jpeg"
+        )
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(response.json(), {"error": "The file content is PDF, not PNG"})
+        self.enqueue.assert_not_called()
+
+    def test_html_in_a_legacy_encoding(self):
+        self.add_conversion("html", "pdf", FormatType.DOCUMENT)
+        html = "<html><body>Café, crème brûlée</body></html>".encode("cp1252")
+        response = self.submit(file=upload("menu.html", html), output_format="pdf")
+        self.assertEqual(response.status_code, 202)
+
+    def test_upload_without_extension(self):
+        response = self.submit(file=upload("scan"), output_format="jpeg")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.enqueue.call_args.args[2], "png")
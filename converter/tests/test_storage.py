@@ -0,0 +1,167 @@
+import gzip
+import io
+import os
+import tempfile
+import time
+from urllib.parse import parse_qs, urlsplit
+import boto3
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from moto import mock_aws
+from converter.utils.redis_ext_client import redis_client
+from converter.utils.storage import (
+    LocalResultStorage,
+    S3ResultStorage,
+    get_result_storage,
+    work_dirs_shared,
+)
+from .base import ConverterTransactionTestCase
+
+
+BUCKET = "conversions"
+S3_STORAGE = {
+    "BACKEND": "converter.utils.storage.S3ResultStorage",
+    "OPTIONS": {"bucket": BUCKET, "region_name": "us-east-1"},
+}
+
+
+class StorageTestCase(ConverterTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        get_result_storage.cache_clear()
+        self.addCleanup(get_result_storage.cache_clear)
+        user = get_user_model().objects.create_user("storage", password="x")
+        self.client.force_login(user)
+
+    def download(self, name, **headers):
+        redis_client.set("path:token", name)
+        return self.client.get("/api/converter/result/token/", headers=headers)
+
+    def content(self, response):
+        return b"".join(response.streaming_content)
+
+
+class S3StorageTests(StorageTestCase):
+    # moto serves the bucket in process, as any S3 compatible server would
+    def setUp(self):
+        super().setUp()
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.storage = S3ResultStorage(BUCKET, region_name="us-east-1")
+
+    def test_saved_result_reads_back(self):
+        self.storage.save("a.pdf", io.BytesIO(b"%PDF"))
+        self.assertEqual(self.storage.open("a.pdf").read(), b"%PDF")
+        size, age = self.storage.stat("a.pdf")
+        self.assertEqual(size, 4)
+        self.assertLess(age, 60)
+
+    def test_objects_carry_their_headers(self):
+        self.storage.save("a.html.gz", io.BytesIO(gzip.compress(b"<p>")))
+        head = self.s3.head_object(Bucket=BUCKET, Key="results/a.html.gz")
+        self.assertEqual(head["ContentType"], "text/html")
+        self.assertEqual(head["ContentEncoding"], "gzip")
+
+    def test_large_result_is_uploaded_in_parts(self):
+        part_size = 5 * 1024 * 1024
+        storage = S3ResultStorage(BUCKET, region_name="us-east-1", part_size=part_size)
+        data = os.urandom(2 * part_size + 1)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            storage.save_file("big.mp4", f.name)
+        head = self.s3.head_object(Bucket=BUCKET, Key="results/big.mp4")
+        # multipart etags end with the number of parts
+        self.assertTrue(head["ETag"].strip('"').endswith("-3"))
+        self.assertEqual(storage.open("big.mp4").read(), data)
+
+    def test_missing_result(self):
+        self.assertIsNone(self.storage.stat("gone.pdf"))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open("gone.pdf")
+
+    def test_download_url_names_the_file(self):
+        url = self.storage.url("token.pdf", "résumé.pdf")
+        query = parse_qs(urlsplit(url).query)
+        self.assertEqual(
+            query["response-content-disposition"],
+            ["attachment; filename*=utf-8''r%C3%A9sum%C3%A9.pdf"],
+        )
+
+    def test_downloads_stay_on_the_web_tier_when_not_offloaded(self):
+        storage = S3ResultStorage(BUCKET, offload_downloads=False)
+        self.assertIsNone(storage.url("token.pdf", "token.pdf"))
+
+    def test_lifecycle_rule_expires_results(self):
+        self.storage.configure_lifecycle(1)
+        (rule,) = self.s3.get_bucket_lifecycle_configuration(Bucket=BUCKET)["Rules"]
+        self.assertEqual(rule["Expiration"], {"Days": 1})
+        self.assertEqual(rule["Filter"], {"Prefix": "results/"})
+
+    @override_settings(RESULT_STORAGE=S3_STORAGE)
+    def test_download_redirects_to_the_bucket(self):
+        get_result_storage().save("token.pdf", io.BytesIO(b"%PDF"))
+        response = self.download("token.pdf")
+        self.assertEqual(response.status_code, 302)
+        location = urlsplit(response["Location"])
+        self.assertIn(BUCKET, location.netloc + location.path)
+        self.assertTrue(location.path.endswith("/results/token.pdf"))
+
+    @override_settings(RESULT_STORAGE=S3_STORAGE)
+    def test_download_is_decoded_for_clients_without_the_encoding(self):
+        get_result_storage().save("token.html.gz", io.BytesIO(gzip.compress(b"<p>")))
+        response = self.download("token.html.gz", accept_encoding="identity")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), b"<p>")
+        self.assertNotIn("Content-Encoding", response)
+
+    @override_settings(RESULT_STORAGE=S3_STORAGE)
+    def test_work_dirs_are_not_shared_through_the_bucket(self):
+        self.assertFalse(work_dirs_shared())
+        # unless the workers mount a shared filesystem for them
+        with override_settings(SHARED_WORK_DIRS=True):
+            self.assertTrue(work_dirs_shared())
+
+
+class LocalStorageTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        self.location = location.name
+        self.storage = LocalResultStorage(self.location)
+
+    def test_saved_result_reads_back(self):
+        self.storage.save("a.pdf", io.BytesIO(b"%PDF"))
+        with self.storage.open("a.pdf") as f:
+            self.assertEqual(f.read(), b"%PDF")
+        self.assertEqual(os.listdir(self.location), ["a.pdf"])
+        self.assertEqual(self.storage.stat("a.pdf")[0], 4)
+        self.assertIsNone(self.storage.stat("gone.pdf"))
+
+    def test_expire_removes_old_results(self):
+        self.storage.save("old.pdf", io.BytesIO(b"%PDF"))
+        self.storage.save("new.pdf", io.BytesIO(b"%PDF"))
+        hour_ago = time.time() - 3600
+        os.utime(os.path.join(self.location, "old.pdf"), (hour_ago, hour_ago))
+        with self.assertLogs("converter.utils.storage", "INFO"):
+            self.storage.expire(60)
+        self.assertEqual(os.listdir(self.location), ["new.pdf"])
+
+    def test_download_names_the_file(self):
+        with override_settings(TEMP_DIR=self.location):
+            self.storage.save("token.pdf", io.BytesIO(b"%PDF"))
+            response = self.download("token.pdf")
+            self.assertEqual(self.content(response), b"%PDF")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="token.pdf"'
+        )
+        self.assertEqual(response["Content-Length"], "4")
+
+    def test_work_dirs_are_shared_with_the_results(self):
+        self.assertTrue(work_dirs_shared())
+        with override_settings(SHARED_WORK_DIRS=False):
+            self.assertFalse(work_dirs_shared())
@@ -0,0 +1,92 @@
+import io
+from unittest import mock
+from django.contrib.auth import get_user_model
+from PIL import Image
+from converter.models import FormatType
+from converter.utils import submission
+from converter.utils.redis_ext_client import redis_client
+from .base import ConverterTransactionTestCase
+
+
+def png():
+    out = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(out, format="PNG")
+    return out.getvalue()
+
+
+def upload(name="a.png", data=None):
+    f = io.BytesIO(png() if data is None else data)
+    f.name = name
+    return f
+
+
+class SubmissionTestCase(ConverterTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        self.add_conversion("png", "webp", FormatType.IMAGE)
+        self.user = get_user_model().objects.create_user("api", password="x")
+        self.client.force_login(self.user)
+        enqueue = mock.patch.object(submission, "enqueue")
+        self.enqueue = enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def submit(self, **data):
+        data.setdefault("file", upload())
+        return self.client.post("/api/converter/convert/", data)
+
+
+class SubmitViewTests(SubmissionTestCase):
+    def test_submission_is_enqueued(self):
+        response = self.submit(output_format="jpeg")
+        self.assertEqual(response.status_code, 202)
+        token = response.json()["result token"]
+        task_id = redis_client.get(f"conv:{token}").decode()
+
+        self.enqueue.assert_awaited_once()
+        call = self.enqueue.call_args
+        self.assertEqual(call.args[0], submission.CONVERT_TASK)
+        self.assertEqual(call.args[1:], (png(), "png", "jpeg", token))
+        self.assertEqual(call.kwargs["task_id"], task_id)
+        self.assertEqual(call.kwargs["soft_time_limit"], 60)
+        # the worker completes the job's history entry
+        self.assertEqual(
+            redis_client.hget(f"job:{token}", "user_id").decode(), str(self.user.pk)
+        )
+
+    def test_several_targets_share_one_job(self):
+        response = self.submit(output_format="jpeg,webp")
+        tokens = response.json()["result tokens"]
+        self.assertEqual(sorted(tokens), ["jpeg", "webp"])
+        call = self.enqueue.call_args
+        self.assertEqual(call.args[0], submission.CONVERT_MANY_TASK)
+        self.assertEqual(call.args[3], tokens)
+        # one decode, but every target is encoded
+        self.assertEqual(call.kwargs["soft_time_limit"], 120)
+
+    def test_missing_file(self):
+        response = self.client.post(
+            "/api/converter/convert/", {"output_format": "jpeg"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_output_format(self):
+        self.assertEqual(self.submit().status_code, 400)
+
+    def test_unsupported_pair(self):
+        response = self.submit(output_format="gif")
+        self.assertEqual(response.status_code, 422)
+        self.enqueue.assert_not_called()
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        self.assertEqual(self.submit(output_format="jpeg").status_code, 403)
+
+    def test_failed_enqueue_releases_the_job(self):
+        self.enqueue.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            self.submit(output_format="jpeg")
+        self.enqueue.side_effect = None
+        # a retry leads its own job instead of following the failed one
+        self.assertEqual(self.submit(output_format="jpeg").status_code, 202)
+        self.assertEqual(self.enqueue.await_count, 2)
@@ -0,0 +1,131 @@
+import io
+import os
+from types import SimpleNamespace
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from converter.models import FormatType
+from converter.utils import threads
+from converter.utils.converters import AudioConverter
+from converter.utils.threads import (
+    BUDGET_ENV,
+    THREAD_ENV_VARS,
+    ffmpeg_threads,
+    set_thread_budget,
+    thread_budget,
+    visible_cpus,
+)
+from siteconv.celery import budget_engine_threads
+from .base import ConverterTestCase
+from .test_clips import tone
+from .test_metrics import samples
+
+
+def cgroup(files):
+    # stands in for the cgroup files, a missing one raises like on the host
+    def fake_open(path, *args, **kwargs):
+        if path not in files:
+            raise FileNotFoundError(path)
+        return io.StringIO(files[path])
+
+    return mock.patch.object(threads, "open", fake_open, create=True)
+
+
+def worker_env(**env):
+    # a worker's environment without budgets set by the host running the tests
+    environ = {k: v for k, v in os.environ.items() if k not in THREAD_ENV_VARS}
+    environ.pop(BUDGET_ENV, None)
+    return mock.patch.dict(os.environ, {**environ, **env}, clear=True)
+
+
+class VisibleCpusTests(SimpleTestCase):
+    def test_cgroup_v2_quota(self):
+        with cgroup({"/sys/fs/cgroup/cpu.max": "150000 100000\n"}):
+            self.assertEqual(threads._cgroup_quota(), 1.5)
+        with cgroup({"/sys/fs/cgroup/cpu.max": "max 100000\n"}):
+            self.assertIsNone(threads._cgroup_quota())
+
+    def test_cgroup_v1_quota(self):
+        v1 = {
+            "/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "200000\n",
+            "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000\n",
+        }
+        with cgroup(v1):
+            self.assertEqual(threads._cgroup_quota(), 2)
+        with cgroup({**v1, "/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "-1\n"}):
+            self.assertIsNone(threads._cgroup_quota())
+        with cgroup({}):
+            self.assertIsNone(threads._cgroup_quota())
+
+    def test_affinity_capped_by_the_quota(self):
+        with mock.patch.object(
+            threads.os, "sched_getaffinity", return_value=set(range(8))
+        ):
+            for quota, cpus in ((None, 8), (1.5, 2), (0.1, 1), (32, 8)):
+                with self.subTest(quota), mock.patch.object(
+                    threads, "_cgroup_quota", return_value=quota
+                ):
+                    self.assertEqual(visible_cpus(), cpus)
+
+
+class ThreadBudgetTests(SimpleTestCase):
+    def test_cpus_are_divided_among_the_pool(self):
+        self.assertEqual(thread_budget(8, 3), 2)
+        self.assertEqual(thread_budget(8, 16), 1)
+        self.assertEqual(thread_budget(8, 0), 8)
+
+    @override_settings(ENGINE_THREADS=3)
+    def test_setting_overrides(self):
+        self.assertEqual(thread_budget(8, 8), 3)
+
+    def test_budget_is_inherited_through_the_environment(self):
+        with worker_env(OMP_NUM_THREADS="1"), mock.patch.object(
+            threads, "visible_cpus", return_value=8
+        ), self.assertLogs("converter.utils.threads"):
+            self.assertEqual(set_thread_budget("w1", 2), (2, 4))
+            self.assertEqual(os.environ[BUDGET_ENV], "4")
+            # the deployment's own value wins
+            self.assertEqual(os.environ["OMP_NUM_THREADS"], "1")
+            self.assertEqual(os.environ["OPENBLAS_NUM_THREADS"], "4")
+        self.assertEqual(
+            samples("converter_engine_threads", worker="w1"),
+            {"converter_engine_threads": 4},
+        )
+        self.assertEqual(
+            samples("converter_visible_cpus", worker="w1"),
+            {"converter_visible_cpus": 8},
+        )
+
+    def test_worker_concurrency_follows_the_visible_cpus(self):
+        with worker_env(), mock.patch.object(
+            threads, "visible_cpus", return_value=3
+        ), self.assertLogs("converter.utils.threads"):
+            conf = SimpleNamespace()
+            budget_engine_threads("w2", conf, {})
+            self.assertEqual(conf.worker_concurrency, 3)
+            self.assertEqual(os.environ[BUDGET_ENV], "1")
+            budget_engine_threads("w3", conf, {"pool": "solo", "concurrency": 4})
+            self.assertEqual(conf.worker_concurrency, 1)
+            self.assertEqual(os.environ[BUDGET_ENV], "3")
+
+    def test_ffmpeg_threads(self):
+        with worker_env():
+            self.assertEqual(ffmpeg_threads(), [])
+        with worker_env(**{BUDGET_ENV: "4"}):
+            self.assertEqual(ffmpeg_threads(), ["-threads", "4"])
+            self.assertEqual(ffmpeg_threads(3), ["-threads", "1"])
+            self.assertEqual(ffmpeg_threads(8), ["-threads", "1"])
+
+
+class EngineThreadsTests(ConverterTestCase):
+    def test_outputs_of_one_run_share_the_budget(self):
+        self.add_conversion("wav", "mp3", FormatType.AUDIO, audio_codec="libmp3lame")
+        self.add_conversion("wav", "ogg", FormatType.AUDIO, audio_codec="libvorbis")
+        converter = AudioConverter()
+        with worker_env(**{BUDGET_ENV: "4"}), mock.patch.object(
+            converter, "_run_engine", wraps=converter._run_engine
+        ) as engine:
+            converter.convert_many(tone(1), "wav", ["mp3", "ogg"])
+        cmd = engine.call_args.args[0]
+        # the decode gets the whole budget, each encoder half of it
+        counts = [cmd[i + 1] for i, arg in enumerate(cmd) if arg == "-threads"]
+        self.assertEqual(counts, ["4", "2", "2"])
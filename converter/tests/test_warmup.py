@@ -0,0 +1,91 @@
+import subprocess
+import sys
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from converter import tasks
+from converter.models import FormatType
+from converter.utils import warmup
+from converter.utils.errors import EngineUnavailable
+from .base import ConverterTestCase
+
+
+ENGINES = ("moviepy", "numpy", "PIL", "pypandoc", "converter.tasks")
+
+WEB_TIER = f"""
+import sys
+import django
+
+django.setup()
+import siteconv.asgi, siteconv.urls
+
+print(",".join(m for m in {ENGINES!r} if m in sys.modules))
+"""
+
+
+class WebTierTests(SimpleTestCase):
+    def test_web_process_does_not_load_the_engines(self):
+        # a fresh interpreter, the test run itself has them all loaded
+        loaded = subprocess.run(
+            [sys.executable, "-c", WEB_TIER],
+            capture_output=True,
+            check=True,
+            text=True,
+            timeout=60,
+        ).stdout.strip()
+        self.assertEqual(loaded, "")
+
+
+class WarmUpTests(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        run = mock.patch.object(warmup.subprocess, "run")
+        self.run = run.start()
+        self.addCleanup(run.stop)
+
+    def warm_up(self):
+        with self.assertLogs("converter.utils.warmup") as logs:
+            warmup.warm_up()
+        return logs.records
+
+    def test_catalog_is_cached(self):
+        records = self.warm_up()
+        self.assertEqual(cache.get("format_type_png"), FormatType.IMAGE)
+        self.assertEqual(cache.get("format_type_jpeg"), FormatType.IMAGE)
+        timings = records[-1].__dict__
+        self.assertEqual(records[-1].getMessage(), "worker warmed up")
+        for stage in ("engines", "engine_start", "catalog"):
+            self.assertIn(stage, timings)
+
+    def test_engines_are_started_once(self):
+        with mock.patch.object(warmup.shutil, "which", return_value=None), mock.patch(
+            "converter.utils.converters.pandoc_path",
+            side_effect=EngineUnavailable("pandoc is not installed"),
+        ):
+            self.warm_up()
+        # only ffmpeg is there to start
+        self.assertEqual(self.run.call_count, 1)
+        cmd = self.run.call_args.args[0]
+        self.assertEqual(cmd[1:], ["-hide_banner", "-version"])
+        self.assertEqual(self.run.call_args.kwargs["timeout"], 60)
+
+    def test_failed_step_does_not_stop_the_worker(self):
+        with mock.patch.object(
+            warmup, "_load_engines", side_effect=ImportError("no moviepy")
+        ):
+            records = self.warm_up()
+        self.assertEqual(records[0].levelname, "ERROR")
+        self.assertEqual(records[0].stage, "engines")
+        # engines that can't be imported aren't started either
+        self.run.assert_not_called()
+        self.assertIn("catalog", records[-1].__dict__)
+        self.assertNotIn("engine_start", records[-1].__dict__)
+
+    def test_worker_signal(self):
+        with mock.patch.object(tasks, "warm_up") as warm_up:
+            with override_settings(WORKER_WARMUP=False):
+                tasks.warm_up_worker()
+            warm_up.assert_not_called()
+            tasks.warm_up_worker()
+            warm_up.assert_called_once_with()
@@ -0,0 +1,250 @@
+import hashlib
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from converter.models import FormatType, JobOutcome, WebhookFailure
+from converter.tasks import deliver_webhook
+from converter.utils import submission, webhooks
+from converter.utils.webhooks import (
+    WebhookError,
+    WebhookRejected,
+    callback,
+    completion,
+    register_callback,
+    send_webhook,
+    take_callbacks,
+)
+from users.api.utils import generate_api_key
+from users.models import UserAPIKey
+from .base import ConverterTestCase, ConverterTransactionTestCase
+from .test_submission import upload
+
+
+RESULT = completion(JobOutcome.SUCCEEDED, 10)
+
+
+class Receiver(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append((dict(self.headers), body))
+        self.send_response(self.server.status)
+        if self.server.status == 302:
+            self.send_header("Location", "http://127.0.0.1:1/")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class WebhookTestCase(ConverterTestCase):
+    def setUp(self):
+        super().setUp()
+        user = get_user_model().objects.create_user("client", password="x")
+        self.api_key = UserAPIKey.objects.create(user=user, key=generate_api_key())
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Receiver)
+        server.received, server.status = [], 200
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+        self.hook = callback(
+            f"http://127.0.0.1:{server.server_port}/done",
+            self.api_key.pk,
+            "https://conv.example/",
+        )
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=True)
+class SendWebhookTests(WebhookTestCase):
+    def test_delivery_is_signed_with_the_api_key(self):
+        send_webhook("token", self.hook, RESULT)
+        ((headers, body),) = self.server.received
+        timestamp = headers["X-Webhook-Timestamp"]
+        expected = hmac.new(
+            self.api_key.key.encode(),
+            f"{timestamp}.".encode() + body,
+            hashlib.sha256,
+        ).hexdigest()
+        self.assertEqual(headers["X-Webhook-Signature"], f"sha256={expected}")
+        self.assertEqual(headers["X-Webhook-Token"], "token")
+        payload = json.loads(body)
+        self.assertEqual(payload["status"], "succeeded")
+        self.assertEqual(
+            payload["download_url"],
+            "https://conv.example/api/converter/result/token/",
+        )
+
+    def test_coalesced_submission_is_told_its_own_token(self):
+        send_webhook("leader", {**self.hook, "token": "follower"}, RESULT)
+        ((headers, body),) = self.server.received
+        self.assertEqual(headers["X-Webhook-Token"], "follower")
+        payload = json.loads(body)
+        self.assertEqual(payload["token"], "follower")
+        self.assertTrue(payload["download_url"].endswith("/result/follower/"))
+
+    def test_failed_jobs_have_no_download(self):
+        send_webhook("token", self.hook, completion(JobOutcome.BUDGET_EXCEEDED, None))
+        payload = json.loads(self.server.received[0][1])
+        self.assertEqual(payload["status"], "failed")
+        self.assertEqual(payload["outcome"], "budget_exceeded")
+        self.assertNotIn("download_url", payload)
+
+    def test_error_response(self):
+        self.server.status = 500
+        with self.assertRaisesMessage(WebhookError, "HTTP 500"):
+            send_webhook("token", self.hook, RESULT)
+
+    def test_redirects_are_not_followed(self):
+        self.server.status = 302
+        with self.assertRaisesMessage(WebhookError, "HTTP 302"):
+            send_webhook("token", self.hook, RESULT)
+        self.assertEqual(len(self.server.received), 1)
+
+    def test_unreachable_receiver(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(WebhookError):
+            send_webhook("token", self.hook, RESULT)
+
+    def test_deleted_api_key(self):
+        self.api_key.delete()
+        with self.assertRaises(WebhookRejected):
+            send_webhook("token", self.hook, RESULT)
+        self.assertEqual(self.server.received, [])
+
+
+class DestinationTests(WebhookTestCase):
+    def test_private_hosts_are_rejected(self):
+        with self.assertRaisesMessage(WebhookRejected, "not a public address"):
+            send_webhook("token", self.hook, RESULT)
+        self.assertEqual(self.server.received, [])
+
+    def test_unresolvable_host_is_retried(self):
+        hook = {**self.hook, "url": "http://nonexistent.invalid/done"}
+        with self.assertRaises(WebhookError) as cm:
+            send_webhook("token", hook, RESULT)
+        self.assertNotIsInstance(cm.exception, WebhookRejected)
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=True)
+class DeliverWebhookTests(WebhookTestCase):
+    def setUp(self):
+        super().setUp()
+        requeue = mock.patch.object(deliver_webhook, "apply_async")
+        self.requeue = requeue.start()
+        self.addCleanup(requeue.stop)
+
+    def deliver(self, attempt=0):
+        with self.assertLogs("converter.tasks") as logs:
+            deliver_webhook("token", self.hook, RESULT, attempt)
+        return logs.output
+
+    def test_delivered(self):
+        self.deliver()
+        self.assertEqual(len(self.server.received), 1)
+        self.requeue.assert_not_called()
+
+    def test_failed_delivery_backs_off(self):
+        self.server.status = 503
+        self.deliver(attempt=2)
+        self.requeue.assert_called_once_with(
+            ("token", self.hook, RESULT), {"attempt": 3}, countdown=120
+        )
+        self.assertFalse(WebhookFailure.objects.exists())
+
+    @override_settings(WEBHOOK_MAX_ATTEMPTS=3)
+    def test_last_attempt_is_dead_lettered(self):
+        self.server.status = 503
+        self.deliver(attempt=2)
+        self.requeue.assert_not_called()
+        failure = WebhookFailure.objects.get()
+        self.assertEqual(failure.attempts, 3)
+        self.assertEqual(failure.api_key_id, self.api_key.pk)
+        self.assertIn("HTTP 503", failure.last_error)
+
+    def test_rejected_delivery_is_dead_lettered_at_once(self):
+        with override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=False):
+            self.deliver()
+        self.requeue.assert_not_called()
+        self.assertEqual(WebhookFailure.objects.get().attempts, 1)
+
+    @override_settings(WEBHOOK_MAX_CONCURRENCY_PER_KEY=1)
+    def test_busy_key_waits_without_using_an_attempt(self):
+        webhooks.acquire_slot(self.api_key.pk)
+        deliver_webhook("token", self.hook, RESULT, 1)
+        self.requeue.assert_called_once_with(
+            ("token", self.hook, RESULT), {"attempt": 1}, countdown=2
+        )
+        self.assertEqual(self.server.received, [])
+        # the slot is free again once the other delivery is done
+        webhooks.release_slot(self.api_key.pk)
+        self.deliver(attempt=1)
+        self.assertEqual(len(self.server.received), 1)
+
+
+class RegistrationTests(WebhookTestCase):
+    def setUp(self):
+        super().setUp()
+        enqueue = mock.patch.object(webhooks, "enqueue")
+        self.enqueue = enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def test_callbacks_are_taken_once(self):
+        async_to_sync(register_callback)("token", self.hook)
+        self.assertEqual(take_callbacks("token", RESULT), [self.hook])
+        self.assertEqual(take_callbacks("token", RESULT), [])
+        self.enqueue.assert_not_called()
+
+    def test_late_registration_is_delivered_at_once(self):
+        # a follower of a coalesced job that finished meanwhile
+        take_callbacks("token", RESULT)
+        async_to_sync(register_callback)("token", self.hook)
+        self.enqueue.assert_awaited_once_with(
+            webhooks.DELIVER_TASK, "token", self.hook, RESULT
+        )
+        self.assertEqual(take_callbacks("token", RESULT), [])
+
+
+class CallbackSubmissionTests(ConverterTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_conversion("png", "jpeg", FormatType.IMAGE)
+        user = get_user_model().objects.create_user("client", password="x")
+        self.api_key = UserAPIKey.objects.create(user=user, key=generate_api_key())
+        enqueue = mock.patch.object(submission, "enqueue")
+        enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def submit(self, callback_url, **headers):
+        return self.client.post(
+            "/api/converter/convert/",
+            {"file": upload(), "output_format": "jpeg", "callback_url": callback_url},
+            headers=headers,
+        )
+
+    def test_callback_is_registered_for_the_job(self):
+        response = self.submit(
+            "https://client.example/done", authorization=f"Api-Key {self.api_key.key}"
+        )
+        self.assertEqual(response.status_code, 202)
+        token = response.json()["result token"]
+        (hook,) = take_callbacks(token, RESULT)
+        self.assertEqual(hook["url"], "https://client.example/done")
+        self.assertEqual(hook["api_key_id"], self.api_key.pk)
+        self.assertEqual(hook["base_url"], "http://testserver/")
+
+    def test_invalid_callback_url(self):
+        response = self.submit(
+            "ftp://client.example/done", authorization=f"Api-Key {self.api_key.key}"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_session_has_no_key_to_sign_with(self):
+        self.client.force_login(self.api_key.user)
+        response = self.submit("https://client.example/done")
+        self.assertEqual(response.status_code, 400)
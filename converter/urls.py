@@ -21,6 +21,11 @@ urlpatterns = [
         views.ConvertView.as_view(),
         name="convert",
     ),
+    path(
+        "preview/<slug:input_format>/",
+        views.PreviewView.as_view(),
+        name="preview",
+    ),
     path(
         "convert-progress-info/<str:token>/",
         views.ProgressbarView.as_view(),
@@ -31,6 +36,11 @@ urlpatterns = [
         views.ConvertProgressView.as_view(),
         name="convert_progress",
     ),
+    path(
+        "cancel-conversion/<str:token>/",
+        views.CancelConvertView.as_view(),
+        name="cancel_conversion",
+    ),
     path(
         "download-file/<str:token>/",
         views.DownloadFileView.as_view(),
@@ -0,0 +1,14 @@
+from asgiref.sync import sync_to_async
+from celery import current_app
+
+
+async def read_uploaded_file(file):
+    # uploads above FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to disk by django
+    return await sync_to_async(file.read, thread_sensitive=False)()
+
+
+async def enqueue(task_name, *args, **options):
+    # broker publish is blocking network I/O, keep it off the event loop
+    return await sync_to_async(current_app.send_task, thread_sensitive=False)(
+        task_name, args, **options
+    )
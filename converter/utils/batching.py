@@ -0,0 +1,75 @@
+import json
+import os
+import time
+from django.conf import settings
+from .redis_ext_client import redis_client
+
+
+def _queue_key(output_format):
+    return f"docbatch:{output_format}"
+
+
+def _lock_key(output_format):
+    return f"docbatch:lock:{output_format}"
+
+
+def stage_input(token, input_format, file):
+    # the batch may be converted by another worker, inputs go to shared storage
+    path = os.path.join(settings.BATCH_DIR, f"{token}.{input_format}")
+    with open(path, "wb") as f:
+        f.write(file)
+    return path
+
+
+def add_job(output_format, job):
+    key = _queue_key(output_format)
+    redis_client.rpush(key, json.dumps({**job, "staged_at": time.time()}))
+    redis_client.expire(key, settings.WORK_DIR_TTL)
+
+
+def claim_batch(output_format):
+    # held only while gathering, expires if the leader dies before taking
+    return bool(
+        redis_client.set(
+            _lock_key(output_format),
+            1,
+            nx=True,
+            ex=int(settings.DOC_BATCH_WINDOW) + 30,
+        )
+    )
+
+
+def gather_batch(output_format):
+    # waits out the window, or until a full batch is queued
+    deadline = time.monotonic() + settings.DOC_BATCH_WINDOW
+    while redis_client.llen(_queue_key(output_format)) < settings.DOC_BATCH_MAX_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(settings.DOC_BATCH_POLL_INTERVAL, remaining))
+
+
+def take_batch(output_format):
+    # returns the jobs and whether more are waiting; a job added after the
+    # lock is gone either claims the batch itself or is seen as waiting here
+    jobs = redis_client.lpop(_queue_key(output_format), settings.DOC_BATCH_MAX_SIZE)
+    redis_client.delete(_lock_key(output_format))
+    waiting = redis_client.llen(_queue_key(output_format)) > 0
+    return [json.loads(job) for job in jobs or []], waiting
+
+
+def is_expired(job):
+    return job.get("staged_at", time.time()) < time.time() - settings.DOC_BATCH_EXPIRY
+
+
+def stranded_batches():
+    # output formats with jobs waiting but no leader gathering them, the
+    # leader died between claiming and taking the batch
+    stale = time.time() - settings.DOC_BATCH_WINDOW - settings.DOC_BATCH_RECLAIM_AFTER
+    for key in redis_client.scan_iter(match=_queue_key("*"), _type="list"):
+        output_format = key.decode().removeprefix(_queue_key(""))
+        head = redis_client.lindex(key, 0)
+        if head is None or redis_client.exists(_lock_key(output_format)):
+            continue
+        if json.loads(head).get("staged_at", 0) < stale:
+            yield output_format
@@ -1,7 +1,15 @@
 from django.core.cache import cache
-from converter.models import ConverterMap, FileFormat, FormatConversion
+from converter.models import (
+    ConverterMap,
+    EncodingProfile,
+    EncodingProfileName,
+    FileFormat,
+    FormatConversion,
+    ProfilingRule,
+)
 from functools import lru_cache
 import importlib
+from .formats import normalize_format
 
 
 def get_input_choices(category: str):
@@ -37,6 +45,58 @@ def get_output_choices(input_format: str):
     return cache.get_or_set(cache_key, fetch_choices, timeout=3600)
 
 
+def get_format_type(format_name: str):
+    format_name = normalize_format(format_name.lower())
+    cache_key = f"format_type_{format_name}"
+    return cache.get_or_set(
+        cache_key,
+        lambda: FileFormat.objects.filter(name__iexact=format_name)
+        .values_list("file_type", flat=True)
+        .first(),
+        timeout=3600,
+    )
+
+
+def get_encoding_options(input_format, output_format, profile):
+    # empty when the pair has no such profile, the engine defaults apply; a
+    # fast profile is left out where the encoder has nothing faster to offer
+    if not profile:
+        return {}
+    input_format = normalize_format(input_format.lower())
+    output_format = normalize_format(output_format.lower())
+    names = [profile]
+    if profile == EncodingProfileName.FAST:
+        names.append(EncodingProfileName.BALANCED)
+
+    def fetch_options():
+        options = dict(
+            EncodingProfile.objects.filter(
+                conversion__input_format__name__iexact=input_format,
+                conversion__output_format__name__iexact=output_format,
+                name__in=names,
+            ).values_list("name", "options")
+        )
+        return next((options[name] for name in names if name in options), {})
+
+    cache_key = f"encoding_options_{input_format}_{output_format}_{profile}"
+    return cache.get_or_set(cache_key, fetch_options, timeout=3600)
+
+
+def is_inline(input_format, output_format):
+    input_format = normalize_format(input_format.lower())
+    output_format = normalize_format(output_format.lower())
+    cache_key = f"inline_{input_format}_{output_format}"
+    return cache.get_or_set(
+        cache_key,
+        lambda: FormatConversion.objects.filter(
+            input_format__name__iexact=input_format,
+            output_format__name__iexact=output_format,
+            inline=True,
+        ).exists(),
+        timeout=3600,
+    )
+
+
 def get_converter_map(format_type):
     cache_key = f"converter_map_{format_type}"
     converter_map = cache.get(cache_key)
@@ -46,6 +106,21 @@ def get_converter_map(format_type):
     return converter_map
 
 
+def get_profiling_rules():
+    def fetch_rules():
+        rules = ProfilingRule.objects.select_related(
+            "input_format", "output_format"
+        ).filter(enabled=True)
+        # the most specific matching rule decides
+        return sorted(
+            rules,
+            key=lambda rule: (rule.input_format is None) + (rule.output_format is None),
+        )
+
+    # short timeout, rules are toggled from the admin while debugging
+    return cache.get_or_set("profiling_rules", fetch_rules, timeout=60)
+
+
 @lru_cache(maxsize=4)
 def get_converter_class(class_path):
     try:
@@ -0,0 +1,154 @@
+import signal
+import threading
+from contextlib import contextmanager
+from asgiref.sync import sync_to_async
+from celery import current_app, current_task, states
+from celery.result import AsyncResult
+from celery.worker import state as worker_state
+from celery.worker.control import control_command
+from django.conf import settings
+from .errors import Cancelled
+from .followers import async_result_token
+from .redis_ext_client import redis_client, get_async_redis
+
+
+# sent to the pool child running the job, soft time limits use SIGUSR1
+CANCEL_SIGNAL = "SIGUSR2"
+
+CANCELLED = "cancelled"
+# other submissions still wait for the job, it keeps running
+DETACHED = "detached"
+FINISHED = "finished"
+
+
+def _flag_key(task_id):
+    return f"cancelled:{task_id}"
+
+
+def _watchers_key(task_id):
+    return f"watchers:{task_id}"
+
+
+def _pieces_key(task_id):
+    return f"pieces:{task_id}"
+
+
+def _token_key(token):
+    return f"cancel:{token}"
+
+
+async def watch(task_ids, ttl):
+    # one per submission attached to the job, coalesced ones included
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        for task_id in task_ids:
+            pipe.incr(_watchers_key(task_id))
+            pipe.expire(_watchers_key(task_id), ttl)
+        await pipe.execute()
+
+
+def add_pieces(task_id, piece_ids):
+    # tasks the job was split into, cancelled along with it
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.sadd(_pieces_key(task_id), *piece_ids)
+    pipe.expire(_pieces_key(task_id), settings.WORK_DIR_TTL)
+    pipe.execute()
+
+
+def job_pieces(task_id):
+    return [piece.decode() for piece in redis_client.smembers(_pieces_key(task_id))]
+
+
+def is_cancelled(task_id):
+    return bool(task_id) and bool(redis_client.exists(_flag_key(task_id)))
+
+
+async def was_cancelled(task_id):
+    return bool(await get_async_redis().exists(_flag_key(task_id)))
+
+
+def claim_cancelled(task_id):
+    # the job's pieces may be cancelled on several workers, one finishes it
+    return bool(
+        redis_client.set(f"{_flag_key(task_id)}:done", 1, nx=True, ex=settings.FILE_TTL)
+    )
+
+
+async def cancel(token):
+    # stops the job behind the token, with every target it encodes, None for
+    # unknown tokens
+    task_id = await get_async_redis().get(f"conv:{token}")
+    if task_id is None:
+        return None
+    task_id = task_id.decode()
+    if await was_cancelled(task_id):
+        return CANCELLED
+
+    result = AsyncResult(task_id)
+    state = await sync_to_async(lambda: result.state, thread_sensitive=False)()
+    stored = await get_async_redis().exists(f"path:{await async_result_token(token)}")
+    if state in states.READY_STATES or stored:
+        return FINISHED
+    # a repeated cancel of the same submission must not detach another watcher
+    if not await get_async_redis().set(
+        _token_key(token), 1, nx=True, ex=settings.FILE_TTL
+    ):
+        return DETACHED
+    if await get_async_redis().decr(_watchers_key(task_id)) > 0:
+        return DETACHED
+
+    # set first, pieces dispatched after the read below see it when they start
+    await get_async_redis().setex(_flag_key(task_id), settings.FILE_TTL, 1)
+    pieces = [
+        piece.decode()
+        for piece in await get_async_redis().smembers(_pieces_key(task_id))
+    ]
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        for piece in pieces:
+            pipe.setex(_flag_key(piece), settings.FILE_TTL, 1)
+        await pipe.execute()
+    # queued tasks check the flag when they start, running ones are signalled
+    await sync_to_async(current_app.control.broadcast, thread_sensitive=False)(
+        "cancel_jobs", arguments={"task_ids": [task_id, *pieces]}
+    )
+    return CANCELLED
+
+
+@control_command(args=[("task_ids", list)], signature="<task_id> [task_id ...]")
+def cancel_jobs(state, task_ids):
+    # a revoke would also signal tasks that are only reserved, once they start
+    stopped = []
+    for request in list(worker_state.active_requests):
+        if request.id not in task_ids or not request.worker_pid:
+            continue
+        try:
+            state.consumer.pool.terminate_job(
+                request.worker_pid, getattr(signal, CANCEL_SIGNAL)
+            )
+        except NotImplementedError:
+            # threads and solo pools, the job stops once its engine returns
+            break
+        stopped.append(request.id)
+    return {"ok": stopped}
+
+
+def _raise_cancelled(signum, frame):
+    # the job may have ended before the signal arrived, the child moved on
+    if current_task and is_cancelled(current_task.request.id):
+        raise Cancelled()
+
+
+def install_cancel_handler():
+    signal.signal(getattr(signal, CANCEL_SIGNAL), _raise_cancelled)
+
+
+@contextmanager
+def uncancellable():
+    # the signal is dropped, not deferred until the block ends
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    previous = signal.signal(getattr(signal, CANCEL_SIGNAL), signal.SIG_IGN)
+    try:
+        yield
+    finally:
+        signal.signal(getattr(signal, CANCEL_SIGNAL), previous)
@@ -0,0 +1,85 @@
+import math
+import os
+import re
+import subprocess
+from django.conf import settings
+from .errors import EngineUnavailable
+from .scratch import scratch_dir
+
+
+# printed by ffmpeg for every input it can open, N/A when it can't tell
+DURATION = re.compile(rb"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+
+
+def ffmpeg_binary():
+    # the binary moviepy picks, without loading moviepy into the web tier
+    binary = os.getenv("FFMPEG_BINARY", "ffmpeg-imageio")
+    if binary == "ffmpeg-imageio":
+        from imageio_ffmpeg import get_ffmpeg_exe
+
+        try:
+            return get_ffmpeg_exe()
+        except RuntimeError as e:
+            raise EngineUnavailable(f"ffmpeg is not installed: {e}") from e
+    return "ffmpeg" if binary == "auto-detect" else binary
+
+
+def parse_time(value):
+    # seconds, or [hh:]mm:ss with optional fractions
+    if value in (None, ""):
+        return None
+    parts = str(value).strip().split(":")
+    if len(parts) > 3:
+        raise ValueError(f"Invalid time {value}")
+    seconds = 0.0
+    for part in parts:
+        part = float(part)
+        if not math.isfinite(part) or part < 0:
+            raise ValueError(f"Invalid time {value}")
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def probe_duration(file_bin, input_format):
+    # the whole file is needed, mp4 and mov may keep their index at the end;
+    # None when it can't tell, the worker still checks the clip while converting
+    tmp_dir_obj = scratch_dir(len(file_bin))
+    try:
+        input_path = os.path.join(tmp_dir_obj.name, f"input.{input_format}")
+        with open(input_path, "wb") as f:
+            f.write(file_bin)
+        process = subprocess.run(
+            [ffmpeg_binary(), "-hide_banner", "-i", input_path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=settings.PROBE_TIME_LIMIT,
+            check=False,
+        )
+    except (subprocess.TimeoutExpired, EngineUnavailable, OSError):
+        # a slow probe, or a web tier without ffmpeg
+        return None
+    finally:
+        tmp_dir_obj.cleanup()
+    match = DURATION.search(process.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def clip_tag(clip):
+    # tells jobs on different ranges of the same file apart
+    if not clip:
+        return ""
+    end = "end" if clip["end"] is None else f"{clip['end']:g}"
+    return f"{clip['start']:g}-{end}"
+
+
+def input_args(clip):
+    # before -i, ffmpeg seeks in the input and stops reading after the range
+    if not clip:
+        return []
+    args = ["-ss", f"{clip['start']:.3f}"]
+    if clip["end"] is not None:
+        args += ["-t", f"{clip['end'] - clip['start']:.3f}"]
+    return args
@@ -0,0 +1,87 @@
+import gzip
+import zlib
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+CHUNK_SIZE = 64 * 1024
+# content-coding names, the suffix on the stored file records which one it is
+SUFFIXES = {"zstd": ".zst", "br": ".br", "gzip": ".gz"}
+
+
+def _available(encoding):
+    if encoding == "zstd":
+        return zstandard is not None
+    if encoding == "br":
+        return brotli is not None
+    return encoding == "gzip"
+
+
+def result_encoding(output_format):
+    if output_format not in settings.COMPRESSED_RESULT_FORMATS:
+        return None
+    return next((e for e in settings.RESULT_ENCODINGS if _available(e)), None)
+
+
+def compress(data, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    if encoding == "br":
+        return brotli.compress(data, mode=brotli.MODE_TEXT)
+    return gzip.compress(data, mtime=0)
+
+
+def split_encoding(filename):
+    for encoding, suffix in SUFFIXES.items():
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)], encoding
+    return filename, None
+
+
+def accepts(accept_encoding, encoding):
+    # Accept-Encoding with optional q values, q=0 refuses
+    allowed = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            allowed[name.strip().lower()] = quality
+    return allowed.get(encoding, allowed.get("*", 0.0)) > 0
+
+
+def _decompressor(encoding):
+    # returns feed and flush callables for incremental decoding
+    if encoding == "zstd":
+        obj = zstandard.ZstdDecompressor().decompressobj()
+        return obj.decompress, obj.flush
+    if encoding == "br":
+        obj = brotli.Decompressor()
+        return obj.process, lambda: b""
+    obj = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    return obj.decompress, obj.flush
+
+
+def decompress_file(f, encoding, chunk_size=CHUNK_SIZE):
+    feed, flush = _decompressor(encoding)
+    with f:
+        while chunk := f.read(chunk_size):
+            if data := feed(chunk):
+                yield data
+    if tail := flush():
+        yield tail
@@ -1,29 +1,44 @@
 import os
+import shutil
 import subprocess
 import tempfile
 import io
-import pypandoc
-from PIL import Image
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-from moviepy.video.io.VideoFileClip import VideoFileClip
+import math
 from abc import ABC, abstractmethod
-from converter.models import FormatConversion
-
-
-FORMAT_ALIASES = {
-    "jpg": "jpeg",
-    "jpe": "jpeg",
-    "jfif": "jpeg",
-    "tif": "tiff",
-    "bmpf": "bmp",
-    "dib": "bmp",
-    "htm": "html",
-}
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from converter.models import FormatConversion, FormatType
+from .metrics import StageTimer, MULTI_TARGET
+from .formats import normalize_format
+from .failures import is_transient, out_of_memory
+from .limits import get_conversion_limits, run_engine
+from .cache_func import get_encoding_options
+from .scratch import scratch_dir
+from .threads import engine_threads, ffmpeg_threads
+from .clips import ffmpeg_binary, input_args
+from .errors import (
+    ConversionError,
+    BudgetExceeded,
+    EngineUnavailable,
+    InvalidInput,
+    PreviewUnavailable,
+)
+
+
+# the engines are imported on first use, the web process converts small
+# images and texts inline and must not load moviepy and numpy for it
+def open_image(fp):
+    from PIL import Image
+
+    # pillow's decompression bomb check would reject images before they can be
+    # downscaled, ImageConverter checks its own budget from the header
+    Image.MAX_IMAGE_PIXELS = None
+    return Image.open(fp)
 
 
 def get_conversion(input_format, output_format):
-    input_format = FORMAT_ALIASES.get(input_format, input_format)
-    output_format = FORMAT_ALIASES.get(output_format, output_format)
+    input_format = normalize_format(input_format)
+    output_format = normalize_format(output_format)
     conversion = FormatConversion.objects.get(
         input_format__name__iexact=input_format,
         output_format__name__iexact=output_format,
@@ -31,23 +46,137 @@ def get_conversion(input_format, output_format):
     return conversion, output_format
 
 
-class ConversionError(Exception):
-    pass
+def pandoc_path():
+    import pypandoc
+
+    # pypandoc raises a bare OSError when pandoc isn't installed
+    try:
+        return pypandoc.get_pandoc_path()
+    except OSError as e:
+        raise EngineUnavailable(f"pandoc is not installed: {e}") from e
+
+
+# running out of a budget is not a property of the input, don't retry it
+BUDGET_ERRORS = (MemoryError, SoftTimeLimitExceeded, subprocess.TimeoutExpired)
 
 
 class BaseConverter(ABC):
+    engine = None
+    format_type = None
+    # implements split, encode_segment and join
+    segmentable = False
+
+    def __init__(self, **limits):
+        # tighter limits for runs outside the worker, e.g. inline conversions
+        self.limits = {**get_conversion_limits(self.format_type), **limits}
+
     @abstractmethod
-    def convert(self, file, input_format, output_format):
+    def convert(self, file, input_format, output_format, profile=None, clip=None):
         pass
 
+    def convert_many(self, file, input_format, output_formats, profile=None, clip=None):
+        # converters that can share the decode override this
+        return {
+            output_format: self.convert(
+                file, input_format, output_format, profile, clip
+            )
+            for output_format in output_formats
+        }
+
+    def batchable(self, conversion):
+        # whether convert_batch can take this conversion along with others
+        return False
+
+    def fits_inline(self, file, input_format):
+        # checked before converting a small input in the web process
+        return True
+
+    def preview(self, file, input_format, size):
+        raise PreviewUnavailable(f"No preview for {input_format} files")
+
+    def _encode_many(
+        self, file, input_format, output_formats, profile, clip, stream_args
+    ):
+        # one ffmpeg process decodes the input once and feeds every output
+        timer = StageTimer()
+        tmp_dir_obj = None
+        # looked up before the engine runs, these fail the same for any input
+        binary = ffmpeg_binary()
+        streams = {}
+        for output_format in output_formats:
+            conversion, output_format = get_conversion(input_format, output_format)
+            options = get_encoding_options(input_format, output_format, profile)
+            streams[output_format] = stream_args(conversion, options)
+
+        try:
+            with timer.stage("temp_write"):
+                input_path, _, tmp_dir_obj = self._create_temp_dir(
+                    file, input_format, "out"
+                )
+            cmd = [binary, "-v", "error", "-y", *ffmpeg_threads()]
+            cmd += input_args(clip) + ["-i", input_path]
+            outputs = {}
+            for output_format, args in streams.items():
+                path = os.path.join(tmp_dir_obj.name, f"output.{output_format}")
+                cmd += args + ffmpeg_threads(len(streams)) + [path]
+                outputs[output_format] = path
+            with timer.stage("engine"):
+                self._run_engine(cmd)
+            with timer.stage("temp_read"):
+                return {
+                    output_format: self._save_file_for_return(path)
+                    for output_format, path in outputs.items()
+                }
+
+        except Exception as e:
+            raise self._conversion_error(e)
+
+        finally:
+            self._cleanup(tmp_dir_obj)
+            timer.observe(normalize_format(input_format), MULTI_TARGET, self.engine)
+
+    def _trim(self, media, clip):
+        # moviepy's readers seek in the input to the first frame they are asked for
+        if not clip:
+            return media
+        return media.subclipped(clip["start"], clip["end"])
+
+    def _thumbnail(self, img, size):
+        # reducing_gap only speeds up the resize, formats without draft support
+        # are decoded in full and bounded by the pixel budget alone
+        img.thumbnail((size, size), reducing_gap=2.0)
+        result = io.BytesIO()
+        img.convert("RGB").save(result, format="JPEG", quality=settings.PREVIEW_QUALITY)
+        return result.getvalue()
+
+    def _conversion_error(self, e):
+        if isinstance(e, ConversionError):
+            return e
+        if isinstance(e, BUDGET_ERRORS) or out_of_memory(str(e)):
+            return BudgetExceeded(f"Conversion budget exceeded: {e!r}")
+        if is_transient(e):
+            return ConversionError(f"Сonversion failed: {e}")
+        return InvalidInput(f"Сonversion failed: {e}")
+
+    def _cleanup(self, tmp_dir_obj):
+        if tmp_dir_obj is not None:
+            tmp_dir_obj.cleanup()
+
     def _save_file_for_return(self, output_path):
         with open(output_path, "rb") as out_f:
             result = io.BytesIO(out_f.read())
             result.seek(0)
             return result
 
+    def _run_engine(self, cmd, timeout=None):
+        run_engine(
+            cmd,
+            timeout=timeout or self.limits["soft_time_limit"],
+            memory=self.limits["memory"],
+        )
+
     def _create_temp_dir(self, file, input_format, output_format):
-        tmp_dir_obj = tempfile.TemporaryDirectory()
+        tmp_dir_obj = scratch_dir(len(file))
         tmp_dir = tmp_dir_obj.name
         input_path = os.path.join(tmp_dir, f"input.{input_format}")
         output_path = os.path.join(tmp_dir, f"output.{output_format}")
@@ -59,35 +188,149 @@ class BaseConverter(ABC):
 
 
 class ImageConverter(BaseConverter):
-    def convert(self, file, _input_format, output_format):
-        try:
-            file_stream = io.BytesIO(file)
-            file_stream.seek(0)
+    engine = "pillow"
+    format_type = FormatType.IMAGE
 
-            with Image.open(file_stream) as img:
-                img = img.convert("RGB")
+    def convert(self, file, input_format, output_format, profile=None, clip=None):
+        options = get_encoding_options(input_format, output_format, profile)
+        timer = StageTimer()
+        try:
+            with timer.stage("engine"), self._open_image(file) as img:
                 result = io.BytesIO()
-                img.save(result, format=output_format.upper())
+                img.save(result, format=output_format.upper(), **options)
                 result.seek(0)
                 return result
 
         except Exception as e:
-            raise ConversionError(f"Сonversion failed: {e}")
+            raise self._conversion_error(e)
+
+        finally:
+            timer.observe(
+                normalize_format(input_format), output_format.lower(), self.engine
+            )
+
+    def convert_many(self, file, input_format, output_formats, profile=None, clip=None):
+        timer = StageTimer()
+        try:
+            with timer.stage("engine"), self._open_image(file) as img:
+                results = {}
+                for output_format in output_formats:
+                    options = get_encoding_options(input_format, output_format, profile)
+                    result = io.BytesIO()
+                    img.save(result, format=output_format.upper(), **options)
+                    result.seek(0)
+                    results[output_format] = result
+                return results
+
+        except Exception as e:
+            raise self._conversion_error(e)
+
+        finally:
+            timer.observe(normalize_format(input_format), MULTI_TARGET, self.engine)
+
+    def preview(self, file, input_format, size):
+        try:
+            with open_image(io.BytesIO(file)) as img:
+                # jpeg is decoded straight at 1/2 to 1/8 scale
+                img.draft("RGB", (size, size))
+                self._limit_pixels(img, downscale=True)
+                return self._thumbnail(img, size)
+        except Exception as e:
+            raise self._conversion_error(e)
+
+    def fits_inline(self, file, input_format):
+        # a small file may still decode to a large image, the header tells
+        try:
+            with open_image(io.BytesIO(file)) as img:
+                width, height = img.size
+        except Exception:
+            return False
+        return width * height <= settings.INLINE_MAX_PIXELS
+
+    def _pixel_budget(self, img):
+        # the decoded image and its rgb copy while the mode is changed,
+        # pillow keeps multi band pixels in 32 bits
+        mode = img.mode
+        if mode in ("1", "L", "P"):
+            per_pixel = 1
+        elif mode.startswith("I;16"):
+            per_pixel = 2
+        else:
+            per_pixel = 4
+        if mode != "RGB":
+            per_pixel += 4
+        if img.format == "JPEG2000":
+            # openjpeg decodes every component to 32 bit samples first
+            per_pixel += 4 * len(img.getbands())
+        memory = int(self.limits["memory"] * settings.IMAGE_MEMORY_SHARE)
+        return min(settings.IMAGE_MAX_PIXELS, memory // per_pixel)
+
+    def _limit_pixels(self, img, downscale):
+        # size and mode come from the header, nothing is decoded yet
+        width, height = img.size
+        budget = self._pixel_budget(img)
+        if width * height <= budget:
+            return
+        oversize = InvalidInput(
+            f"Image is {width}x{height}, more than the {budget} pixels allowed"
+        )
+        if not downscale:
+            raise oversize
+        factor = 2 ** math.ceil(math.log2(math.sqrt(width * height / budget)))
+        # only these decoders skip resolution levels, others decode in full
+        if img.format == "JPEG" and factor <= 8:
+            img.draft("RGB", (width // factor, height // factor))
+        elif img.format == "JPEG2000":
+            img.reduce = int(math.log2(factor))
+        else:
+            raise oversize
+
+    def _open_image(self, file):
+        img = open_image(io.BytesIO(file))
+        try:
+            self._limit_pixels(img, downscale=settings.IMAGE_DOWNSCALE_OVERSIZE)
+            img.load()
+            if img.mode != "RGB":
+                rgb = img.convert("RGB")
+                # frees the decoded source before encoding starts
+                img.close()
+                img = rgb
+            return img
+        except Exception:
+            img.close()
+            raise
 
 
 class DocConverter(BaseConverter):
-    def convert(self, file, input_format, output_format):
+    format_type = FormatType.DOCUMENT
+    # libreoffice can't open these, they are previewed through html
+    PANDOC_INPUTS = {"markdown", "latex", "epub"}
+
+    def convert(self, file, input_format, output_format, profile=None, clip=None):
         conversion, output_format = get_conversion(input_format, output_format)
         engine = conversion.engine
+        timer = StageTimer()
+        tmp_dir_obj = None
 
         try:
-            input_path, output_path, tmp_dir_obj = self._create_temp_dir(
-                file, input_format, output_format
-            )
+            with timer.stage("temp_write"):
+                input_path, output_path, tmp_dir_obj = self._create_temp_dir(
+                    file, input_format, output_format
+                )
 
             if engine == "pandoc":
-                pypandoc.convert_file(input_path, output_format, outputfile=output_path)
-                result = self._save_file_for_return(output_path)
+                cmd = [
+                    pandoc_path(),
+                    input_path,
+                    "--to",
+                    output_format,
+                    "--output",
+                    output_path,
+                ]
+                with timer.stage("engine"):
+                    self._run_engine(cmd)
+                with timer.stage("temp_read"):
+                    result = self._save_file_for_return(output_path)
             else:
                 cmd = [
                     "libreoffice",
@@ -98,51 +341,183 @@ class DocConverter(BaseConverter):
                     tmp_dir_obj.name,
                     input_path,
                 ]
-                subprocess.run(
-                    cmd,
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
+                with timer.stage("engine"):
+                    self._run_engine(cmd)
                 output_files = [
                     f
                     for f in os.listdir(tmp_dir_obj.name)
                     if f.endswith(f".{output_format.lower()}")
                 ]
+                if not output_files:
+                    # a profile locked by another instance exits quietly too
+                    raise EngineUnavailable(
+                        f"Сonversion failed: libreoffice left no {output_format} output"
+                    )
                 output_path = os.path.join(tmp_dir_obj.name, output_files[0])
-                result = self._save_file_for_return(output_path)
+                with timer.stage("temp_read"):
+                    result = self._save_file_for_return(output_path)
 
             return result
 
         except Exception as e:
-            raise ConversionError(f"Сonversion failed: {e}")
+            raise self._conversion_error(e)
 
         finally:
-            tmp_dir_obj.cleanup()
+            self._cleanup(tmp_dir_obj)
+            timer.observe(
+                normalize_format(input_format),
+                output_format,
+                "pandoc" if engine == "pandoc" else "libreoffice",
+            )
+
+    def batchable(self, conversion):
+        return conversion.engine != "pandoc"
+
+    def convert_batch(self, input_paths, output_format, timeout=None):
+        # one libreoffice start for all files, maps each input path to its
+        # converted file or to the error for that file alone; files left out
+        # got no verdict from a failed run and need a run of their own
+        tmp_dir_obj = scratch_dir(sum(os.path.getsize(p) for p in input_paths))
+        try:
+            cmd = [
+                "libreoffice",
+                "--headless",
+                "--convert-to",
+                output_format,
+                "--outdir",
+                tmp_dir_obj.name,
+                *input_paths,
+            ]
+            try:
+                self._run_engine(cmd, timeout)
+            except SoftTimeLimitExceeded:
+                raise
+            except Exception as e:
+                if len(input_paths) == 1:
+                    return {input_paths[0]: self._conversion_error(e)}
+                # one file took the whole run down or the batch ran out of
+                # time, run by run in this task the rest would run out too
+                return {}
+
+            results = {}
+            for path in input_paths:
+                stem = os.path.splitext(os.path.basename(path))[0]
+                output_path = os.path.join(tmp_dir_obj.name, f"{stem}.{output_format}")
+                if os.path.exists(output_path):
+                    results[path] = self._save_file_for_return(output_path)
+                else:
+                    results[path] = EngineUnavailable(
+                        f"Сonversion failed: no {output_format} output"
+                    )
+            return results
+
+        finally:
+            self._cleanup(tmp_dir_obj)
+
+    def preview(self, file, input_format, size):
+        timeout = settings.PREVIEW_TIME_LIMIT
+        tmp_dir_obj = None
+        try:
+            input_path, _, tmp_dir_obj = self._create_temp_dir(
+                file, input_format, "png"
+            )
+            if normalize_format(input_format) in self.PANDOC_INPUTS:
+                html_path = os.path.join(tmp_dir_obj.name, "preview.html")
+                cmd = [
+                    pandoc_path(),
+                    input_path,
+                    "--standalone",
+                    "--to",
+                    "html",
+                    "--output",
+                    html_path,
+                ]
+                self._run_engine(cmd, timeout)
+                input_path = html_path
+
+            # the png export renders the first page only
+            out_dir = os.path.join(tmp_dir_obj.name, "preview")
+            cmd = [
+                "libreoffice",
+                "--headless",
+                "--convert-to",
+                "png",
+                "--outdir",
+                out_dir,
+                input_path,
+            ]
+            self._run_engine(cmd, timeout)
+            stem = os.path.splitext(os.path.basename(input_path))[0]
+            with open_image(os.path.join(out_dir, f"{stem}.png")) as img:
+                return self._thumbnail(img, size)
+
+        except Exception as e:
+            raise self._conversion_error(e)
+
+        finally:
+            self._cleanup(tmp_dir_obj)
 
 
 class AudioConverter(BaseConverter):
-    def convert(self, file, input_format, output_format):
+    engine = "moviepy"
+    format_type = FormatType.AUDIO
+
+    def convert(self, file, input_format, output_format, profile=None, clip=None):
         conversion, output_format = get_conversion(input_format, output_format)
         codec = conversion.audio_codec
+        options = get_encoding_options(input_format, output_format, profile)
+        timer = StageTimer()
+        tmp_dir_obj = None
 
         try:
-            input_path, output_path, tmp_dir_obj = self._create_temp_dir(
-                file, input_format, output_format
-            )
-            audio = AudioFileClip(input_path)
-            audio.write_audiofile(output_path, codec=codec, logger=None)
-            result = self._save_file_for_return(output_path)
+            from moviepy.audio.io.AudioFileClip import AudioFileClip
+
+            with timer.stage("temp_write"):
+                input_path, output_path, tmp_dir_obj = self._create_temp_dir(
+                    file, input_format, output_format
+                )
+            # closing the clip stops its ffmpeg reader process
+            with timer.stage("engine"), AudioFileClip(input_path) as audio:
+                self._trim(audio, clip).write_audiofile(
+                    output_path,
+                    codec=codec,
+                    bitrate=options.get("audio_bitrate"),
+                    ffmpeg_params=options.get("ffmpeg_params", []) + ffmpeg_threads(),
+                    logger=None,
+                )
+            with timer.stage("temp_read"):
+                result = self._save_file_for_return(output_path)
             return result
 
         except Exception as e:
-            raise ConversionError(f"Сonversion failed: {e}")
+            raise self._conversion_error(e)
 
         finally:
-            tmp_dir_obj.cleanup()
+            self._cleanup(tmp_dir_obj)
+            timer.observe(normalize_format(input_format), output_format, self.engine)
+
+    def _stream_args(self, conversion, options):
+        args = ["-vn"]
+        if conversion.audio_codec:
+            args += ["-c:a", conversion.audio_codec]
+        if options.get("audio_bitrate"):
+            args += ["-b:a", options["audio_bitrate"]]
+        return args + options.get("ffmpeg_params", [])
+
+    def convert_many(self, file, input_format, output_formats, profile=None, clip=None):
+        return self._encode_many(
+            file, input_format, output_formats, profile, clip, self._stream_args
+        )
 
 
 class VideoConverter(BaseConverter):
+    engine = "moviepy"
+    format_type = FormatType.VIDEO
+    segmentable = True
+
+    # in sec, falls back to the first frame for shorter clips
+    PREVIEW_POSITIONS = (1, 0)
+
     def _get_audio_ext(self, acodec):
         return {
             "aac": "m4a",
@@ -153,37 +528,213 @@ class VideoConverter(BaseConverter):
             "wmav2": "wma",
         }.get(acodec)
 
-    def convert(self, file, input_format, output_format):
+    def _encoder_params(self, options):
+        # moviepy has no crf argument, it goes with the raw ffmpeg options
+        params = list(options.get("ffmpeg_params", []))
+        if "crf" in options:
+            params += ["-crf", str(options["crf"])]
+        return params
+
+    def _write_video(
+        self, input_path, output_path, codec, audio_codec, options, clip=None
+    ):
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+
+        encoding = {
+            "codec": codec,
+            "audio_codec": audio_codec,
+            "preset": options.get("preset", "medium"),
+            "bitrate": options.get("video_bitrate"),
+            "audio_bitrate": options.get("audio_bitrate"),
+            "ffmpeg_params": self._encoder_params(options) or None,
+            "threads": engine_threads(),
+            "logger": None,
+        }
+        with VideoFileClip(input_path) as video:
+            video = self._trim(video, clip)
+            ext = self._get_audio_ext(audio_codec)
+
+            if ext:
+                temp_audio_path = f"{os.path.splitext(output_path)[0]}-audio.{ext}"
+                video.write_videofile(
+                    output_path, temp_audiofile=temp_audio_path, **encoding
+                )
+            else:
+                video.write_videofile(output_path, **encoding)
+
+    def _stream_args(self, conversion, options):
+        # same pixel format moviepy writes
+        args = ["-c:v", conversion.video_codec, "-pix_fmt", "yuv420p"]
+        if "preset" in options:
+            args += ["-preset", options["preset"]]
+        if options.get("video_bitrate"):
+            args += ["-b:v", options["video_bitrate"]]
+        if conversion.audio_video_codec:
+            args += ["-c:a", conversion.audio_video_codec]
+            if options.get("audio_bitrate"):
+                args += ["-b:a", options["audio_bitrate"]]
+        return args + self._encoder_params(options)
+
+    def convert_many(self, file, input_format, output_formats, profile=None, clip=None):
+        return self._encode_many(
+            file, input_format, output_formats, profile, clip, self._stream_args
+        )
+
+    def split(self, file, input_format):
+        # returns the work dir and keyframe aligned segments, or None when the
+        # input is not worth spreading across workers
+        if len(file) < settings.VIDEO_SEGMENT_MIN_SIZE:
+            return None
+        work_dir = tempfile.mkdtemp(dir=settings.SEGMENT_DIR)
+        try:
+            input_path = os.path.join(work_dir, f"input.{input_format}")
+            with open(input_path, "wb") as f:
+                f.write(file)
+            from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+            duration = ffmpeg_parse_infos(input_path).get("duration") or 0
+            if duration < settings.VIDEO_SEGMENT_MIN_DURATION:
+                shutil.rmtree(work_dir)
+                return None
+
+            # stream copy, the segment muxer cuts on the next keyframe
+            cmd = [
+                ffmpeg_binary(),
+                "-v",
+                "error",
+                "-i",
+                input_path,
+                "-map",
+                "0:v:0",
+                "-map",
+                "0:a?",
+                "-c",
+                "copy",
+                "-f",
+                "segment",
+                "-segment_time",
+                str(settings.VIDEO_SEGMENT_DURATION),
+                "-reset_timestamps",
+                "1",
+                os.path.join(work_dir, "segment_%04d.mkv"),
+            ]
+            self._run_engine(cmd)
+            os.remove(input_path)
+            segments = sorted(
+                os.path.join(work_dir, name)
+                for name in os.listdir(work_dir)
+                if name.startswith("segment_")
+            )
+            return work_dir, segments
+
+        except Exception as e:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise self._conversion_error(e)
+
+    def encode_segment(self, segment_path, input_format, output_format, profile=None):
+        conversion, output_format = get_conversion(input_format, output_format)
+        # every segment gets the same options, the parts are joined by copying
+        options = get_encoding_options(input_format, output_format, profile)
+        output_path = f"{os.path.splitext(segment_path)[0]}.{output_format}"
+        try:
+            self._write_video(
+                segment_path,
+                output_path,
+                conversion.video_codec,
+                conversion.audio_video_codec,
+                options,
+            )
+            return output_path
+        except Exception as e:
+            raise self._conversion_error(e)
+
+    def join(self, parts, output_path):
+        # parts share codec parameters, the concat demuxer copies the streams
+        list_path = f"{output_path}.txt"
+        try:
+            with open(list_path, "w") as f:
+                f.writelines(f"file '{part}'\n" for part in parts)
+            cmd = [
+                ffmpeg_binary(),
+                "-v",
+                "error",
+                "-y",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                list_path,
+                "-c",
+                "copy",
+                output_path,
+            ]
+            self._run_engine(cmd)
+        except Exception as e:
+            raise self._conversion_error(e)
+
+    def convert(self, file, input_format, output_format, profile=None, clip=None):
         conversion, output_format = get_conversion(input_format, output_format)
         codec = conversion.video_codec
         audio_codec = conversion.audio_video_codec
+        options = get_encoding_options(input_format, output_format, profile)
+        timer = StageTimer()
+        tmp_dir_obj = None
 
         try:
-            input_path, output_path, tmp_dir_obj = self._create_temp_dir(
-                file, input_format, output_format
-            )
-            clip = VideoFileClip(input_path)
-            ext = self._get_audio_ext(audio_codec)
-
-            if ext:
-                temp_audio_path = os.path.join(tmp_dir_obj.name, f"temp-audio.{ext}")
-                clip.write_videofile(
-                    output_path,
-                    codec=codec,
-                    audio_codec=audio_codec,
-                    logger=None,
-                    temp_audiofile=temp_audio_path,
+            with timer.stage("temp_write"):
+                input_path, output_path, tmp_dir_obj = self._create_temp_dir(
+                    file, input_format, output_format
                 )
-            else:
-                clip.write_videofile(
-                    output_path, codec=codec, audio_codec=audio_codec, logger=None
+            with timer.stage("engine"):
+                self._write_video(
+                    input_path, output_path, codec, audio_codec, options, clip
                 )
 
-            result = self._save_file_for_return(output_path)
+            with timer.stage("temp_read"):
+                result = self._save_file_for_return(output_path)
             return result
 
         except Exception as e:
-            raise ConversionError(f"Сonversion failed: {e}")
+            raise self._conversion_error(e)
 
         finally:
-            tmp_dir_obj.cleanup()
+            self._cleanup(tmp_dir_obj)
+            timer.observe(normalize_format(input_format), output_format, self.engine)
+
+    def preview(self, file, input_format, size):
+        tmp_dir_obj = None
+        try:
+            input_path, output_path, tmp_dir_obj = self._create_temp_dir(
+                file, input_format, "jpeg"
+            )
+            for position in self.PREVIEW_POSITIONS:
+                # seeking before -i jumps to the nearest keyframe without
+                # decoding anything in between
+                cmd = [
+                    ffmpeg_binary(),
+                    "-v",
+                    "error",
+                    "-y",
+                    *ffmpeg_threads(),
+                    "-ss",
+                    str(position),
+                    "-i",
+                    input_path,
+                    "-frames:v",
+                    "1",
+                    "-vf",
+                    f"scale={size}:{size}:force_original_aspect_ratio=decrease",
+                    output_path,
+                ]
+                self._run_engine(cmd, settings.PREVIEW_TIME_LIMIT)
+                if os.path.exists(output_path) and os.path.getsize(output_path):
+                    break
+            with open_image(output_path) as img:
+                return self._thumbnail(img, size)
+
+        except Exception as e:
+            raise self._conversion_error(e)
+
+        finally:
+            self._cleanup(tmp_dir_obj)
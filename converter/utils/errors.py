@@ -0,0 +1,30 @@
+# kept free of engine imports, the web tier only needs these
+
+
+class ConversionError(Exception):
+    pass
+
+
+class BudgetExceeded(ConversionError):
+    pass
+
+
+class InvalidInput(ConversionError):
+    # fails the same way for every attempt with this input and format pair
+    pass
+
+
+class EngineUnavailable(ConversionError):
+    # the worker lacks the engine or the engine left no output, the input may
+    # convert fine on another attempt or worker
+    pass
+
+
+class PreviewUnavailable(ConversionError):
+    pass
+
+
+class Cancelled(BaseException):
+    # raised in a worker whose job was cancelled, passes the handlers that
+    # turn exceptions into conversion failures, finally blocks still clean up
+    pass
@@ -0,0 +1,62 @@
+import errno
+import hashlib
+from django.conf import settings
+from .formats import normalize_format
+from .redis_ext_client import redis_client, get_async_redis
+
+
+# a failing system call on the worker, not something wrong with the input
+TRANSIENT_ERRNOS = {
+    errno.EAGAIN,
+    errno.EBUSY,
+    errno.EINTR,
+    errno.EMFILE,
+    errno.ENFILE,
+    errno.ENOMEM,
+    errno.ENOSPC,
+    errno.ENOENT,
+    errno.EACCES,
+    errno.EPIPE,
+    errno.ECONNREFUSED,
+    errno.ECONNRESET,
+    errno.ETIMEDOUT,
+}
+
+
+# what engines print when an allocation fails, e.g. under the memory budget
+OUT_OF_MEMORY = ("cannot allocate memory", "out of memory", "memoryerror", "bad_alloc")
+
+
+def is_transient(e):
+    # library errors about a corrupt or mislabeled input (PIL, moviepy) are
+    # raised as plain exceptions or OSError without an errno
+    return isinstance(e, OSError) and e.errno in TRANSIENT_ERRNOS
+
+
+def out_of_memory(message):
+    message = message.lower()
+    return any(marker in message for marker in OUT_OF_MEMORY)
+
+
+def input_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def input_key(prefix, digest, *formats):
+    pair = ":".join(normalize_format(str(f).lower()) for f in formats)
+    return f"{prefix}:{digest}:{pair}"
+
+
+def remember_failure(digest, input_format, output_format, reason):
+    redis_client.setex(
+        input_key("failed", digest, input_format, output_format),
+        settings.FAILED_INPUT_TTL,
+        reason,
+    )
+
+
+async def known_failure(digest, input_format, output_format):
+    reason = await get_async_redis().get(
+        input_key("failed", digest, input_format, output_format)
+    )
+    return reason.decode() if reason else None
@@ -0,0 +1,27 @@
+from django.conf import settings
+from .redis_ext_client import redis_client, get_async_redis
+
+
+# a submission coalesced into a running job gets a token of its own, so it is
+# watched and cancelled on its own, while the result is stored under the leader's
+
+
+def _lead_key(token):
+    return f"lead:{token}"
+
+
+async def follow(token, leader, task_id):
+    async with get_async_redis().pipeline(transaction=True) as pipe:
+        pipe.setex(f"conv:{token}", settings.FILE_TTL, task_id)
+        pipe.setex(_lead_key(token), settings.FILE_TTL, leader)
+        await pipe.execute()
+
+
+def result_token(token):
+    leader = redis_client.get(_lead_key(token))
+    return leader.decode() if leader else token
+
+
+async def async_result_token(token):
+    leader = await get_async_redis().get(_lead_key(token))
+    return leader.decode() if leader else token
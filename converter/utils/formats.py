@@ -0,0 +1,13 @@
+FORMAT_ALIASES = {
+    "jpg": "jpeg",
+    "jpe": "jpeg",
+    "jfif": "jpeg",
+    "tif": "tiff",
+    "bmpf": "bmp",
+    "dib": "bmp",
+    "htm": "html",
+}
+
+
+def normalize_format(name):
+    return FORMAT_ALIASES.get(name, name)
@@ -0,0 +1,263 @@
+import json
+import math
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from converter.models import ConversionJob, ConversionRollup, JobOutcome
+from users.models import UserAPIKey
+from .cache_func import get_format_type
+from .errors import BudgetExceeded, Cancelled, InvalidInput
+from .redis_ext_client import redis_client, get_async_redis
+
+
+# finished jobs waiting to be written to the database
+FINISHED_KEY = "jobs:finished"
+# the batch being written, and the claim of the flush writing it
+FLUSHING_KEY = "jobs:flushing"
+FLUSH_LOCK_KEY = "jobs:flush:lock"
+
+
+def _job_key(token):
+    return f"job:{token}"
+
+
+async def job_submitted(tokens, input_size, user_id=None, api_key_id=None):
+    # the worker completes the hash, flush_history reads it
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        for token in tokens:
+            pipe.hset(
+                _job_key(token),
+                mapping={
+                    "submitted_at": time.time(),
+                    "input_size": input_size,
+                    "user_id": user_id or "",
+                    "api_key_id": api_key_id or "",
+                },
+            )
+            pipe.expire(_job_key(token), settings.JOB_HISTORY_TTL)
+        await pipe.execute()
+
+
+async def job_withdrawn(token):
+    # submitted but never run, e.g. an inline attempt handed to the queue
+    await get_async_redis().delete(_job_key(token))
+
+
+def job_started(*tokens):
+    # the first attempt counts, later retries are part of the service time
+    pipe = redis_client.pipeline(transaction=False)
+    for token in tokens:
+        pipe.hsetnx(_job_key(token), "started_at", time.time())
+        pipe.expire(_job_key(token), settings.JOB_HISTORY_TTL)
+    pipe.execute()
+
+
+def job_output(token, size):
+    redis_client.hset(_job_key(token), "output_size", size)
+
+
+def job_output_size(token):
+    return _number(redis_client.hget(_job_key(token), "output_size"), int)
+
+
+def outcome_of(error):
+    if error is None:
+        return JobOutcome.SUCCEEDED
+    if isinstance(error, InvalidInput):
+        return JobOutcome.INVALID_INPUT
+    if isinstance(error, BudgetExceeded):
+        return JobOutcome.BUDGET_EXCEEDED
+    if isinstance(error, Cancelled):
+        return JobOutcome.CANCELLED
+    return JobOutcome.FAILED
+
+
+def job_finished(token, task_id, labels, outcome):
+    entry = {
+        "token": token,
+        "task_id": task_id or "",
+        "input_format": labels["input_format"],
+        "output_format": labels["output_format"],
+        "engine": labels["engine"],
+        "outcome": outcome or JobOutcome.FAILED,
+        "finished_at": time.time(),
+    }
+    redis_client.rpush(FINISHED_KEY, json.dumps(entry))
+
+
+def _number(value, cast=float):
+    return cast(value) if value not in (None, "") else None
+
+
+def _build_job(entry, detail):
+    finished = entry["finished_at"]
+    submitted = _number(detail.get("submitted_at"))
+    started = _number(detail.get("started_at"))
+    return ConversionJob(
+        token=entry["token"],
+        task_id=entry["task_id"],
+        format_type=get_format_type(entry["input_format"]) or "",
+        input_format=entry["input_format"],
+        output_format=entry["output_format"],
+        engine=entry["engine"],
+        input_size=_number(detail.get("input_size"), int),
+        output_size=_number(detail.get("output_size"), int),
+        queue_wait=started - submitted if started and submitted else None,
+        service_time=finished - started if started else None,
+        outcome=entry["outcome"],
+        user_id=_number(detail.get("user_id"), int),
+        api_key_id=_number(detail.get("api_key_id"), int),
+        finished_at=datetime.fromtimestamp(finished, tz=timezone.utc),
+    )
+
+
+def _drop_missing_owners(jobs):
+    # users and keys deleted since the job was submitted
+    for field, model in (("user_id", get_user_model()), ("api_key_id", UserAPIKey)):
+        ids = {getattr(job, field) for job in jobs} - {None}
+        if not ids:
+            continue
+        existing = set(model.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        for job in jobs:
+            if getattr(job, field) not in existing:
+                setattr(job, field, None)
+
+
+def _claim_flush():
+    # refreshed per batch, expires if the flush dies
+    return bool(
+        redis_client.set(FLUSH_LOCK_KEY, 1, nx=True, ex=settings.JOB_HISTORY_FLUSH_LOCK)
+    )
+
+
+def _take_entries():
+    # moved aside in one transaction, pushes keep going to the finished list
+    pipe = redis_client.pipeline(transaction=True)
+    for _ in range(settings.JOB_HISTORY_FLUSH_SIZE):
+        pipe.lmove(FINISHED_KEY, FLUSHING_KEY, "LEFT", "RIGHT")
+    return [entry for entry in pipe.execute() if entry is not None]
+
+
+def _write_entries(entries, recovered=False):
+    entries = [json.loads(entry) for entry in entries]
+    pipe = redis_client.pipeline(transaction=False)
+    for entry in entries:
+        pipe.hgetall(_job_key(entry["token"]))
+    details = [
+        {key.decode(): value.decode() for key, value in detail.items()}
+        for detail in pipe.execute()
+    ]
+
+    jobs = [_build_job(entry, detail) for entry, detail in zip(entries, details)]
+    if recovered:
+        # the flush that moved them may have died after inserting
+        written = set(
+            ConversionJob.objects.filter(
+                token__in=[job.token for job in jobs]
+            ).values_list("token", flat=True)
+        )
+        jobs = [job for job in jobs if job.token not in written]
+    _drop_missing_owners(jobs)
+    ConversionJob.objects.bulk_create(jobs)
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(FLUSHING_KEY)
+    pipe.delete(*{_job_key(entry["token"]) for entry in entries})
+    pipe.execute()
+    return len(jobs)
+
+
+def flush_history():
+    # one flush at a time, a batch stays in redis until it is written and a
+    # failed flush is picked up by the next one
+    if not _claim_flush():
+        return 0
+    try:
+        flushed = 0
+        leftover = redis_client.lrange(FLUSHING_KEY, 0, -1)
+        if leftover:
+            flushed += _write_entries(leftover, recovered=True)
+        while entries := _take_entries():
+            redis_client.expire(FLUSH_LOCK_KEY, settings.JOB_HISTORY_FLUSH_LOCK)
+            flushed += _write_entries(entries)
+        return flushed
+    finally:
+        redis_client.delete(FLUSH_LOCK_KEY)
+
+
+def _percentile(values, q):
+    # nearest rank, values are sorted
+    if not values:
+        return None
+    return values[max(math.ceil(q * len(values)) - 1, 0)]
+
+
+def rollup_day(day):
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    rows = (
+        ConversionJob.objects.filter(
+            finished_at__gte=start, finished_at__lt=start + timedelta(days=1)
+        )
+        .order_by()
+        .values_list(
+            "format_type",
+            "input_format",
+            "output_format",
+            "engine",
+            "input_size",
+            "output_size",
+            "queue_wait",
+            "service_time",
+            "outcome",
+        )
+    )
+    groups = defaultdict(list)
+    for row in rows.iterator():
+        groups[row[:4]].append(row[4:])
+
+    rollups = []
+    for (format_type, input_format, output_format, engine), jobs in groups.items():
+        service = sorted(job[3] for job in jobs if job[3] is not None)
+        waits = sorted(job[2] for job in jobs if job[2] is not None)
+        rollups.append(
+            ConversionRollup(
+                day=day,
+                format_type=format_type,
+                input_format=input_format,
+                output_format=output_format,
+                engine=engine,
+                jobs=len(jobs),
+                # a cancelled job didn't fail, it was no longer wanted
+                failures=sum(
+                    job[4] not in (JobOutcome.SUCCEEDED, JobOutcome.CANCELLED)
+                    for job in jobs
+                ),
+                input_bytes=sum(job[0] or 0 for job in jobs),
+                output_bytes=sum(job[1] or 0 for job in jobs),
+                busy_time=sum(service),
+                service_p50=_percentile(service, 0.5),
+                service_p95=_percentile(service, 0.95),
+                service_p99=_percentile(service, 0.99),
+                service_max=service[-1] if service else None,
+                queue_wait_p50=_percentile(waits, 0.5),
+                queue_wait_p95=_percentile(waits, 0.95),
+            )
+        )
+
+    # recomputed as a whole, the day may still be receiving jobs
+    with transaction.atomic():
+        ConversionRollup.objects.filter(day=day).delete()
+        ConversionRollup.objects.bulk_create(rollups)
+    return len(rollups)
+
+
+def prune_history(now):
+    ConversionJob.objects.filter(
+        finished_at__lt=now - timedelta(days=settings.JOB_HISTORY_RETENTION)
+    ).delete()
+    ConversionRollup.objects.filter(
+        day__lt=(now - timedelta(days=settings.JOB_ROLLUP_RETENTION)).date()
+    ).delete()
@@ -0,0 +1,54 @@
+from asgiref.sync import sync_to_async
+from celery import states
+from celery.result import AsyncResult
+from .cancellation import was_cancelled
+from .clips import clip_tag
+from .failures import input_key
+from .redis_ext_client import redis_client, get_async_redis
+
+
+async def _leader_alive(token):
+    task_id = await get_async_redis().get(f"conv:{token}")
+    if not task_id or await was_cancelled(task_id.decode()):
+        return False
+    result = AsyncResult(task_id.decode())
+    state = await sync_to_async(lambda: result.state, thread_sensitive=False)()
+    return state not in (states.FAILURE, states.REVOKED)
+
+
+def _inflight_key(digest, input_format, output_format, profile, clip):
+    # the same file encoded with another profile or range is a different job
+    parts = [input_format, output_format, profile or ""]
+    if clip:
+        parts.append(clip_tag(clip))
+    return input_key("inflight", digest, *parts)
+
+
+async def claim_inflight(
+    digest, input_format, output_format, token, ttl, profile=None, clip=None
+):
+    # returns the token whose job this submission should follow, its own if it
+    # became the leader
+    key = _inflight_key(digest, input_format, output_format, profile, clip)
+    for _ in range(2):
+        if await get_async_redis().set(key, token, nx=True, ex=ttl):
+            return token
+        leader = await get_async_redis().get(key)
+        if leader is None:
+            continue
+        leader = leader.decode()
+        if await _leader_alive(leader):
+            return leader
+        # the leader died without releasing, e.g. killed by the hard time limit;
+        # two submissions racing here may both lead, which only costs a duplicate
+        await get_async_redis().delete(key)
+    return token
+
+
+def release_inflight(
+    digest, input_format, output_format, token, profile=None, clip=None
+):
+    key = _inflight_key(digest, input_format, output_format, profile, clip)
+    leader = redis_client.get(key)
+    if leader is not None and leader.decode() == token:
+        redis_client.delete(key)
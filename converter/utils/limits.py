@@ -0,0 +1,126 @@
+import ctypes
+import os
+import resource
+import signal
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from django.conf import settings
+from .cache_func import get_format_type
+from .errors import BudgetExceeded, EngineUnavailable
+from .failures import out_of_memory
+
+
+DEFAULT_LIMITS = {
+    "soft_time_limit": 300,
+    "time_limit": 360,
+    "memory": 2 * 1024**3,
+}
+PR_SET_PDEATHSIG = 1
+# bytes of an engine's error output kept to tell why it failed
+STDERR_TAIL = 4096
+
+
+def get_conversion_limits(format_type):
+    return {**DEFAULT_LIMITS, **settings.CONVERSION_LIMITS.get(format_type, {})}
+
+
+def task_time_limits(format_type):
+    if not format_type:
+        return {}
+    limits = get_conversion_limits(format_type)
+    return {
+        "soft_time_limit": limits["soft_time_limit"],
+        "time_limit": limits["time_limit"],
+    }
+
+
+def conversion_task_options(input_format):
+    # apply_async options, celery enforces the limits around the whole task
+    return task_time_limits(get_format_type(input_format))
+
+
+def _address_space_size():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize()
+
+
+@contextmanager
+def memory_budget(limit):
+    # caps what this conversion may allocate on top of the worker's current
+    # footprint, inherited by engine subprocesses; the limit is process wide,
+    # so only safe when a process runs one task at a time (prefork pool)
+    current = _address_space_size()
+    if not limit or not settings.CONVERSION_RLIMIT_SELF or current is None:
+        yield
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    budget = current + limit
+    if hard != resource.RLIM_INFINITY:
+        budget = min(budget, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (budget, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def _limit_child(memory):
+    def preexec():
+        if memory:
+            resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        try:
+            # the engine must not outlive a worker killed by the hard time limit
+            libc = ctypes.CDLL("libc.so.6", use_errno=True)
+            libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+        except OSError:
+            pass
+
+    return preexec
+
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def run_engine(cmd, timeout, memory=None):
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=stderr,
+                start_new_session=True,
+                preexec_fn=_limit_child(memory),
+            )
+        except FileNotFoundError as e:
+            raise EngineUnavailable(f"{cmd[0]} is not installed") from e
+        try:
+            returncode = process.wait(timeout=timeout)
+        except BaseException:
+            # timeouts, soft time limits and cancellation, take the whole group down
+            _kill_group(process)
+            raise
+        if not returncode:
+            return
+        stderr.seek(max(os.fstat(stderr.fileno()).st_size - STDERR_TAIL, 0))
+        output = stderr.read().decode(errors="replace")
+
+    if returncode < 0:
+        # killed, not an answer about the input; sigkill is the kernel's oom killer
+        name = signal.Signals(-returncode).name
+        if returncode == -signal.SIGKILL:
+            raise BudgetExceeded(f"{cmd[0]} was killed with {name}")
+        raise EngineUnavailable(f"{cmd[0]} crashed with {name}")
+    if out_of_memory(output):
+        raise BudgetExceeded(f"{cmd[0]} ran out of memory")
+    raise subprocess.CalledProcessError(returncode, cmd, stderr=output)
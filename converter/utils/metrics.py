@@ -0,0 +1,239 @@
+import ipaddress
+import os
+import time
+from contextlib import contextmanager
+from celery.signals import before_task_publish, worker_process_shutdown
+from django.conf import settings
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+
+PAIR_LABELS = ("input_format", "output_format", "engine")
+UNKNOWN = "unknown"
+# output_format label of jobs encoding several targets at once
+MULTI_TARGET = "multi"
+
+# conversions range from milliseconds (small images) to hours (long videos)
+STAGE_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+    900,
+    3600,
+)
+
+STAGE_SECONDS = Histogram(
+    "converter_stage_seconds",
+    "Time spent per conversion stage",
+    ("stage",) + PAIR_LABELS,
+    buckets=STAGE_BUCKETS,
+)
+FAILURES = Counter(
+    "converter_failures",
+    "Failed conversion attempts",
+    PAIR_LABELS + ("error",),
+)
+RETRIES = Counter(
+    "converter_retries",
+    "Conversion attempts scheduled for retry",
+    PAIR_LABELS,
+)
+REJECTIONS = Counter(
+    "converter_rejections",
+    "Uploads rejected before they were queued",
+    ("reason",),
+)
+INLINE_CONVERSIONS = Counter(
+    "converter_inline_conversions",
+    "Small conversions tried in the request, by how they ended",
+    ("outcome",),
+)
+SCRATCH_DIRS = Counter(
+    "converter_scratch_dirs",
+    "Engine scratch dirs created per backing medium",
+    ("medium",),
+)
+# set once per worker when it starts, see utils.threads
+VISIBLE_CPUS = Gauge(
+    "converter_visible_cpus",
+    "CPUs the worker may use, affinity and cgroup quota applied",
+    ("worker",),
+    multiprocess_mode="livemax",
+)
+POOL_CONCURRENCY = Gauge(
+    "converter_pool_concurrency",
+    "Pool children of the worker",
+    ("worker",),
+    multiprocess_mode="livemax",
+)
+ENGINE_THREADS = Gauge(
+    "converter_engine_threads",
+    "Threads each engine run of the worker is given",
+    ("worker",),
+    multiprocess_mode="livemax",
+)
+
+
+class StageTimer:
+    # labels are often known only after the catalog lookup, so durations
+    # are collected first and observed once with the final labels
+    def __init__(self):
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0) + max(seconds, 0)
+
+    def observe(self, input_format=UNKNOWN, output_format=UNKNOWN, engine=UNKNOWN):
+        for name, seconds in self.durations.items():
+            STAGE_SECONDS.labels(
+                stage=name,
+                input_format=input_format,
+                output_format=output_format,
+                engine=engine or UNKNOWN,
+            ).observe(seconds)
+        self.durations = {}
+
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    # wall clock, the worker can be another process or machine
+    headers["enqueued_at"] = time.time()
+
+
+@worker_process_shutdown.connect
+def mark_worker_dead(pid=None, **kwargs):
+    # sent by the pool for every child it replaces, max_memory_per_child too
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def mark_current_process_dead():
+    # web processes, the pool's children exit without running atexit
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prune_dead_processes():
+    # every process leaves its counters in a file named after its pid, the
+    # scrape would merge those of long gone processes forever; the dir is
+    # shared by the web and worker processes of one node, so only files of
+    # processes that are gone are removed
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        return
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        return
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        pid = stem.rsplit("_", 1)[-1]
+        if ext != ".db" or not pid.isdigit() or _alive(int(pid)):
+            continue
+        try:
+            os.remove(os.path.join(path, name))
+        except FileNotFoundError:
+            pass
+
+
+def queue_wait(request):
+    enqueued_at = getattr(request, "enqueued_at", None)
+    if enqueued_at is None:
+        return None
+    return time.time() - float(enqueued_at)
+
+
+class TempDirCollector:
+    # scanned at scrape time, so the values are the same for every process
+    def collect(self):
+        files = GaugeMetricFamily(
+            "converter_temp_dir_files", "Files in TEMP_DIR awaiting download"
+        )
+        size = GaugeMetricFamily(
+            "converter_temp_dir_bytes", "Bytes in TEMP_DIR awaiting download"
+        )
+        count, total = 0, 0
+        try:
+            with os.scandir(settings.TEMP_DIR) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            count += 1
+                            total += entry.stat().st_size
+                    except FileNotFoundError:
+                        continue
+        except OSError:
+            return
+        files.add_metric([], count)
+        size.add_metric([], total)
+        yield files
+        yield size
+
+
+def scrape_allowed(address):
+    # the peer address, a proxy in front of the site scrapes as itself
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network)
+        for network in settings.METRICS_ALLOWED_NETWORKS
+    )
+
+
+def build_registry():
+    # fresh registry per scrape, multiprocess files are merged on collect
+    registry = CollectorRegistry()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        for collector in (
+            STAGE_SECONDS,
+            FAILURES,
+            RETRIES,
+            REJECTIONS,
+            INLINE_CONVERSIONS,
+            SCRATCH_DIRS,
+            VISIBLE_CPUS,
+            POOL_CONCURRENCY,
+            ENGINE_THREADS,
+        ):
+            registry.register(collector)
+    registry.register(TempDirCollector())
+    return registry
@@ -0,0 +1,98 @@
+import threading
+from asgiref.sync import sync_to_async
+from celery.exceptions import TimeoutError as ResultTimeout
+from django.conf import settings
+from converter.models import FormatType
+from .async_files import enqueue
+from .cache_func import get_format_type, get_converter_map, get_converter_class
+from .errors import EngineUnavailable, PreviewUnavailable
+from .failures import input_digest, input_key
+from .formats import normalize_format
+from .redis_ext_client import get_async_redis, redis_client
+
+
+# enqueued by name, importing the tasks would load every conversion engine
+PREVIEW_TASK = "converter.tasks.preview_task"
+
+# image previews rendered at once by this web process, the rest queue up
+_web_slots = threading.BoundedSemaphore(settings.PREVIEW_WEB_CONCURRENCY)
+
+
+def preview_size(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return settings.PREVIEW_SIZE
+    return min(max(size, 16), settings.PREVIEW_MAX_SIZE)
+
+
+def _preview_format_type(input_format):
+    format_type = get_format_type(input_format)
+    if not format_type:
+        raise PreviewUnavailable(f"No preview for {input_format} files")
+    return format_type
+
+
+def render_preview(file, input_format, size):
+    input_format = normalize_format(input_format.lower())
+    converter_map = get_converter_map(_preview_format_type(input_format))
+    converter = get_converter_class(converter_map.class_path)()
+    return converter.preview(file, input_format, size)
+
+
+def store_preview(key, file, input_format, size):
+    preview = render_preview(file, input_format, size)
+    redis_client.setex(key, settings.PREVIEW_TTL, preview)
+    return preview
+
+
+def _render_in_web(key, file_bin, input_format, size):
+    # None when a worker has to render it
+    if not _web_slots.acquire(blocking=False):
+        return None
+    try:
+        return store_preview(key, file_bin, input_format, size)
+    finally:
+        _web_slots.release()
+
+
+def _wait_for_worker(result):
+    try:
+        result.get(timeout=settings.PREVIEW_QUEUE_WAIT)
+    except ResultTimeout:
+        raise EngineUnavailable("Preview is still rendering, try again shortly")
+
+
+async def get_preview(file_bin, input_format, size):
+    digest = await sync_to_async(input_digest, thread_sensitive=False)(file_bin)
+    key = input_key("preview", digest, input_format, size)
+    preview = await get_async_redis().get(key)
+    if preview is not None:
+        return preview
+
+    format_type = await sync_to_async(_preview_format_type)(
+        normalize_format(input_format.lower())
+    )
+    if format_type == FormatType.IMAGE:
+        # pillow decodes within the pixel budget, jpeg reduced while decoding
+        preview = await sync_to_async(_render_in_web, thread_sensitive=False)(
+            key, file_bin, input_format, size
+        )
+        if preview is not None:
+            return preview
+
+    # documents and videos start an engine, that is the workers' job; a worker
+    # finishing after the wait still fills the cache for the next request
+    result = await enqueue(
+        PREVIEW_TASK,
+        key,
+        file_bin,
+        input_format,
+        size,
+        expires=settings.PREVIEW_QUEUE_WAIT,
+    )
+    await sync_to_async(_wait_for_worker, thread_sensitive=False)(result)
+    preview = await get_async_redis().get(key)
+    if preview is None:
+        raise EngineUnavailable("Preview expired before it was read")
+    return preview
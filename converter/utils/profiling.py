@@ -0,0 +1,116 @@
+import cProfile
+import logging
+import marshal
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from converter.models import ConversionProfile, ProfilerMode
+from .cache_func import get_profiling_rules
+
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    # samples the calling thread's stack from a helper thread, so the
+    # profiled code runs untraced and the overhead is one stack walk per tick
+    def __init__(self, interval=None):
+        self.interval = interval or settings.PROFILER_SAMPLE_INTERVAL
+        self.stacks = Counter()
+        self._target = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self):
+        # flamegraph.pl / speedscope collapsed stack format
+        lines = (f"{stack} {count}" for stack, count in self.stacks.most_common())
+        return "\n".join(lines).encode()
+
+
+class DeterministicProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self):
+        # same bytes pstats.Stats.dump_stats would write
+        stats = pstats.Stats(self.profile)
+        return marshal.dumps(stats.stats)
+
+
+PROFILERS = {
+    ProfilerMode.SAMPLING: SamplingProfiler,
+    ProfilerMode.CPROFILE: DeterministicProfiler,
+}
+
+
+class ConversionProfiling:
+    def __init__(self, mode):
+        self.mode = mode
+        self.profiler = PROFILERS[mode]()
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.profiler.start()
+        return self
+
+    def finish(self, token, task_id, labels, succeeded):
+        self.profiler.stop()
+        duration = time.perf_counter() - self.started
+        try:
+            ConversionProfile.objects.create(
+                token=token,
+                task_id=task_id or "",
+                input_format=labels["input_format"],
+                output_format=labels["output_format"],
+                engine=labels["engine"],
+                mode=self.mode,
+                duration=duration,
+                succeeded=succeeded,
+                data=self.profiler.dump(),
+            )
+        except Exception:
+            # profiling must never fail the conversion itself
+            logger.exception("failed to save profile", extra={"token": token})
+
+
+def start_profiling(input_format, output_format):
+    for rule in get_profiling_rules():
+        if not rule.matches(input_format, output_format):
+            continue
+        if random.random() >= rule.sample_rate:
+            return None
+        return ConversionProfiling(rule.mode).start()
+    return None
@@ -1,3 +1,24 @@
+import asyncio
 import redis
+import redis.asyncio as aioredis
 
 redis_client = redis.Redis(host="localhost", port=6379, db=1)
+
+# same db for async views, the loadtest points it at an in-process server
+ASYNC_POOL_OPTIONS = {"host": "localhost", "port": 6379, "db": 1}
+
+_async_clients = {}
+
+
+def get_async_redis():
+    # connections are bound to the loop that opened them, under WSGI every
+    # async view runs on a fresh loop that is closed after the request
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(id(loop))
+    if entry is None or entry[0] is not loop:
+        for key, (other, _) in list(_async_clients.items()):
+            if other.is_closed():
+                _async_clients.pop(key, None)
+        pool = aioredis.ConnectionPool(**ASYNC_POOL_OPTIONS)
+        entry = _async_clients[id(loop)] = (loop, aioredis.Redis(connection_pool=pool))
+    return entry[1]
@@ -0,0 +1,45 @@
+import os
+import tempfile
+from django.conf import settings
+from .metrics import SCRATCH_DIRS
+
+
+def _available_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _used_bytes(directory):
+    # tmpfs usage is shared by every worker on the host, so it is the budget
+    stat = os.statvfs(directory)
+    return (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+
+
+def memory_backed(size):
+    directory = settings.SCRATCH_MEMORY_DIR
+    if not directory or size > settings.SCRATCH_MEMORY_MAX_INPUT:
+        return False
+    # input, output and engine temp files
+    need = size * settings.SCRATCH_MEMORY_FACTOR
+    try:
+        if _used_bytes(directory) + need > settings.SCRATCH_MEMORY_BUDGET:
+            return False
+    except OSError:
+        return False
+    # tmpfs pages are not reclaimable, leave room for the engines themselves
+    available = _available_memory()
+    return available is None or available - need >= settings.SCRATCH_MIN_AVAILABLE
+
+
+def scratch_dir(size):
+    if memory_backed(size):
+        SCRATCH_DIRS.labels(medium="memory").inc()
+        return tempfile.TemporaryDirectory(dir=settings.SCRATCH_MEMORY_DIR)
+    SCRATCH_DIRS.labels(medium="disk").inc()
+    return tempfile.TemporaryDirectory()
@@ -0,0 +1,193 @@
+import struct
+
+
+# enough for every signature below, containers name their content early
+HEAD_SIZE = 4096
+
+# formats without a reliable signature, their content isn't checked
+UNCHECKED = {"tga"}
+TEXT_FORMATS = {"markdown", "latex", "html"}
+# not used by text in any encoding, except tab, newlines, form feed and escape
+CONTROL_BYTES = bytes(sorted(set(range(32)) - {9, 10, 12, 13, 27})) + b"\x7f"
+
+ID3_FORMATS = {"mp3", "aac", "flac"}
+ZIP_FORMATS = {"docx", "odt", "epub"}
+ZIP_MIMETYPES = {
+    b"application/vnd.oasis.opendocument.text": "odt",
+    b"application/epub+zip": "epub",
+}
+
+
+def _png(head):
+    # signature and a complete IHDR with a size
+    if len(head) < 24 or not head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return False
+    if head[12:16] != b"IHDR":
+        return False
+    width, height = struct.unpack(">II", head[16:24])
+    return width > 0 and height > 0
+
+
+def _gif(head):
+    if head[:6] not in (b"GIF87a", b"GIF89a") or len(head) < 10:
+        return False
+    width, height = struct.unpack("<HH", head[6:10])
+    return width > 0 and height > 0
+
+
+def _bmp(head):
+    if not head.startswith(b"BM") or len(head) < 26:
+        return False
+    header_size = struct.unpack("<I", head[14:18])[0]
+    return header_size in (12, 40, 52, 56, 64, 108, 124)
+
+
+def _jpeg(head):
+    return head.startswith(b"\xff\xd8\xff")
+
+
+def _tiff(head):
+    return head[:4] in (b"II*\x00", b"MM\x00*")
+
+
+def _webp(head):
+    return head[:4] == b"RIFF" and head[8:15] == b"WEBPVP8"
+
+
+def _ico(head):
+    return head[:4] == b"\x00\x00\x01\x00" and head[4:6] != b"\x00\x00"
+
+
+def _ppm(head):
+    return head[:1] == b"P" and head[1:2] in b"123456" and head[2:3].isspace()
+
+
+def _pdf(head):
+    # readers accept leading junk, so do we
+    return b"%PDF-" in head[:1024]
+
+
+def _rtf(head):
+    return head.startswith(b"{\\rtf")
+
+
+def _ole(head):
+    return head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1")
+
+
+def _riff(kind):
+    return lambda head: head[:4] in (b"RIFF", b"RF64") and head[8:12] == kind
+
+
+def _mp3(head):
+    # ID3 tag or a MPEG audio frame with a layer set
+    if head.startswith(b"ID3"):
+        return True
+    return len(head) > 1 and head[0] == 0xFF and head[1] & 0xE6 in (0xE2, 0xE4, 0xE6)
+
+
+def _aac(head):
+    # ADTS frames or the rarely used ADIF header
+    if head.startswith(b"ADIF"):
+        return True
+    return len(head) > 1 and head[0] == 0xFF and head[1] & 0xF6 == 0xF0
+
+
+def _isobmff(head):
+    # ftyp comes first, QuickTime files written before it start with a box
+    return head[4:8] in (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip")
+
+
+def _mpeg(head):
+    return head[:4] in (b"\x00\x00\x01\xba", b"\x00\x00\x01\xb3")
+
+
+def _asf(head):
+    return head.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11")
+
+
+# candidates per signature, formats sharing a container are told apart by the engine
+SIGNATURES = (
+    ({"png"}, _png),
+    ({"gif"}, _gif),
+    ({"bmp"}, _bmp),
+    ({"jpeg"}, _jpeg),
+    ({"tiff"}, _tiff),
+    ({"webp"}, _webp),
+    ({"ico"}, _ico),
+    ({"ppm"}, _ppm),
+    ({"pdf"}, _pdf),
+    ({"rtf"}, _rtf),
+    ({"doc"}, _ole),
+    ({"wav"}, _riff(b"WAVE")),
+    ({"avi"}, _riff(b"AVI ")),
+    ({"flac"}, lambda head: head.startswith(b"fLaC")),
+    ({"ogg", "opus", "ogv"}, lambda head: head.startswith(b"OggS")),
+    ({"mp4", "mov", "m4a"}, _isobmff),
+    ({"mkv", "webm"}, lambda head: head.startswith(b"\x1a\x45\xdf\xa3")),
+    ({"wma", "wmv"}, _asf),
+    ({"flv"}, lambda head: head.startswith(b"FLV\x01")),
+    ({"mpeg"}, _mpeg),
+    ({"mp3"}, _mp3),
+    ({"aac"}, _aac),
+)
+
+
+def _id3_end(head):
+    # ID3v2 tags may precede mp3, aac and flac data, the size is syncsafe
+    size = head[6:10]
+    return 10 + sum((byte & 0x7F) << (7 * (3 - i)) for i, byte in enumerate(size))
+
+
+def _zip_formats(head):
+    # odt and epub store their mimetype uncompressed as the first entry
+    name_length, extra_length = struct.unpack("<HH", head[26:30])
+    name = head[30 : 30 + name_length]
+    if name == b"mimetype":
+        start = 30 + name_length + extra_length
+        for mimetype, output_format in ZIP_MIMETYPES.items():
+            if head[start : start + len(mimetype)] == mimetype:
+                return {output_format}
+        return set()
+    if b"[Content_Types].xml" in head or b"word/" in head:
+        return {"docx"}
+    return set(ZIP_FORMATS)
+
+
+def _is_text(head):
+    if b"\x00" in head:
+        return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError:
+        # latin-1, cp1252 and other 8 bit encodings, libreoffice and pandoc
+        # read them too; binary data has control bytes all over
+        controls = len(head) - len(head.translate(None, CONTROL_BYTES))
+        return controls * 100 <= len(head)
+    return True
+
+
+def sniff(head):
+    # formats the content may be in, empty if it matches none of them
+    if head.startswith(b"ID3") and len(head) >= 10:
+        end = _id3_end(head)
+        if end >= len(head):
+            # tag longer than the head, the audio after it is not visible
+            return set(ID3_FORMATS)
+        return sniff(head[end:]) & ID3_FORMATS or set(ID3_FORMATS)
+    if head.startswith(b"PK\x03\x04") and len(head) >= 30:
+        return _zip_formats(head)
+    for formats, matches in SIGNATURES:
+        if matches(head):
+            return set(formats)
+    if head and _is_text(head):
+        return set(TEXT_FORMATS)
+    return set()
+
+
+def content_mismatch(input_format, head):
+    # None if the content may be input_format, else the formats it may be
+    formats = sniff(head)
+    if input_format in formats or (input_format in UNCHECKED and not formats):
+        return None
+    return formats
@@ -0,0 +1,218 @@
+import logging
+import mimetypes
+import os
+import shutil
+import time
+from functools import lru_cache
+from django.conf import settings
+from django.utils.http import content_disposition_header
+from django.utils.module_loading import import_string
+from .compression import split_encoding
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _object_headers(name):
+    filename, encoding = split_encoding(name)
+    content_type, _ = mimetypes.guess_type(filename)
+    headers = {"ContentType": content_type or "application/octet-stream"}
+    if encoding:
+        headers["ContentEncoding"] = encoding
+    return headers
+
+
+class LocalResultStorage:
+    # results on a filesystem shared by web and worker nodes
+    shares_work_dirs = True
+
+    def __init__(self, location=None):
+        self._location = location
+
+    @property
+    def location(self):
+        # read lazily, TEMP_DIR is overridden by the load test
+        return str(self._location or settings.TEMP_DIR)
+
+    def _path(self, name):
+        return os.path.join(self.location, name)
+
+    def save(self, name, fileobj):
+        # written aside first, the result appears complete or not at all
+        path = self._path(name)
+        partial = f"{path}.part"
+        with open(partial, "wb") as f:
+            shutil.copyfileobj(fileobj, f, CHUNK_SIZE)
+        os.replace(partial, path)
+
+    def save_file(self, name, source_path):
+        try:
+            # work dirs live next to the results, usually just a rename
+            os.replace(source_path, self._path(name))
+        except OSError:
+            with open(source_path, "rb") as f:
+                self.save(name, f)
+
+    def open(self, name):
+        return open(self._path(name), "rb")
+
+    def stat(self, name):
+        # size and age in sec, None if the result is gone
+        try:
+            stat = os.stat(self._path(name))
+        except FileNotFoundError:
+            return None
+        return stat.st_size, time.time() - stat.st_mtime
+
+    def url(self, name, filename):
+        # no direct download, the web tier streams the file
+        return None
+
+    def expire(self, max_age):
+        now = time.time()
+        with os.scandir(self.location) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if now - entry.stat().st_mtime <= max_age:
+                    continue
+                try:
+                    os.remove(entry.path)
+                    logger.info("removed expired file", extra={"path": entry.path})
+                except PermissionError:
+                    logger.warning(
+                        "permission denied, skipping", extra={"path": entry.path}
+                    )
+                except FileNotFoundError:
+                    pass
+                except Exception:
+                    logger.exception(
+                        "failed to delete file", extra={"path": entry.path}
+                    )
+
+
+class S3ResultStorage:
+    # results in an S3 compatible bucket, workers and web nodes share nothing else
+    shares_work_dirs = False
+
+    def __init__(
+        self,
+        bucket,
+        prefix="results/",
+        endpoint_url=None,
+        region_name=None,
+        offload_downloads=True,
+        url_expires=300,
+        part_size=8 * 1024 * 1024,
+        **client_options,
+    ):
+        # optional dependency, only needed when this backend is configured
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.offload_downloads = offload_downloads
+        self.url_expires = url_expires
+        self._client = boto3.client(
+            "s3", endpoint_url=endpoint_url, region_name=region_name, **client_options
+        )
+        # parts are read from the file as they are sent, never the whole result
+        self._transfer = TransferConfig(
+            multipart_threshold=part_size, multipart_chunksize=part_size
+        )
+
+    def _key(self, name):
+        return f"{self.prefix}{name}"
+
+    def _missing(self, error):
+        code = error.response.get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def save(self, name, fileobj):
+        # a multipart upload only becomes visible once it is completed
+        self._client.upload_fileobj(
+            fileobj,
+            self.bucket,
+            self._key(name),
+            ExtraArgs=_object_headers(name),
+            Config=self._transfer,
+        )
+
+    def save_file(self, name, source_path):
+        with open(source_path, "rb") as f:
+            self.save(name, f)
+
+    def open(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(name) from e
+            raise
+        return response["Body"]
+
+    def stat(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self._client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+        return head["ContentLength"], time.time() - head["LastModified"].timestamp()
+
+    def url(self, name, filename):
+        if not self.offload_downloads:
+            return None
+        # the client fetches from the bucket, the web tier only redirects
+        return self._client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self._key(name),
+                "ResponseContentDisposition": content_disposition_header(
+                    True, filename
+                ),
+            },
+            ExpiresIn=self.url_expires,
+        )
+
+    def expire(self, max_age):
+        # objects are removed by the bucket lifecycle rule, see configure_lifecycle
+        pass
+
+    def configure_lifecycle(self, days):
+        self._client.put_bucket_lifecycle_configuration(
+            Bucket=self.bucket,
+            LifecycleConfiguration={
+                "Rules": [
+                    {
+                        "ID": "expire-conversion-results",
+                        "Filter": {"Prefix": self.prefix},
+                        "Status": "Enabled",
+                        "Expiration": {"Days": days},
+                        "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 1},
+                    }
+                ]
+            },
+        )
+
+
+@lru_cache(maxsize=1)
+def get_result_storage():
+    config = settings.RESULT_STORAGE
+    return import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+
+
+def work_dirs_shared():
+    # segmented videos and batched documents leave files in SEGMENT_DIR and
+    # BATCH_DIR for whichever worker runs the next step
+    if settings.SHARED_WORK_DIRS is not None:
+        return settings.SHARED_WORK_DIRS
+    return get_result_storage().shares_work_dirs
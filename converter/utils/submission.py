@@ -0,0 +1,337 @@
+import asyncio
+import secrets
+from asgiref.sync import sync_to_async
+from celery.utils import uuid
+from django.conf import settings
+from converter.models import EncodingProfileName, FormatType, JobOutcome
+from .async_files import enqueue
+from .cancellation import watch
+from .cache_func import (
+    get_converter_class,
+    get_converter_map,
+    get_format_type,
+    get_output_choices,
+    is_inline,
+)
+from .clips import parse_time, probe_duration
+from .converters import get_conversion
+from .errors import ConversionError, InvalidInput
+from .failures import input_digest, known_failure, remember_failure
+from .followers import follow
+from .formats import normalize_format
+from .history import (
+    job_finished,
+    job_output,
+    job_started,
+    job_submitted,
+    job_withdrawn,
+)
+from .inflight import claim_inflight, release_inflight
+from .limits import conversion_task_options
+from .metrics import INLINE_CONVERSIONS, REJECTIONS, UNKNOWN
+from .redis_ext_client import get_async_redis
+from .sniffing import HEAD_SIZE, TEXT_FORMATS, sniff, content_mismatch
+from .webhooks import register_callback
+
+
+# enqueued by name, importing the tasks would load every conversion engine
+CONVERT_TASK = "converter.tasks.convert_task"
+CONVERT_MANY_TASK = "converter.tasks.convert_many_task"
+
+
+class Rejected(Exception):
+    def __init__(self, message, status=422):
+        super().__init__(message)
+        self.status = status
+
+
+def _reject(reason, message, status=422):
+    REJECTIONS.labels(reason=reason).inc()
+    return Rejected(message, status)
+
+
+def _check_profile(profile):
+    profile = profile or settings.DEFAULT_ENCODING_PROFILE
+    if profile not in EncodingProfileName.values:
+        raise _reject(
+            "unknown_profile",
+            f"Unknown encoding profile {profile}, "
+            f"choose from {', '.join(EncodingProfileName.values)}",
+        )
+    return profile
+
+
+def _check_upload(head, input_format, output_formats):
+    # cheap checks on the upload itself, before any worker sees it
+    if not input_format:
+        detected = sniff(head)
+        if len(detected) != 1:
+            raise _reject(
+                "unknown_input", "Can't tell the file format, add an extension", 415
+            )
+        input_format = detected.pop()
+    name = normalize_format(input_format.lower())
+    if not get_format_type(name):
+        raise _reject("unknown_input", f"Unsupported input format {input_format}")
+
+    targets = {target for target, _ in get_output_choices(name)}
+    unsupported = [
+        output_format
+        for output_format in output_formats
+        if normalize_format(output_format.lower()) not in targets
+    ]
+    if unsupported:
+        raise _reject(
+            "unsupported_pair",
+            f"{input_format} can't be converted to {', '.join(unsupported)}",
+        )
+
+    formats = content_mismatch(name, head)
+    if formats:
+        found = "text" if formats == TEXT_FORMATS else "/".join(sorted(formats))
+        raise _reject(
+            "content_mismatch",
+            f"The file content is {found.upper()}, not {name.upper()}",
+            415,
+        )
+    if formats is not None:
+        raise _reject(
+            "unrecognised_content", f"This is not a valid {name.upper()} file", 415
+        )
+    return input_format
+
+
+def _requested_clip(input_format, start, end, max_duration):
+    try:
+        start, end, max_duration = map(parse_time, (start, end, max_duration))
+    except ValueError:
+        raise _reject(
+            "invalid_clip", "Start, end and max duration are seconds or [hh:]mm:ss"
+        )
+    if start is None and end is None and max_duration is None:
+        return None
+    if get_format_type(input_format) not in (FormatType.AUDIO, FormatType.VIDEO):
+        raise _reject("invalid_clip", f"{input_format} files can't be trimmed")
+
+    start = start or 0
+    if max_duration is not None:
+        end = start + max_duration if end is None else min(end, start + max_duration)
+    if end is not None and end <= start:
+        raise _reject("invalid_clip", "The clip must end after it starts")
+    return {"start": start, "end": end}
+
+
+async def _check_clip(file_bin, input_format, clip):
+    # probed before enqueueing, an out of range clip would only fail on a worker
+    duration = await sync_to_async(probe_duration, thread_sensitive=False)(
+        file_bin, input_format
+    )
+    if duration is not None:
+        if clip["start"] >= duration:
+            raise _reject(
+                "invalid_clip",
+                f"The clip starts at {clip['start']:g}s, "
+                f"the file is {duration:g}s long",
+            )
+        if clip["end"] is not None and clip["end"] >= duration:
+            clip = {**clip, "end": None}
+    # the whole file, shares its job with untrimmed submissions
+    if not clip["start"] and clip["end"] is None:
+        return None
+    return clip
+
+
+async def _check_known_failures(digest, input_format, output_formats):
+    for output_format in output_formats:
+        reason = await known_failure(digest, input_format, output_format)
+        if reason:
+            raise _reject(
+                "known_failure",
+                f"This file has already failed to convert to {output_format}. "
+                f"{reason}",
+            )
+
+
+def _inline_converter(input_format, output_format):
+    # the converter and the history labels the worker would use
+    conversion, output_format = get_conversion(input_format, output_format)
+    converter_map = get_converter_map(conversion.input_format.file_type)
+    converter_class = get_converter_class(converter_map.class_path)
+    labels = {
+        "input_format": conversion.input_format.name,
+        "output_format": output_format,
+        "engine": conversion.engine or converter_class.engine or UNKNOWN,
+    }
+    return converter_class(soft_time_limit=settings.INLINE_TIME_LIMIT), labels
+
+
+def _render_inline(converter, file_bin, labels, profile, token):
+    # None when the converter won't take the input in the web process
+    if not converter.fits_inline(file_bin, labels["input_format"]):
+        return None
+    job_started(token)
+    return converter.convert(
+        file_bin, labels["input_format"], labels["output_format"], profile
+    ).read()
+
+
+def _finish_inline(token, labels, outcome, output_size=None):
+    if output_size is not None:
+        job_output(token, output_size)
+    job_finished(token, None, labels, outcome)
+
+
+async def convert_inline(
+    file_bin, input_format, output_format, profile=None, user_id=None, api_key_id=None
+):
+    # the converted file, or None when the job has to go through the queue
+    if not settings.INLINE_MAX_SIZE or len(file_bin) > settings.INLINE_MAX_SIZE:
+        return None
+    profile = _check_profile(profile)
+    input_format = await sync_to_async(_check_upload)(
+        file_bin[:HEAD_SIZE], input_format, [output_format]
+    )
+    if not await sync_to_async(is_inline)(input_format, output_format):
+        return None
+    digest = input_digest(file_bin)
+    await _check_known_failures(digest, input_format, [output_format])
+
+    converter, labels = await sync_to_async(_inline_converter)(
+        input_format, output_format
+    )
+    # recorded like a queued job, it counts in the history and the rollups
+    token = secrets.token_urlsafe(16)
+    await job_submitted([token], len(file_bin), user_id, api_key_id)
+    try:
+        result = await asyncio.wait_for(
+            sync_to_async(_render_inline, thread_sensitive=False)(
+                converter, file_bin, labels, profile, token
+            ),
+            settings.INLINE_TIME_LIMIT,
+        )
+    except InvalidInput as e:
+        INLINE_CONVERSIONS.labels(outcome="invalid_input").inc()
+        await sync_to_async(_finish_inline, thread_sensitive=False)(
+            token, labels, JobOutcome.INVALID_INPUT
+        )
+        # a worker would fail the same way
+        await sync_to_async(remember_failure, thread_sensitive=False)(
+            digest, input_format, output_format, str(e)
+        )
+        raise Rejected(str(e))
+    except (asyncio.TimeoutError, ConversionError):
+        # slow or failing for another reason, a run past the time limit
+        # finishes in its thread, bounded by the pixel and engine limits
+        result = None
+    if result is None:
+        INLINE_CONVERSIONS.labels(outcome="fallback").inc()
+        # the queued job is recorded under a token of its own
+        await job_withdrawn(token)
+        return None
+    INLINE_CONVERSIONS.labels(outcome="converted").inc()
+    await sync_to_async(_finish_inline, thread_sensitive=False)(
+        token, labels, JobOutcome.SUCCEEDED, len(result)
+    )
+    return result
+
+
+async def submit_conversions(
+    file_bin,
+    input_format,
+    output_formats,
+    user_id=None,
+    api_key_id=None,
+    callback=None,
+    profile=None,
+    start=None,
+    end=None,
+    max_duration=None,
+):
+    # returns a token per output format, several targets share one decode
+    output_formats = list(dict.fromkeys(output_formats))
+    if len(output_formats) > settings.MAX_CONVERSION_TARGETS:
+        raise _reject(
+            "too_many_targets",
+            f"At most {settings.MAX_CONVERSION_TARGETS} output formats per file",
+        )
+    profile = _check_profile(profile)
+    input_format = await sync_to_async(_check_upload)(
+        file_bin[:HEAD_SIZE], input_format, output_formats
+    )
+    clip = await sync_to_async(_requested_clip)(input_format, start, end, max_duration)
+    if clip:
+        clip = await _check_clip(file_bin, input_format, clip)
+
+    # hashing a large upload takes a while, keep it off the event loop
+    digest = await sync_to_async(input_digest, thread_sensitive=False)(file_bin)
+    await _check_known_failures(digest, input_format, output_formats)
+
+    task_id = uuid()
+    options = await sync_to_async(conversion_task_options)(input_format)
+    # outlives a job running to its hard limit, stale claims are detected anyway
+    ttl = options.get("time_limit", settings.CELERY_TASK_TIME_LIMIT) + settings.FILE_TTL
+    tokens, own, leaders = {}, {}, {}
+    # jobs this submission waits on, a job is cancelled once nobody waits on it
+    watched = set()
+    for output_format in output_formats:
+        token = secrets.token_urlsafe(16)
+        # stored before claiming, followers may poll the token right away
+        await get_async_redis().setex(f"conv:{token}", settings.FILE_TTL, task_id)
+        leader = await claim_inflight(
+            digest, input_format, output_format, token, ttl, profile, clip
+        )
+        if leader == token:
+            own[output_format] = token
+            watched.add(task_id)
+        else:
+            leader_task = await get_async_redis().get(f"conv:{leader}")
+            if leader_task:
+                await follow(token, leader, leader_task)
+                leaders[token] = leader
+                watched.add(leader_task.decode())
+            else:
+                await get_async_redis().delete(f"conv:{token}")
+                token = leader
+        tokens[output_format] = token
+    await watch(watched, ttl)
+
+    if callback:
+        # before the job is enqueued, it can't finish unnoticed
+        for token in tokens.values():
+            if token in leaders:
+                # delivered with the job's result, under this submission's token
+                await register_callback(leaders[token], {**callback, "token": token})
+            else:
+                await register_callback(token, callback)
+
+    if not own:
+        return tokens
+    if len(own) == 1:
+        ((output_format, token),) = own.items()
+        task, args = CONVERT_TASK, (file_bin, input_format, output_format, token)
+    else:
+        task, args = CONVERT_MANY_TASK, (file_bin, input_format, own)
+        # one decode, but every target is encoded
+        options = {name: limit * len(own) for name, limit in options.items()}
+
+    try:
+        await job_submitted(own.values(), len(file_bin), user_id, api_key_id)
+        await enqueue(
+            task,
+            *args,
+            kwargs={"input_hash": digest, "profile": profile, "clip": clip},
+            task_id=task_id,
+            **options,
+        )
+    except Exception:
+        for output_format, token in own.items():
+            await sync_to_async(release_inflight)(
+                digest, input_format, output_format, token, profile, clip
+            )
+        raise
+    return tokens
+
+
+async def submit_conversion(file_bin, input_format, output_format, **owner):
+    tokens = await submit_conversions(file_bin, input_format, [output_format], **owner)
+    return tokens[output_format]
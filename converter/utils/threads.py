@@ -0,0 +1,84 @@
+import logging
+import math
+import os
+from django.conf import settings
+from .metrics import VISIBLE_CPUS, POOL_CONCURRENCY, ENGINE_THREADS
+
+
+logger = logging.getLogger(__name__)
+
+# set by the worker's main process, pool children inherit it
+BUDGET_ENV = "CONVERTER_ENGINE_THREADS"
+# read when numpy's BLAS, OpenMP and libreoffice's thread pool start
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "MAX_CONCURRENCY",
+)
+
+
+def _cgroup_quota():
+    # cpus granted by the cgroup cpu controller, None without a quota
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 else None
+
+
+def visible_cpus():
+    # os.cpu_count() counts the host, not the cpus this process may use
+    cpus = len(os.sched_getaffinity(0))
+    quota = _cgroup_quota()
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(cpus, 1)
+
+
+def thread_budget(cpus, concurrency):
+    if settings.ENGINE_THREADS:
+        return settings.ENGINE_THREADS
+    # every child may run an engine at the same time
+    return max(cpus // max(concurrency, 1), 1)
+
+
+def set_thread_budget(worker, concurrency):
+    cpus = visible_cpus()
+    concurrency = concurrency or cpus
+    threads = thread_budget(cpus, concurrency)
+    os.environ[BUDGET_ENV] = str(threads)
+    for name in THREAD_ENV_VARS:
+        # explicit settings of the deployment win
+        os.environ.setdefault(name, str(threads))
+
+    VISIBLE_CPUS.labels(worker=worker).set(cpus)
+    POOL_CONCURRENCY.labels(worker=worker).set(concurrency)
+    ENGINE_THREADS.labels(worker=worker).set(threads)
+    logger.info(
+        "engine thread budget",
+        extra={"cpus": cpus, "concurrency": concurrency, "threads": threads},
+    )
+    return concurrency, threads
+
+
+def engine_threads():
+    # None outside a worker, the engines pick their own thread count
+    value = os.environ.get(BUDGET_ENV)
+    return int(value) if value else None
+
+
+def ffmpeg_threads(share=1):
+    # share is the number of encoders running side by side in one ffmpeg
+    threads = engine_threads()
+    return ["-threads", str(max(threads // share, 1))] if threads else []
@@ -0,0 +1,75 @@
+import logging
+import shutil
+import subprocess
+import time
+from django.conf import settings
+from django.db import connections
+from converter.models import ConverterMap, FileFormat
+from .cache_func import get_converter_class, get_converter_map, get_format_type
+from .clips import ffmpeg_binary
+from .errors import EngineUnavailable
+
+
+logger = logging.getLogger(__name__)
+
+
+def _load_engines():
+    # the engine stacks, imported once before the pool forks its children,
+    # converters.py itself only imports them on first use
+    import moviepy.audio.io.AudioFileClip  # noqa: F401
+    import moviepy.video.io.VideoFileClip  # noqa: F401
+    import pypandoc  # noqa: F401
+    from PIL import Image
+
+    Image.init()
+
+
+def _start_engines():
+    from .converters import pandoc_path
+
+    # first start of a binary pays for loading it and its libraries from disk
+    commands = [[ffmpeg_binary(), "-hide_banner", "-version"]]
+    try:
+        commands.append([pandoc_path(), "--version"])
+    except EngineUnavailable:
+        pass
+    if shutil.which("libreoffice"):
+        # also creates the user profile, otherwise done by the first document job
+        commands.append(["libreoffice", "--headless", "--terminate_after_init"])
+    for cmd in commands:
+        subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=settings.WORKER_WARMUP_TIMEOUT,
+            check=False,
+        )
+
+
+def _load_catalog():
+    for converter_map in ConverterMap.objects.all():
+        get_converter_map(converter_map.format_type)
+        get_converter_class(converter_map.class_path)
+    for name in FileFormat.objects.values_list("name", flat=True):
+        get_format_type(name)
+
+
+def _timed(stage, step, timings):
+    started = time.perf_counter()
+    try:
+        step()
+    except Exception:
+        logger.exception("worker warm-up step failed", extra={"stage": stage})
+        return False
+    timings[stage] = round(time.perf_counter() - started, 3)
+    return True
+
+
+def warm_up():
+    timings = {}
+    if _timed("engines", _load_engines, timings):
+        _timed("engine_start", _start_engines, timings)
+    _timed("catalog", _load_catalog, timings)
+    # children of a prefork pool must not share the parent's sockets
+    connections.close_all()
+    logger.info("worker warmed up", extra=timings)
@@ -0,0 +1,180 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+from django.conf import settings
+from django.core.validators import URLValidator
+from django.urls import reverse
+from converter.models import JobOutcome, WebhookFailure
+from users.models import UserAPIKey
+from .async_files import enqueue
+from .redis_ext_client import redis_client, get_async_redis
+
+
+# enqueued by name from the web tier, see submission
+DELIVER_TASK = "converter.tasks.deliver_webhook"
+
+validate_callback_url = URLValidator(schemes=["http", "https"])
+
+
+class WebhookError(Exception):
+    pass
+
+
+class WebhookRejected(WebhookError):
+    # retrying would not help
+    pass
+
+
+def _hooks_key(token):
+    return f"hooks:{token}"
+
+
+def _done_key(token):
+    return f"hooks:done:{token}"
+
+
+def callback(url, api_key_id, base_url):
+    # what a submission registers, base_url is where the client reached the api
+    return {"url": url, "api_key_id": api_key_id, "base_url": base_url}
+
+
+async def register_callback(token, hook):
+    entry = json.dumps(hook)
+    async with get_async_redis().pipeline(transaction=True) as pipe:
+        pipe.rpush(_hooks_key(token), entry)
+        pipe.expire(_hooks_key(token), settings.WEBHOOK_REGISTRATION_TTL)
+        pipe.get(_done_key(token))
+        _, _, done = await pipe.execute()
+    # a coalesced job may finish before its follower registered,
+    # whoever removes the entry delivers it
+    if done and await get_async_redis().lrem(_hooks_key(token), 1, entry):
+        await enqueue(DELIVER_TASK, token, hook, json.loads(done))
+
+
+def take_callbacks(token, result):
+    # marks the job done and takes its callbacks in one step, see register_callback
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.setex(_done_key(token), settings.FILE_TTL, json.dumps(result))
+    pipe.lrange(_hooks_key(token), 0, -1)
+    pipe.delete(_hooks_key(token))
+    _, hooks, _ = pipe.execute()
+    return [json.loads(hook) for hook in hooks]
+
+
+def completion(outcome, size):
+    if outcome in (JobOutcome.SUCCEEDED, JobOutcome.CANCELLED):
+        status = outcome
+    else:
+        status = "failed"
+    return {
+        "status": status,
+        "outcome": outcome,
+        "size": size,
+    }
+
+
+def acquire_slot(api_key_id):
+    key = f"hooks:slots:{api_key_id}"
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.incr(key)
+    # a worker killed mid delivery must not hold its slot forever
+    pipe.expire(key, settings.WEBHOOK_TIMEOUT * 3)
+    count, _ = pipe.execute()
+    if count > settings.WEBHOOK_MAX_CONCURRENCY_PER_KEY:
+        redis_client.decr(key)
+        return False
+    return True
+
+
+def release_slot(api_key_id):
+    redis_client.decr(f"hooks:slots:{api_key_id}")
+
+
+def _payload(token, hook, result):
+    payload = {"token": token, **result}
+    if result["status"] == "succeeded":
+        payload["download_url"] = urljoin(
+            hook["base_url"], reverse("converter_api:result", args=[token])
+        )
+    return payload
+
+
+def sign(secret, timestamp, body):
+    # the timestamp is signed too, receivers reject old replays
+    message = f"{timestamp}.".encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def _check_destination(url):
+    if settings.WEBHOOK_ALLOW_PRIVATE_HOSTS:
+        return
+    parts = urlsplit(url)
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or None)
+    except socket.gaierror as e:
+        raise WebhookError(f"Can't resolve {parts.hostname}: {e}") from e
+    for *_, sockaddr in addresses:
+        if not ipaddress.ip_address(sockaddr[0]).is_global:
+            raise WebhookRejected(f"{parts.hostname} is not a public address")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # a redirect could point the signed request anywhere
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def send_webhook(token, hook, result):
+    # a coalesced submission is told under its own token
+    token = hook.get("token", token)
+    api_key = UserAPIKey.objects.filter(pk=hook["api_key_id"]).first()
+    if api_key is None:
+        raise WebhookRejected("The API key the callback was registered with is gone")
+    _check_destination(hook["url"])
+
+    body = json.dumps(_payload(token, hook, result)).encode()
+    timestamp = str(int(time.time()))
+    # signed with the client's API key, rotating the key changes the signature
+    request = urllib.request.Request(
+        hook["url"],
+        data=body,
+        method="POST",
+        headers={
+            "Content-Type": "application/json",
+            "User-Agent": "siteconv-webhooks",
+            "X-Webhook-Token": token,
+            "X-Webhook-Timestamp": timestamp,
+            "X-Webhook-Signature": f"sha256={sign(api_key.key, timestamp, body)}",
+        },
+    )
+    try:
+        with _opener.open(request, timeout=settings.WEBHOOK_TIMEOUT) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        raise WebhookError(f"HTTP {e.code} from {hook['url']}") from e
+    except (urllib.error.URLError, OSError) as e:
+        raise WebhookError(f"Delivery to {hook['url']} failed: {e}") from e
+
+
+def dead_letter(token, hook, result, attempts, error):
+    token = hook.get("token", token)
+    WebhookFailure.objects.create(
+        token=token,
+        url=hook["url"],
+        api_key_id=UserAPIKey.objects.filter(pk=hook["api_key_id"])
+        .values_list("pk", flat=True)
+        .first(),
+        hook=hook,
+        result=result,
+        attempts=attempts,
+        last_error=str(error),
+    )
@@ -1,13 +1,29 @@
 import os
-import time
-import secrets
 from django.shortcuts import render
-from django.http import FileResponse, JsonResponse
+import mimetypes
+from django.http import (
+    FileResponse,
+    JsonResponse,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header
 from django.urls import reverse
-from .utils.cache_func import get_input_choices, get_output_choices
-from .utils.redis_ext_client import redis_client
+from .utils.cache_func import get_format_type, get_input_choices, get_output_choices
+from .utils.redis_ext_client import redis_client, get_async_redis
+from .utils.async_files import read_uploaded_file
+from .utils.cancellation import cancel, was_cancelled, FINISHED
+from .utils.submission import convert_inline, submit_conversion, Rejected
+from .utils.followers import result_token
+from .utils.formats import normalize_format
+from .utils.previews import get_preview, preview_size
+from .utils.errors import ConversionError, EngineUnavailable, PreviewUnavailable
+from .utils.compression import split_encoding, accepts, decompress_file
+from .utils.storage import get_result_storage
 from .forms import ConvertForm, FileForm
-from .tasks import convert_task
 from celery.result import AsyncResult
 from django.conf import settings
 from celery_progress.backend import Progress
@@ -15,6 +31,9 @@ from .models import FormatType
 from django.views.generic.edit import FormView
 from django.views.generic import TemplateView
 from django.views import View
+from asgiref.sync import sync_to_async
+from prometheus_client.exposition import choose_encoder
+from .utils.metrics import build_registry, scrape_allowed
 
 
 class GetTargetFormatView(View):
@@ -88,41 +107,105 @@ class SelectFormatView(FormView):
         return context
 
 
-class ConvertView(FormView):
-    form_class = FileForm
+class ConvertView(View):
+    http_method_names = ["get", "post"]
     template_name = "converter/convert/file_converter.html"
 
-    def dispatch(self, request, *args, **kwargs):
-        self.input_format = kwargs.get("input_format")
-        self.output_format = kwargs.get("output_format")
-        return super().dispatch(request, *args, **kwargs)
-
     def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context.update(
-            {
-                "input_format": self.input_format,
-                "output_format": self.output_format,
-                "MAX_FORM_FILE_SIZE": settings.MAX_FORM_FILE_SIZE,
-            }
-        )
+        context = {
+            "input_format": self.kwargs.get("input_format"),
+            "output_format": self.kwargs.get("output_format"),
+            "MAX_FORM_FILE_SIZE": settings.MAX_FORM_FILE_SIZE,
+        }
+        context.update(kwargs)
         return context
 
-    def form_valid(self, form):
-        file = form.cleaned_data["file"]
-        file_bin = file.read()
-        token = secrets.token_urlsafe(16)
-        task = convert_task.delay(
-            file_bin, self.input_format, self.output_format, token
+    async def get(self, request, *args, **kwargs):
+        format_type = await sync_to_async(get_format_type)(self.kwargs["input_format"])
+        context = self.get_context_data(
+            form=FileForm(),
+            trimmable=format_type in (FormatType.AUDIO, FormatType.VIDEO),
         )
-        redis_client.setex(f"conv:{token}", settings.FILE_TTL, task.id)
+        return await sync_to_async(render)(request, self.template_name, context)
+
+    async def post(self, request, *args, **kwargs):
+        # multipart parsing may spool large uploads to disk
+        form = await sync_to_async(self._bind_form, thread_sensitive=False)(request)
+        if not form.is_valid():
+            return self.form_invalid(form)
+        return await self.form_valid(form)
+
+    def _bind_form(self, request):
+        return FileForm(request.POST, request.FILES)
+
+    async def form_valid(self, form):
+        file = form.cleaned_data["file"]
+        file_bin = await read_uploaded_file(file)
+        # the session user is loaded lazily, from the database
+        user_id = await sync_to_async(lambda: self.request.user.pk)()
+        input_format = self.kwargs.get("input_format")
+        output_format = self.kwargs.get("output_format")
+        profile = form.cleaned_data["profile"] or settings.WEB_ENCODING_PROFILE
+        trim = {"start": form.cleaned_data["start"], "end": form.cleaned_data["end"]}
+        try:
+            if not any(trim.values()):
+                # small files of cheap pairs skip the queue and the progress page
+                result = await convert_inline(
+                    file_bin, input_format, output_format, profile, user_id=user_id
+                )
+                if result is not None:
+                    return self._file_response(result, file.name, output_format)
+            token = await submit_conversion(
+                file_bin,
+                input_format,
+                output_format,
+                user_id=user_id,
+                profile=profile,
+                **trim,
+            )
+        except Rejected as e:
+            return JsonResponse({"error": str(e)}, status=e.status)
         progress_url = reverse("converter:convert_progress_info", args=[token])
         return JsonResponse({"token": token, "redirect_url": progress_url})
 
+    def _file_response(self, result, name, output_format):
+        extension = normalize_format(output_format.lower())
+        filename = f"{os.path.splitext(name)[0]}.{extension}"
+        mime_type, _ = mimetypes.guess_type(filename)
+        response = HttpResponse(
+            result, content_type=mime_type or "application/octet-stream"
+        )
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+        return response
+
     def form_invalid(self, form):
         return JsonResponse({"error": form.errors.as_text()}, status=400)
 
 
+class PreviewView(View):
+    http_method_names = ["post"]
+
+    async def post(self, request, input_format):
+        form = await sync_to_async(self._bind_form, thread_sensitive=False)(request)
+        if not form.is_valid():
+            return JsonResponse({"error": form.errors.as_text()}, status=400)
+
+        file_bin = await read_uploaded_file(form.cleaned_data["file"])
+        size = preview_size(request.GET.get("size"))
+        try:
+            preview = await get_preview(file_bin, input_format, size)
+        except PreviewUnavailable as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except EngineUnavailable as e:
+            return JsonResponse({"error": str(e)}, status=503)
+        except ConversionError as e:
+            return JsonResponse({"error": str(e)}, status=422)
+        return HttpResponse(preview, content_type="image/jpeg")
+
+    def _bind_form(self, request):
+        return FileForm(request.POST, request.FILES)
+
+
 class ProgressbarView(TemplateView):
     template_name = "converter/convert/progress.html"
 
@@ -135,9 +218,9 @@ class ProgressbarView(TemplateView):
 class ConvertProgressView(View):
     http_method_names = ["get"]
 
-    def get(self, request, token, *args, **kwargs):
+    async def get(self, request, token, *args, **kwargs):
         try:
-            task_id = redis_client.get(f"conv:{token}")
+            task_id = await get_async_redis().get(f"conv:{token}")
             if not task_id:
                 return JsonResponse(
                     {
@@ -147,8 +230,20 @@ class ConvertProgressView(View):
                     }
                 )
 
+            # the task may still be stopping, its state lags behind
+            if await was_cancelled(task_id.decode()):
+                return JsonResponse(
+                    {
+                        "complete": True,
+                        "success": False,
+                        "result": "Conversion cancelled",
+                    }
+                )
+
             task_result = AsyncResult(task_id.decode())
-            if task_result.failed():
+            # result backend lookups are blocking redis calls
+            failed = await sync_to_async(task_result.failed, thread_sensitive=False)()
+            if failed:
                 return JsonResponse(
                     {
                         "complete": True,
@@ -157,7 +252,9 @@ class ConvertProgressView(View):
                     }
                 )
 
-            progress_data = Progress(task_result).get_info()
+            progress_data = await sync_to_async(
+                Progress(task_result).get_info, thread_sensitive=False
+            )()
             return JsonResponse(progress_data)
 
         except Exception:
@@ -170,27 +267,77 @@ class ConvertProgressView(View):
             )
 
 
+class CancelConvertView(View):
+    http_method_names = ["post"]
+
+    async def post(self, request, token):
+        outcome = await cancel(token)
+        if outcome is None:
+            return JsonResponse({"result": "Invalid convert token"}, status=404)
+        if outcome == FINISHED:
+            return JsonResponse({"result": "Conversion already finished"}, status=409)
+        return JsonResponse({"result": outcome}, status=202)
+
+
 class DownloadFileView(View):
     http_method_names = ["get"]
 
     def get(self, request, token):
-        temp_path = redis_client.get(f"path:{token}")
-        if not temp_path:
+        name = redis_client.get(f"path:{result_token(token)}")
+        if not name:
             return render(request, "converter/file_not_found.html")
 
-        temp_path = temp_path.decode()
+        # older entries hold a full local path
+        name = os.path.basename(name.decode())
+        storage = get_result_storage()
 
-        if (
-            not os.path.exists(temp_path)
-            or (time.time() - os.path.getmtime(temp_path)) > settings.FILE_TTL
-        ):
+        stat = storage.stat(name)
+        if stat is None or stat[1] > settings.FILE_TTL:
             return render(request, "converter/file_not_found.html")
 
+        filename, encoding = split_encoding(name)
+        decode = encoding and not accepts(
+            request.headers.get("Accept-Encoding", ""), encoding
+        )
+        if not decode and (url := storage.url(name, filename)):
+            return HttpResponseRedirect(url)
+
         try:
-            return FileResponse(
-                open(temp_path, "rb"),
-                as_attachment=True,
-                filename=os.path.basename(temp_path),
-            )
+            if decode:
+                # the client can't decode it, inflate while sending
+                mime_type, _ = mimetypes.guess_type(filename)
+                response = StreamingHttpResponse(
+                    decompress_file(storage.open(name), encoding),
+                    content_type=mime_type or "application/octet-stream",
+                )
+                response["Content-Disposition"] = content_disposition_header(
+                    True, filename
+                )
+            else:
+                response = FileResponse(
+                    storage.open(name),
+                    as_attachment=True,
+                    filename=filename,
+                )
+                # object store bodies are not seekable
+                response.setdefault("Content-Length", stat[0])
+                if encoding:
+                    response["Content-Encoding"] = encoding
         except OSError:
             return render(request, "converter/file_not_found.html")
+
+        if encoding:
+            patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+
+class MetricsView(View):
+    http_method_names = ["get"]
+
+    def get(self, request):
+        if not (
+            scrape_allowed(request.META.get("REMOTE_ADDR", "")) or request.user.is_staff
+        ):
+            return HttpResponseForbidden()
+        encoder, content_type = choose_encoder(request.headers.get("Accept", ""))
+        return HttpResponse(encoder(build_registry()), content_type=content_type)
@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import celeryd_init
 from django.conf import settings
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "siteconv.settings")
@@ -8,9 +9,34 @@ app = Celery("siteconv")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
 
+
+@celeryd_init.connect
+def budget_engine_threads(sender=None, conf=None, options=None, **kwargs):
+    # before the task modules load the engines, they size their pools from the env
+    from converter.utils.threads import set_thread_budget
+
+    options = options or {}
+    concurrency = 1 if options.get("pool") == "solo" else options.get("concurrency")
+    concurrency, _ = set_thread_budget(sender, concurrency)
+    # celery's own default counts the host's cpus, not the container's
+    conf.worker_concurrency = concurrency
+
+
 app.conf.beat_schedule = {
     "cleanup-temp-files": {
         "task": "converter.tasks.cleanup_temp_folder",
         "schedule": crontab(minute=f"*/{settings.FILE_TTL // 60}"),
     },
+    "flush-job-history": {
+        "task": "converter.tasks.flush_job_history",
+        "schedule": crontab(),
+    },
+    "reclaim-doc-batches": {
+        "task": "converter.tasks.reclaim_doc_batches",
+        "schedule": crontab(),
+    },
+    "rollup-job-history": {
+        "task": "converter.tasks.rollup_job_history",
+        "schedule": crontab(minute=5),
+    },
 }
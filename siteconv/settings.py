@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -131,16 +132,187 @@ CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
 CELERY_RESULT_EXPIRES = 300  # 5 min ttl for redis db-0
 # beats
 CELERY_BEAT_SCHEDULER = "celery.beat.PersistentScheduler"
+# fallback limits for tasks enqueued without per format type limits, in sec
+CELERY_TASK_SOFT_TIME_LIMIT = 300
+CELERY_TASK_TIME_LIMIT = 360
+# prefork children are replaced after a task leaves them above this RSS, in KB
+CELERY_WORKER_MAX_MEMORY_PER_CHILD = 1536 * 1024
 
 # temp dir for converted files
 TEMP_DIR = BASE_DIR / "tmp"
 TEMP_DIR.mkdir(exist_ok=True)
+# work dirs of segmented video jobs, shared by every worker that encodes a part
+SEGMENT_DIR = TEMP_DIR / "segments"
+SEGMENT_DIR.mkdir(exist_ok=True)
+# inputs of batched document jobs, shared the same way
+BATCH_DIR = TEMP_DIR / "batches"
+BATCH_DIR.mkdir(exist_ok=True)
 
 # value in sec
 FILE_TTL = 300
+# text results are stored compressed, first installed encoding is used
+COMPRESSED_RESULT_FORMATS = {
+    "html",
+    "markdown",
+    "latex",
+    "rtf",
+    "txt",
+    "svg",
+    "csv",
+    "json",
+    "xml",
+}
+RESULT_ENCODINGS = ("zstd", "br", "gzip")
+# where results wait for download, local disk needs web and workers on one host
+RESULT_STORAGE = {
+    "BACKEND": "converter.utils.storage.LocalResultStorage",
+    "OPTIONS": {},
+}
+# object store instead, endpoint_url points at any S3 compatible server:
+# RESULT_STORAGE = {
+#     "BACKEND": "converter.utils.storage.S3ResultStorage",
+#     "OPTIONS": {"bucket": "conversions", "endpoint_url": "http://localhost:9000"},
+# }
+# lifecycle rule of the bucket, value in days
+RESULT_STORAGE_EXPIRE_DAYS = 1
+# whether SEGMENT_DIR and BATCH_DIR are on a filesystem every worker mounts,
+# video segmenting and document batching are off otherwise; None follows
+# RESULT_STORAGE, shared for local disk and not for an object store
+SHARED_WORK_DIRS = None
+# per format type budget of a single conversion, time in sec, memory in bytes
+CONVERSION_LIMITS = {
+    "image": {"soft_time_limit": 60, "time_limit": 90, "memory": 1024**3},
+    "document": {"soft_time_limit": 120, "time_limit": 180, "memory": 2 * 1024**3},
+    "audio": {"soft_time_limit": 600, "time_limit": 660, "memory": 1024**3},
+    "video": {"soft_time_limit": 3600, "time_limit": 3720, "memory": 4 * 1024**3},
+}
+# largest image decoded at once, also bounded by IMAGE_MEMORY_SHARE of the
+# image memory budget above
+IMAGE_MAX_PIXELS = 100_000_000
+IMAGE_MEMORY_SHARE = 0.5
+# shrink oversize jpeg and jpeg 2000 while decoding instead of rejecting them
+IMAGE_DOWNSCALE_OVERSIZE = True
+# cap the worker's own address space during a conversion, prefork pool only
+CONVERSION_RLIMIT_SELF = True
+# output formats a single multi-target job may encode
+MAX_CONVERSION_TARGETS = 8
+# transient failures are retried after 10, 20, 40 sec
+CONVERSION_MAX_RETRIES = 3
+CONVERSION_RETRY_BACKOFF = 10
+# how long an input that failed on its own is rejected for the same pair, in sec
+FAILED_INPUT_TTL = 24 * 60 * 60
+# videos of at least this size in bytes are probed, and split into segments
+# encoded in parallel when they also run at least this long, in sec
+VIDEO_SEGMENT_MIN_SIZE = 256 * 1024 * 1024
+VIDEO_SEGMENT_MIN_DURATION = 10 * 60
+# value in sec
+VIDEO_SEGMENT_DURATION = 120
+# libreoffice document jobs are gathered per target format for this long and
+# converted in one engine start, value in sec, 0 disables batching
+DOC_BATCH_WINDOW = 0.2
+DOC_BATCH_MAX_SIZE = 16
+# the leader stops waiting once a full batch is queued, checked this often, in sec
+DOC_BATCH_POLL_INTERVAL = 0.02
+# kept from the leader's time limit to store the batch's results, value in sec
+DOC_BATCH_FINISH_TIME = 10
+# jobs of a leader that died before taking them are handed to another worker
+# after this long, and failed once staged for longer than the expiry, in sec
+DOC_BATCH_RECLAIM_AFTER = 30
+DOC_BATCH_EXPIRY = 10 * 60
+# leftovers of segmented and batched jobs that never finished, value in sec
+WORK_DIR_TTL = 6 * 60 * 60
+# engine scratch dirs of inputs up to this many bytes go to tmpfs, None disables
+SCRATCH_MEMORY_DIR = "/dev/shm"
+SCRATCH_MEMORY_MAX_INPUT = 16 * 1024 * 1024
+# tmpfs bytes in use on the host above which scratch dirs fall back to disk,
+# a job counts as input size times the factor
+SCRATCH_MEMORY_BUDGET = 512 * 1024 * 1024
+SCRATCH_MEMORY_FACTOR = 3
+# available memory a job must leave, in bytes
+SCRATCH_MIN_AVAILABLE = 1024 * 1024 * 1024
+# preview thumbnails, longest edge in px
+PREVIEW_SIZE = 320
+PREVIEW_MAX_SIZE = 1024
+PREVIEW_QUALITY = 80
+# value in sec
+PREVIEW_TIME_LIMIT = 15
+PREVIEW_TTL = 60 * 60
+# image previews rendered at once in each web process, documents, videos and
+# images past this go through the worker queue
+PREVIEW_WEB_CONCURRENCY = 2
+# value in sec, how long a request waits for a worker to render its preview
+PREVIEW_QUEUE_WAIT = 30
+# ingest probe of audio and video durations for trimmed submissions, in sec
+PROBE_TIME_LIMIT = 15
+# inputs up to this many bytes of pairs marked inline are converted in the
+# request instead of the queue, None disables
+INLINE_MAX_SIZE = 256 * 1024
+# value in sec, inline conversions running longer go through the queue
+INLINE_TIME_LIMIT = 2
+# small files may still decode to large images
+INLINE_MAX_PIXELS = 4_000_000
+# job history, value in sec until an unfinished job's details are dropped
+JOB_HISTORY_TTL = 24 * 60 * 60
+# finished jobs written per insert
+JOB_HISTORY_FLUSH_SIZE = 500
+# value in sec, a flush that died is taken over once its claim expires
+JOB_HISTORY_FLUSH_LOCK = 60
+# values in days, jobs are rolled up per day and pair before they are deleted
+JOB_HISTORY_RETENTION = 14
+JOB_ROLLUP_RETENTION = 400
+# encoding profile of api submissions that name none, and of the web form
+DEFAULT_ENCODING_PROFILE = "balanced"
+WEB_ENCODING_PROFILE = "fast"
+# completion webhooks, value in sec a callback stays registered for its job
+WEBHOOK_REGISTRATION_TTL = 24 * 60 * 60
+# value in sec, per delivery attempt
+WEBHOOK_TIMEOUT = 10
+# attempts before a delivery is dead-lettered, backoff doubles after each
+WEBHOOK_MAX_ATTEMPTS = 6
+# value in sec
+WEBHOOK_RETRY_BACKOFF = 30
+# deliveries in flight per API key, the rest wait
+WEBHOOK_MAX_CONCURRENCY_PER_KEY = 4
+# value in sec
+WEBHOOK_THROTTLE_DELAY = 2
+# callbacks to loopback and private networks, for local development only
+WEBHOOK_ALLOW_PRIVATE_HOSTS = False
+# threads per engine run, None divides the worker's cpus among its pool children
+ENGINE_THREADS = None
+# preload engines and the format catalog when a worker starts
+WORKER_WARMUP = True
+# value in sec, per engine started during warm-up
+WORKER_WARMUP_TIMEOUT = 60
+# stack sampling interval of the on-demand profiler, value in sec
+PROFILER_SAMPLE_INTERVAL = 0.005
 # value in bytes
 MAX_FORM_FILE_SIZE = 1024 * 1024 * 1024  # 1 GB
 
+# prometheus multiprocess mode, shared by web and worker processes of a node
+METRICS_DIR = BASE_DIR / "metrics"
+METRICS_DIR.mkdir(exist_ok=True)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", str(METRICS_DIR))
+# networks /metrics/ is scraped from, staff users may view it from anywhere
+METRICS_ALLOWED_NETWORKS = ["127.0.0.1/32", "::1/128"]
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "converter.utils.log_format.JsonFormatter"},
+    },
+    "handlers": {
+        "json_console": {"class": "logging.StreamHandler", "formatter": "json"},
+    },
+    "loggers": {
+        "converter": {
+            "handlers": ["json_console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
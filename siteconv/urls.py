@@ -18,6 +18,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
+from converter.views import MetricsView
 
 
 urlpatterns = [
@@ -27,4 +28,5 @@ urlpatterns = [
     path("api/converter/", include("converter.api.urls", namespace="converter_api")),
     path("users/", include("users.urls", namespace="users")),
     path("api-key/", include("users.api.urls", namespace="api_key")),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
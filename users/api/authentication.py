@@ -22,4 +22,5 @@ class APIKeyAuthentication(BaseAuthentication):
         except UserAPIKey.DoesNotExist:
             raise AuthenticationFailed("Invalid API key")
 
-        return (key_obj.user, None)
+        # the key becomes request.auth, conversions are attributed to it
+        return (key_obj.user, key_obj)